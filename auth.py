@@ -0,0 +1,270 @@
+"""Password hashing, signed session tokens and the login rate limiter.
+
+Passwords are stored as werkzeug scrypt hashes. The cost is set with
+LIBRARY_PASSWORD_COST, as log2 of N (default 14, i.e. 16 MiB and tens of
+milliseconds per hash). Hashing and verifying run on a small dedicated
+pool of LIBRARY_KDF_WORKERS threads (default 2). A burst of logins
+therefore keeps at most that many cores busy, instead of one per request
+thread. Once more than LIBRARY_KDF_QUEUE jobs are waiting, new ones fail
+fast with KDFBusy rather than queueing without bound. A caller that waits
+longer than KDF_TIMEOUT seconds also gets KDFBusy, while its job keeps
+its slot until it finishes.
+
+A login for an unknown email is checked against a dummy hash, so it
+takes as long as a wrong password and the response doesn't tell which
+emails have accounts.
+
+Rows written before hashing still hold plaintext. Those are compared in
+constant time and re-hashed on the user's next successful login.
+
+Sessions are stateless tokens signed with LIBRARY_SECRET_KEY that carry
+the user id, role and subscription flag. Clients send them as
+`Authorization: Bearer <token>`. Checking one costs an HMAC and no
+database read, so login_required() decides who may call an endpoint
+without looking the user up. Without a configured key a random one is generated,
+which means tokens don't survive a restart and aren't shared between
+server workers.
+
+EventSource can't send headers, so the change stream takes a stream
+token in its query string instead. issue_stream_token() signs one for
+the current session; it carries the same user id and role but is only
+accepted by the stream, for LIBRARY_STREAM_TOKEN_TTL seconds (default
+600), so a token leaked through a URL in a log is of little use.
+"""
+
+import logging
+import os
+import secrets
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+from functools import wraps
+
+from flask import g, jsonify, request
+from itsdangerous import BadSignature, SignatureExpired, URLSafeTimedSerializer
+from werkzeug.security import check_password_hash, generate_password_hash
+
+PASSWORD_COST = int(os.environ.get("LIBRARY_PASSWORD_COST", "14"))
+KDF_WORKERS = int(os.environ.get("LIBRARY_KDF_WORKERS", "2"))
+KDF_QUEUE = int(os.environ.get("LIBRARY_KDF_QUEUE", "64"))
+KDF_TIMEOUT = 10
+SESSION_TTL = int(os.environ.get("LIBRARY_SESSION_TTL", str(7 * 24 * 3600)))
+STREAM_TOKEN_TTL = int(os.environ.get("LIBRARY_STREAM_TOKEN_TTL", "600"))
+
+# Login attempts: a burst, then a steady refill in attempts per second
+LOGIN_EMAIL_BURST = float(os.environ.get("LIBRARY_LOGIN_EMAIL_BURST", "5"))
+LOGIN_EMAIL_RATE = float(os.environ.get("LIBRARY_LOGIN_EMAIL_RATE", "0.1"))
+LOGIN_IP_BURST = float(os.environ.get("LIBRARY_LOGIN_IP_BURST", "20"))
+LOGIN_IP_RATE = float(os.environ.get("LIBRARY_LOGIN_IP_RATE", "1"))
+
+HASH_METHOD = f"scrypt:{2 ** PASSWORD_COST}:8:1"
+HASH_PREFIXES = ("scrypt:", "pbkdf2:")
+
+logger = logging.getLogger("library.auth")
+
+
+class KDFBusy(Exception):
+    """Too many hashing jobs are already waiting"""
+
+
+class KDFPool:
+    """Bounded executor for password hashing"""
+
+    def __init__(self, workers=KDF_WORKERS, max_pending=KDF_QUEUE):
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="library-kdf")
+        self.slots = threading.BoundedSemaphore(workers + max_pending)
+
+    def run(self, fn, *args):
+        if not self.slots.acquire(blocking=False):
+            raise KDFBusy()
+        try:
+            future = self.executor.submit(fn, *args)
+        except BaseException:
+            self.slots.release()
+            raise
+        # Released when the job is done, not when the caller gives up on it
+        future.add_done_callback(lambda _: self.slots.release())
+        try:
+            return future.result(timeout=KDF_TIMEOUT)
+        except TimeoutError:
+            raise KDFBusy() from None
+
+
+kdf_pool = KDFPool()
+
+
+def is_hashed(stored):
+    return bool(stored) and stored.startswith(HASH_PREFIXES)
+
+
+def hash_password(password):
+    return kdf_pool.run(generate_password_hash, password, HASH_METHOD)
+
+
+def verify_password(stored, password):
+    """Check a password against its stored value. Returns (ok, new_hash),
+    where new_hash is set when the stored value should be replaced"""
+    if not stored or password is None:
+        return False, None
+    if not is_hashed(stored):
+        ok = secrets.compare_digest(stored.encode(), str(password).encode())
+        return ok, hash_password(password) if ok else None
+    ok = kdf_pool.run(check_password_hash, stored, password)
+    if ok and not stored.startswith(HASH_METHOD + "$"):
+        # Hashed with an older cost setting
+        return ok, hash_password(password)
+    return ok, None
+
+
+_dummy_hash = None
+
+
+def verify_unknown(password):
+    """Spend the time of a password check on an account that doesn't
+    exist. Always False."""
+    global _dummy_hash
+    if _dummy_hash is None:
+        _dummy_hash = hash_password(secrets.token_hex(16))
+    kdf_pool.run(check_password_hash, _dummy_hash, str(password))
+    return False
+
+
+class TokenBucket:
+    """Per-key token buckets kept in memory"""
+
+    def __init__(self, burst, rate, max_keys=100000):
+        self.burst = burst
+        self.rate = rate
+        self.max_keys = max_keys
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def take(self, key):
+        """Spend one token for `key`. Returns 0 if allowed, otherwise the
+        seconds until the next token is available."""
+        now = time.monotonic()
+        with self._lock:
+            tokens, stamp = self._buckets.get(key, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - stamp) * self.rate)
+            if tokens < 1:
+                self._buckets[key] = (tokens, now)
+                return (1 - tokens) / self.rate
+            self._buckets[key] = (tokens - 1, now)
+            if len(self._buckets) > self.max_keys:
+                self._evict(now)
+            return 0
+
+    def _evict(self, now):
+        # Buckets that have refilled completely carry no state
+        for key, (tokens, stamp) in list(self._buckets.items()):
+            if tokens + (now - stamp) * self.rate >= self.burst:
+                del self._buckets[key]
+
+
+email_limiter = TokenBucket(LOGIN_EMAIL_BURST, LOGIN_EMAIL_RATE)
+ip_limiter = TokenBucket(LOGIN_IP_BURST, LOGIN_IP_RATE)
+
+
+def login_retry_after(email):
+    """Seconds the caller must wait before another login attempt, or 0"""
+    return max(
+        ip_limiter.take(request.remote_addr or ""),
+        email_limiter.take((email or "").strip().lower()),
+    )
+
+
+_secret = None
+_serializers = {}
+_serializer_lock = threading.Lock()
+
+
+def serializer(salt="library-session"):
+    global _secret
+    # Locked so concurrent first calls can't each generate a random key
+    with _serializer_lock:
+        if salt not in _serializers:
+            if _secret is None:
+                _secret = os.environ.get("LIBRARY_SECRET_KEY")
+                if not _secret:
+                    logger.warning("LIBRARY_SECRET_KEY is not set; session tokens will not survive a restart")
+                    _secret = secrets.token_hex(32)
+            _serializers[salt] = URLSafeTimedSerializer(_secret, salt=salt)
+    return _serializers[salt]
+
+
+def issue_token(user):
+    return serializer().dumps(
+        {"uid": user["user_id"], "role": user["role"], "sub": user["is_subscribed"]}
+    )
+
+
+def issue_stream_token():
+    """A change stream token for the current session"""
+    session = current_session()
+    return serializer("library-stream").dumps({"uid": session["uid"], "role": session["role"]})
+
+
+def stream_session(token):
+    """The payload of a stream token, or None if it is missing, forged or
+    expired"""
+    if not token:
+        return None
+    try:
+        return serializer("library-stream").loads(token, max_age=STREAM_TOKEN_TTL)
+    except (BadSignature, SignatureExpired):
+        return None
+
+
+def current_session():
+    """The verified token payload of the current request, or None"""
+    if "session" not in g:
+        header = request.headers.get("Authorization", "")
+        token = header[7:] if header.startswith("Bearer ") else None
+        g.session = None
+        if token:
+            try:
+                g.session = serializer().loads(token, max_age=SESSION_TTL)
+            except (BadSignature, SignatureExpired):
+                pass
+    return g.session
+
+
+def is_admin():
+    session = current_session()
+    return session is not None and session.get("role") == "admin"
+
+
+def may_act_for(user_id):
+    """Whether the current session may read or act on `user_id`'s data:
+    its own, or anyone's for an admin"""
+    session = current_session()
+    if session is None:
+        return False
+    if session.get("role") == "admin":
+        return True
+    try:
+        return int(user_id) == session.get("uid")
+    except (TypeError, ValueError):
+        return False
+
+
+def login_required(role=None, owner=None):
+    """Reject requests without a valid session token (or the wrong role).
+    With owner set to the name of a view argument holding a user id, only
+    that user or an admin gets through."""
+
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            session = current_session()
+            if session is None:
+                return jsonify({"error": "Authentication required"}), 401
+            if role and session.get("role") != role:
+                return jsonify({"error": "Forbidden"}), 403
+            if owner and not may_act_for(kwargs.get(owner)):
+                return jsonify({"error": "Forbidden"}), 403
+            return view(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
@@ -1,11 +1,28 @@
+import io
+import os
+import re
 import sqlite3
+import base64
 import logging
 from datetime import datetime, timedelta
-from flask import Flask, request, jsonify, g, json
+from flask import Flask, request, jsonify, json
 from flask_cors import CORS
+import auth
+import changes
+import metrics
+import recommend
+import scheduler
+from importer import import_books, read_rows
+from http_cache import conditional, response_cache
+from streaming import stream_rows
 from database import (
+    connect,
     get_db,
+    get_lookup_names,
     init_db,
+    lookup_cache,
+    release_db,
+    write_transaction,
     get_or_create_id,
     insert_book_authors,
     insert_book_keywords,
@@ -14,19 +31,24 @@ from database import (
 app = Flask(__name__)
 CORS(app)
 logging.basicConfig(level=logging.DEBUG)
+metrics.init_app(app)
+changes.init_app(app)
 
 with app.app_context():
     init_db()
 
+    warm_conn = connect()
+    lookup_cache.warm(warm_conn)
+    warm_conn.close()
+
 
 @app.teardown_appcontext
 def close_db(exception):
-    db = g.pop("db", None)
-    if db is not None:
-        db.close()
+    release_db(exception)
 
 
 @app.route("/api/books", methods=["POST"])
+@auth.login_required(role="admin")
 def add_new_book():
     db = get_db()
     cursor = db.cursor()
@@ -52,39 +74,38 @@ def add_new_book():
         )
 
     try:
-        theme_id = get_or_create_id("themes", theme, "name")
-        publisher_id = get_or_create_id("publishers", publisher, "name")
+        # One transaction for the lookups, the book, its links and first copy
+        with write_transaction(db):
+            theme_id = get_or_create_id("themes", theme, "name")
+            publisher_id = get_or_create_id("publishers", publisher, "name")
 
-        cursor.execute(
-            """
-            INSERT INTO books (catalog_code, title, theme_id, publisher_id, poster)
-            VALUES (?, ?, ?, ?, ?)
-            """,
-            (catCode, title, theme_id, publisher_id, poster),
-        )
-        book_id = cursor.lastrowid
+            cursor.execute(
+                """
+                INSERT INTO books (catalog_code, title, theme_id, publisher_id, poster)
+                VALUES (?, ?, ?, ?, ?)
+                """,
+                (catCode, title, theme_id, publisher_id, poster),
+            )
+            book_id = cursor.lastrowid
 
-        insert_book_authors(book_id, authors)
-        insert_book_keywords(book_id, keywords)
+            insert_book_authors(book_id, authors)
+            insert_book_keywords(book_id, keywords)
 
-        cursor.execute(
-            """
-            INSERT INTO book_copies (book_id, location, publisher_id, is_available)
-            VALUES (?, ?, ?, 1)
-            """,
-            (book_id, location, publisher_id),
-        )
+            cursor.execute(
+                """
+                INSERT INTO book_copies (book_id, location, publisher_id, is_available)
+                VALUES (?, ?, ?, 1)
+                """,
+                (book_id, location, publisher_id),
+            )
 
-        db.commit()
         return jsonify({"message": "Book added successfully", "book_id": book_id}), 201
 
     except sqlite3.IntegrityError as e:
-        db.rollback()
         return jsonify({"error": "Database constraint failed.", "details": str(e)}), 409
 
     except Exception as e:
         print(f"Error: {e}")
-        db.rollback()
         import traceback
 
         traceback.print_exc()
@@ -99,7 +120,41 @@ def add_new_book():
         )
 
 
+@app.route("/api/books/bulk", methods=["POST"])
+@auth.login_required(role="admin")
+def bulk_import_books():
+    """Import many books at once.
+
+    Accepts a JSON array, JSONL (application/x-ndjson) or CSV (text/csv)
+    body and returns per-row errors alongside the import rate.
+    """
+    db = get_db()
+    mimetype = request.mimetype
+    chunk_size = request.args.get("chunk_size", type=int) or 5000
+
+    try:
+        if mimetype == "application/json":
+            rows = request.get_json()
+            if not isinstance(rows, list):
+                return jsonify({"error": "Expected a JSON array of books"}), 400
+        elif mimetype in ("application/x-ndjson", "application/jsonl", "text/csv"):
+            stream = io.TextIOWrapper(request.stream, encoding="utf-8", newline="")
+            rows = read_rows(stream, "csv" if mimetype == "text/csv" else "jsonl")
+        else:
+            return jsonify({"error": f"Unsupported content type {mimetype}"}), 415
+
+        report = import_books(db, rows, chunk_size)
+        return jsonify(report), 200
+
+    except ValueError as e:
+        return jsonify({"error": "Malformed input", "details": str(e)}), 400
+
+    except Exception as e:
+        return jsonify({"error": "Server error", "details": str(e)}), 500
+
+
 @app.route("/api/books/<int:book_id>/delete", methods=["DELETE"])
+@auth.login_required(role="admin")
 def delete_book(book_id):
     db = get_db()
     cursor = db.cursor()
@@ -134,6 +189,8 @@ def delete_book(book_id):
 
 
 @app.route("/api/books/<int:book_id>/copies", methods=["GET"])
+# catalog for the publisher names
+@conditional(lambda book_id: [f"book:{book_id}", "catalog"])
 def get_book_copies(book_id):
     """Get all copies of a specific book"""
     db = get_db()
@@ -141,7 +198,7 @@ def get_book_copies(book_id):
 
     cursor.execute(
         """
-        SELECT bc.copy_id, bc.book_id, bc.location, p.name as publisher, 
+        SELECT bc.copy_id, bc.book_id, bc.location, bc.location_id, p.name as publisher, 
                bc.is_available, bc.borrowed_by, bc.borrowed_date,bc.state
         FROM book_copies bc
         JOIN publishers p ON bc.publisher_id = p.id
@@ -155,17 +212,130 @@ def get_book_copies(book_id):
     return jsonify(copies), 200
 
 
+@app.route("/api/books/<int:book_id>/availability", methods=["GET"])
+@conditional(lambda book_id: [f"book:{book_id}", "locations"])
+def get_book_availability(book_id):
+    """Copy counts and the first available copy of a book per location.
+
+    ?branch_id= puts that branch's shelves first, so the first entry with
+    available copies is the nearest one.
+    """
+    db = get_db()
+    branch_id = request.args.get("branch_id", type=int)
+
+    try:
+        # Reads only the (book_id, is_available, location_id) index; copy_id
+        # is the rowid and comes with it
+        rows = db.execute(
+            """
+            SELECT a.location_id, l.name AS location,
+                   l.parent_id AS branch_id, br.name AS branch,
+                   a.total_copies, a.available_copies, a.first_available_copy_id
+            FROM (
+                SELECT location_id,
+                       COUNT(*) AS total_copies,
+                       SUM(is_available = 1) AS available_copies,
+                       MIN(CASE WHEN is_available = 1 THEN copy_id END) AS first_available_copy_id
+                FROM book_copies
+                WHERE book_id = ?
+                GROUP BY location_id
+            ) a
+            LEFT JOIN locations l ON l.id = a.location_id
+            LEFT JOIN locations br ON br.id = l.parent_id
+            ORDER BY COALESCE(l.parent_id = ?, 0) DESC,
+                     a.available_copies > 0 DESC,
+                     a.location_id
+            """,
+            (book_id, branch_id),
+        ).fetchall()
+
+        if not rows and not db.execute(
+            "SELECT 1 FROM books WHERE id = ?", (book_id,)
+        ).fetchone():
+            return jsonify({"error": "Book not found"}), 404
+
+        locations = [dict(row) for row in rows]
+        return (
+            jsonify(
+                {
+                    "book_id": book_id,
+                    "total_copies": sum(loc["total_copies"] for loc in locations),
+                    "available_copies": sum(loc["available_copies"] for loc in locations),
+                    "locations": locations,
+                }
+            ),
+            200,
+        )
+
+    except Exception as e:
+        return jsonify({"error": "Server error", "details": str(e)}), 500
+
+
+@app.route("/api/locations", methods=["GET"])
+@conditional(lambda: ["locations"])
+def get_locations():
+    """All branches and shelves; shelves point at their branch via parent_id"""
+    db = get_db()
+    rows = db.execute(
+        "SELECT id, name, parent_id FROM locations ORDER BY COALESCE(parent_id, id), parent_id IS NOT NULL, name"
+    ).fetchall()
+    return jsonify([dict(row) for row in rows]), 200
+
+
+@app.route("/api/locations", methods=["POST"])
+@auth.login_required(role="admin")
+def add_location():
+    """Create a branch, or a shelf inside one when parent_id is given"""
+    db = get_db()
+    data = request.json or {}
+    name = data.get("name")
+    parent_id = data.get("parent_id")
+
+    if not name:
+        return jsonify({"error": "name is required"}), 400
+
+    try:
+        with write_transaction(db):
+            if parent_id is not None and not db.execute(
+                "SELECT 1 FROM locations WHERE id = ?", (parent_id,)
+            ).fetchone():
+                return jsonify({"error": "Parent location not found"}), 404
+            location_id = db.execute(
+                "INSERT INTO locations (name, parent_id) VALUES (?, ?)", (name, parent_id)
+            ).lastrowid
+
+        return jsonify({"message": "Location added", "location_id": location_id}), 201
+
+    except sqlite3.IntegrityError:
+        return jsonify({"error": "Location already exists"}), 409
+
+    except Exception as e:
+        return jsonify({"error": "Server error", "details": str(e)}), 500
+
+
+def location_name(db, location_id):
+    """Name of a branch or shelf, or None if there is no such location"""
+    row = db.execute("SELECT name FROM locations WHERE id = ?", (location_id,)).fetchone()
+    return row["name"] if row else None
+
+
 @app.route("/api/books/<int:book_id>/copies", methods=["POST"])
+@auth.login_required(role="admin")
 def add_book_copy(book_id):
-    """Add a new copy of an existing book with different publisher and/or location"""
+    """Add a new copy of an existing book with different publisher and/or location.
+
+    location_id files the copy under any branch or shelf from /api/locations.
+    A free-text location alone goes under the default branch.
+    """
     db = get_db()
     cursor = db.cursor()
     data = request.json
 
     location = data.get("location")
+    location_id = data.get("location_id")
     publisher = data.get("publisher")
 
-    if not location or not publisher:
+    if not (location or location_id) or not publisher:
         return jsonify({"error": "Location and publisher are required"}), 400
 
     try:
@@ -174,16 +344,21 @@ def add_book_copy(book_id):
         if not cursor.fetchone():
             return jsonify({"error": "Book not found"}), 404
 
+        if location_id is not None:
+            location = location_name(db, location_id)
+            if location is None:
+                return jsonify({"error": "Location not found"}), 404
+
         # Get or create publisher
         publisher_id = get_or_create_id("publishers", publisher, "name")
 
         # Create new copy
         cursor.execute(
             """
-            INSERT INTO book_copies (book_id, location, publisher_id, is_available)
-            VALUES (?, ?, ?, 1)
+            INSERT INTO book_copies (book_id, location, location_id, publisher_id, is_available)
+            VALUES (?, ?, ?, ?, 1)
             """,
-            (book_id, location, publisher_id),
+            (book_id, location, location_id, publisher_id),
         )
 
         db.commit()
@@ -197,9 +372,9 @@ def add_book_copy(book_id):
 
 
 @app.route("/api/books/copies/<int:copy_id>/borrow", methods=["POST"])
+@auth.login_required()
 def borrow_book_copy(copy_id):
     db = get_db()
-    cursor = db.cursor()
     data = request.json
 
     user_id = data.get("user_id")
@@ -207,28 +382,28 @@ def borrow_book_copy(copy_id):
 
     if not user_id:
         return jsonify({"error": "user_id is required"}), 400
+    if not auth.may_act_for(user_id):
+        return jsonify({"error": "Forbidden"}), 403
 
     try:
-        cursor.execute(
-            "SELECT is_available FROM book_copies WHERE copy_id = ?", (copy_id,)
-        )
-        copy = cursor.fetchone()
-
-        if not copy:
-            return jsonify({"error": "Copy not found"}), 404
-        if copy["is_available"] == 0:
-            return jsonify({"error": "Copy is not available"}), 400
-
-        cursor.execute(
-            """
-            UPDATE book_copies 
-            SET is_available = 0, borrowed_by = ?, borrowed_date = ?, due_date = ?
-            WHERE copy_id = ?
-            """,
-            (user_id, datetime.now().isoformat(), due_date, copy_id),
-        )
+        # The availability check and the update are one statement, so two
+        # concurrent borrowers can never both win the same copy
+        with write_transaction(db):
+            borrowed = db.execute(
+                """
+                UPDATE book_copies 
+                SET is_available = 0, borrowed_by = ?, borrowed_date = ?, due_date = ?, overdue = 0
+                WHERE copy_id = ? AND is_available = 1
+                RETURNING copy_id
+                """,
+                (user_id, datetime.now().isoformat(), due_date, copy_id),
+            ).fetchall()
+
+        if not borrowed:
+            if not copy_exists(db, copy_id):
+                return jsonify({"error": "Copy not found"}), 404
+            return jsonify({"error": "Copy is not available"}), 409
 
-        db.commit()
         return (
             jsonify(
                 {
@@ -241,11 +416,18 @@ def borrow_book_copy(copy_id):
         )
 
     except Exception as e:
-        db.rollback()
         return jsonify({"error": "Server error", "details": str(e)}), 500
 
 
+def copy_exists(db, copy_id):
+    return (
+        db.execute("SELECT 1 FROM book_copies WHERE copy_id = ?", (copy_id,)).fetchone()
+        is not None
+    )
+
+
 @app.route("/api/books/copies/<int:copy_id>", methods=["DELETE"])
+@auth.login_required(role="admin")
 def delete_book_copy(copy_id):
     """Delete a specific book copy"""
     db = get_db()
@@ -265,6 +447,9 @@ def delete_book_copy(copy_id):
 
 
 @app.route("/api/users/<int:user_id>/borrowed", methods=["GET"])
+@auth.login_required(owner="user_id")
+# catalog for the titles, posters and publishers of the books
+@conditional(lambda user_id: [f"user:{user_id}", "catalog"])
 def get_user_borrowed_books(user_id):
     """Get all books currently held by a specific user with full details"""
     db = get_db()
@@ -281,6 +466,7 @@ def get_user_borrowed_books(user_id):
             t.name as theme,
             bc.borrowed_date, 
             bc.due_date,
+            bc.overdue,
             bc.state
         FROM book_copies bc
         JOIN books b ON bc.book_id = b.id
@@ -295,15 +481,72 @@ def get_user_borrowed_books(user_id):
     return jsonify(borrowed_books), 200
 
 
+@app.route("/api/users/<int:user_id>/loans", methods=["GET"])
+@auth.login_required(owner="user_id")
+@conditional(lambda user_id: [f"user:{user_id}", "catalog"])
+def get_user_loans(user_id):
+    """A user's loan history, newest first, a page at a time.
+
+    Returns {"loans": [...], "next_cursor": ...}. Loans archived out of the
+    loans table (see scheduler.archive_loans) are not included.
+    """
+    args = request.args
+    try:
+        limit = parse_page_size(args.get("limit"))
+        after = decode_cursor(args["after"]) if args.get("after") else None
+    except (ValueError, TypeError):
+        return jsonify({"error": "Invalid limit or cursor"}), 400
+
+    where = ["l.user_id = ?"]
+    params = [user_id]
+    if after:
+        where.append("(l.borrowed_date, l.loan_id) < (?, ?)")
+        params.extend(after)
+
+    db = get_db()
+    rows = db.execute(
+        f"""
+        SELECT l.loan_id, l.copy_id, l.book_id, b.title, l.borrowed_date,
+               l.due_date, l.returned_date, l.overdue, l.retired
+        FROM loans l
+        LEFT JOIN books b ON b.id = l.book_id
+        WHERE {' AND '.join(where)}
+        ORDER BY l.borrowed_date DESC, l.loan_id DESC
+        LIMIT ?
+        """,
+        (*params, limit + 1),
+    ).fetchall()
+
+    loans = [dict(row) for row in rows]
+    next_cursor = None
+    if len(loans) > limit:
+        loans = loans[:limit]
+        next_cursor = encode_cursor(loans[-1]["borrowed_date"], loans[-1]["loan_id"])
+
+    return jsonify({"loans": loans, "next_cursor": next_cursor}), 200
+
+
 @app.route("/api/books/copies/<int:copy_id>", methods=["PUT"])
+@auth.login_required(role="admin")
 def update_book_copy(copy_id):
-    """Update copy location and/or publisher"""
+    """Update copy location and/or publisher. location_id moves the copy to
+    another branch or shelf; a free-text location alone stays in the
+    default branch."""
     db = get_db()
     cursor = db.cursor()
     data = request.json
 
     try:
-        if "location" in data:
+        if data.get("location_id") is not None:
+            location = location_name(db, data["location_id"])
+            if location is None:
+                return jsonify({"error": "Location not found"}), 404
+            cursor.execute(
+                "UPDATE book_copies SET location = ?, location_id = ? WHERE copy_id = ?",
+                (location, data["location_id"], copy_id),
+            )
+
+        elif "location" in data:
             cursor.execute(
                 "UPDATE book_copies SET location = ? WHERE copy_id = ?",
                 (data["location"], copy_id),
@@ -321,7 +564,8 @@ def update_book_copy(copy_id):
         # Return updated copy
         cursor.execute(
             """
-            SELECT bc.copy_id, bc.book_id, bc.location, p.name as publisher, bc.is_available
+            SELECT bc.copy_id, bc.book_id, bc.location, bc.location_id,
+                   p.name as publisher, bc.is_available
             FROM book_copies bc
             JOIN publishers p ON bc.publisher_id = p.id
             WHERE bc.copy_id = ?
@@ -338,86 +582,90 @@ def update_book_copy(copy_id):
 
 
 @app.route("/api/books/copies/<int:copy_id>/return", methods=["POST"])
+@auth.login_required()
 def return_book_copy(copy_id):
     db = get_db()
-    cursor = db.cursor()
+    # Readers return their own loans; admins any
+    borrower = None if auth.is_admin() else auth.current_session()["uid"]
 
     try:
-        cursor.execute(
-            "SELECT is_available, state FROM book_copies WHERE copy_id = ?", (copy_id,)
-        )
-        copy = cursor.fetchone()
-
-        if not copy or copy["is_available"] == 1:
-            return jsonify({"error": "Copy not found or not borrowed"}), 400
-
-        current_state = copy["state"] if copy["state"] is not None else 100
-        new_state = max(0, current_state - 20)
-
-        if new_state <= 0:
-            cursor.execute("DELETE FROM book_requests WHERE copy_id = ?", (copy_id,))
-            cursor.execute("DELETE FROM book_copies WHERE copy_id = ?", (copy_id,))
-            db.commit()
-            return (
-                jsonify(
-                    {
-                        "message": "Copy returned in poor condition and retired from inventory.",
-                        "removed": True,
-                        "copy_id": copy_id,
-                    }
-                ),
-                200,
-            )
-
-        cursor.execute(
-            """
-            SELECT request_id, user_id FROM book_requests 
-            WHERE copy_id = ? AND status = 'waiting'
-            ORDER BY position ASC LIMIT 1
-        """,
-            (copy_id,),
-        )
-        next_request = cursor.fetchone()
-
-        if next_request:
-            # Auto-borrow for next person
-            user_id = next_request["user_id"]
-            due_date = (datetime.now() + timedelta(days=15)).isoformat()
-
-            cursor.execute(
+        with write_transaction(db):
+            # Decay the state only if the copy is still out, claiming the
+            # return for this request
+            returned = db.execute(
                 """
-                UPDATE book_copies 
-                SET is_available = 0, borrowed_by = ?, borrowed_date = ?, due_date = ?, state = ?
-                WHERE copy_id = ?
-            """,
-                (user_id, datetime.now().isoformat(), due_date, new_state, copy_id),
-            )
-
-            cursor.execute(
-                "DELETE FROM book_requests WHERE request_id = ?",
-                (next_request["request_id"],),
-            )
-
-            # Reorder queue
-            cursor.execute(
+                UPDATE book_copies SET state = MAX(0, COALESCE(state, 100) - 20)
+                WHERE copy_id = ? AND is_available = 0 AND (? IS NULL OR borrowed_by = ?)
+                RETURNING state
+                """,
+                (copy_id, borrower, borrower),
+            ).fetchall()
+
+            if not returned:
+                copy = db.execute(
+                    "SELECT is_available FROM book_copies WHERE copy_id = ?", (copy_id,)
+                ).fetchone()
+                if copy is None:
+                    return jsonify({"error": "Copy not found"}), 404
+                if copy["is_available"] == 0:
+                    return jsonify({"error": "Copy is lent to another user"}), 403
+                return jsonify({"error": "Copy is not borrowed"}), 409
+
+            new_state = returned[0]["state"]
+
+            if new_state <= 0:
+                db.execute("DELETE FROM book_requests WHERE copy_id = ?", (copy_id,))
+                db.execute("DELETE FROM book_copies WHERE copy_id = ?", (copy_id,))
+                return (
+                    jsonify(
+                        {
+                            "message": "Copy returned in poor condition and retired from inventory.",
+                            "removed": True,
+                            "copy_id": copy_id,
+                        }
+                    ),
+                    200,
+                )
+
+            # Pop the head of the waiting queue in the same statement
+            next_request = db.execute(
                 """
-                UPDATE book_requests SET position = position - 1 
-                WHERE copy_id = ? AND status = 'waiting'
-            """,
+                DELETE FROM book_requests
+                WHERE request_id = (
+                    SELECT request_id FROM book_requests
+                    WHERE copy_id = ? AND status = 'waiting'
+                    ORDER BY position ASC LIMIT 1
+                )
+                RETURNING user_id
+                """,
                 (copy_id,),
-            )
-        else:
-            # Make available for everyone
-            cursor.execute(
-                """
-                UPDATE book_copies 
-                SET is_available = 1, borrowed_by = NULL, borrowed_date = NULL, due_date = NULL, state = ?
-                WHERE copy_id = ?
-            """,
-                (new_state, copy_id),
-            )
+            ).fetchall()
+
+            if next_request:
+                # Auto-borrow for next person
+                user_id = next_request[0]["user_id"]
+                due_date = (datetime.now() + timedelta(days=15)).isoformat()
+
+                db.execute(
+                    """
+                    UPDATE book_copies 
+                    SET borrowed_by = ?, borrowed_date = ?, due_date = ?, overdue = 0
+                    WHERE copy_id = ?
+                """,
+                    (user_id, datetime.now().isoformat(), due_date, copy_id),
+                )
+            else:
+                # Make available for everyone
+                db.execute(
+                    """
+                    UPDATE book_copies 
+                    SET is_available = 1, borrowed_by = NULL, borrowed_date = NULL, due_date = NULL,
+                        overdue = 0
+                    WHERE copy_id = ?
+                """,
+                    (copy_id,),
+                )
 
-        db.commit()
         return (
             jsonify(
                 {
@@ -430,41 +678,516 @@ def return_book_copy(copy_id):
         )
 
     except Exception as e:
-        db.rollback()
         return jsonify({"error": "Server error", "details": str(e)}), 500
 
 
+CATALOG_SORT_KEYS = {
+    "id": "b.id",
+    "title": "b.title",
+    "catalog_code": "COALESCE(b.catalog_code, '')",
+    "created_at": "b.created_at",
+}
+# Catalog columns and joins shared by the listing and search queries. Copy
+# counts and keywords come from the trigger-maintained book_summary table;
+# theme and publisher names are filled in from the lookup cache.
+CATALOG_COLUMNS = """b.id, b.catalog_code, b.title, b.poster, b.theme_id,
+               b.publisher_id, s.keywords,
+               COALESCE(s.total_copies, 0) as total_copies,
+               COALESCE(s.available_copies, 0) as available_copies"""
+CATALOG_JOINS = """LEFT JOIN book_summary s ON s.book_id = b.id"""
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+
+def encode_cursor(sort_value, row_id):
+    """Pack the last row's sort key into an opaque cursor string"""
+    raw = json.dumps([sort_value, row_id]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor):
+    """Unpack a cursor produced by encode_cursor"""
+    padded = cursor + "=" * (-len(cursor) % 4)
+    sort_value, row_id = json.loads(base64.urlsafe_b64decode(padded))
+    return sort_value, int(row_id)
+
+
+def with_lookup_names(books):
+    """Replace theme_id/publisher_id on catalog rows with their names"""
+    themes = get_lookup_names("themes", [book["theme_id"] for book in books])
+    publishers = get_lookup_names(
+        "publishers", [book["publisher_id"] for book in books]
+    )
+    for book in books:
+        book["theme"] = themes.get(book.pop("theme_id"))
+        book["publisher"] = publishers.get(book.pop("publisher_id"))
+    return books
+
+
+def parse_page_size(value):
+    """Clamp the requested page size to the allowed range"""
+    if value is None:
+        return DEFAULT_PAGE_SIZE
+    return max(1, min(int(value), MAX_PAGE_SIZE))
+
+
 @app.route("/api/books", methods=["GET"])
+@conditional(lambda: ["catalog"])
 def get_books():
-    """Get all books with their publisher info and copy counts"""
+    """Get books with their publisher info and copy counts, one keyset page
+    at a time: {"books": [...], "next_cursor": ...}. Without limit a page
+    holds DEFAULT_PAGE_SIZE books.
+    """
     db = get_db()
     cursor = db.cursor()
+    args = request.args
+
+    sort = args.get("sort", "id")
+    descending = sort.startswith("-")
+    sort_key = sort.lstrip("-")
+    if sort_key not in CATALOG_SORT_KEYS:
+        return (
+            jsonify(
+                {"error": f"Invalid sort key, expected one of {list(CATALOG_SORT_KEYS)}"}
+            ),
+            400,
+        )
+    sort_column = CATALOG_SORT_KEYS[sort_key]
+
+    try:
+        limit = parse_page_size(args.get("limit"))
+        after = decode_cursor(args["after"]) if args.get("after") else None
+    except (ValueError, TypeError):
+        return jsonify({"error": "Invalid limit or cursor"}), 400
+
+    where = []
+    params = []
+
+    if args.get("theme"):
+        where.append("b.theme_id = (SELECT id FROM themes WHERE name = ?)")
+        params.append(args["theme"])
+    if args.get("publisher"):
+        where.append("b.publisher_id = (SELECT id FROM publishers WHERE name = ?)")
+        params.append(args["publisher"])
+    if args.get("author"):
+        where.append(
+            """EXISTS (SELECT 1 FROM book_authors ba JOIN authors a ON ba.author_id = a.id
+                       WHERE ba.book_id = b.id AND a.name = ?)"""
+        )
+        params.append(args["author"])
+    if args.get("keyword"):
+        where.append(
+            """EXISTS (SELECT 1 FROM book_keywords bk JOIN keyword k ON bk.keyword_id = k.id
+                       WHERE bk.book_id = b.id AND k.word = ?)"""
+        )
+        params.append(args["keyword"])
+    if args.get("available") is not None:
+        if args["available"] in ("1", "true"):
+            where.append("s.available_copies > 0")
+        else:
+            where.append("COALESCE(s.available_copies, 0) = 0")
+    if after:
+        where.append(f"({sort_column}, b.id) {'<' if descending else '>'} (?, ?)")
+        params.extend(after)
+
+    direction = "DESC" if descending else "ASC"
+    where_sql = f"WHERE {' AND '.join(where)}" if where else ""
 
     cursor.execute(
-        """
-        SELECT b.id, b.catalog_code, b.title, b.poster, t.name as theme,
-               p.name as publisher,GROUP_CONCAT(DISTINCT k.word) as keywords,
-               COUNT(bc.copy_id) as total_copies,
-               SUM(CASE WHEN bc.is_available = 1 THEN 1 ELSE 0 END) as available_copies
+        f"""
+        SELECT {CATALOG_COLUMNS}, {sort_column} as sort_value
         FROM books b
-        LEFT JOIN themes t ON b.theme_id = t.id
-        LEFT JOIN publishers p ON b.publisher_id = p.id
-        LEFT JOIN book_copies bc ON b.id = bc.book_id
-        LEFT JOIN book_keywords bk ON b.id = bk.book_id
-        LEFT JOIN keyword k ON bk.keyword_id = k.id
-        GROUP BY b.id
-        ORDER BY b.id
-        """
+        {CATALOG_JOINS}
+        {where_sql}
+        ORDER BY {sort_column} {direction}, b.id {direction}
+        LIMIT ?
+        """,
+        (*params, limit + 1),
     )
 
-    books = [dict(row) for row in cursor.fetchall()]
+    books = with_lookup_names([dict(row) for row in cursor.fetchall()])
+    next_cursor = None
+    if len(books) > limit:
+        books = books[:limit]
+        next_cursor = encode_cursor(books[-1]["sort_value"], books[-1]["id"])
+    for book in books:
+        del book["sort_value"]
+
+    return jsonify({"books": books, "next_cursor": next_cursor}), 200
+
+
+# Column weights for bm25: title, catalog_code, authors, keywords
+SEARCH_RANK = "bm25(books_fts, 10.0, 8.0, 5.0, 2.0)"
+SEARCH_FIELDS = ("title", "catalog_code", "authors", "keywords")
+
+
+def build_match_query(text):
+    """Turn free text into an FTS5 query where every term is a quoted prefix"""
+    terms = re.findall(r"\w+", text)
+    return " ".join(f'"{term}"*' for term in terms)
+
+
+@app.route("/api/books/search", methods=["GET"])
+@conditional(lambda: ["catalog"])
+def search_books():
+    """Full-text search over titles, catalog codes, authors and keywords.
+
+    Results are ranked by bm25 and paginated with the same cursor scheme as
+    the catalog listing. field= restricts the match to one of SEARCH_FIELDS
+    and theme= to one theme.
+    """
+    db = get_db()
+    cursor = db.cursor()
+
+    match = build_match_query(request.args.get("q", ""))
+    if not match:
+        return jsonify({"error": "q is required"}), 400
+    field = request.args.get("field")
+    if field:
+        if field not in SEARCH_FIELDS:
+            return jsonify({"error": f"Invalid field, expected one of {list(SEARCH_FIELDS)}"}), 400
+        match = f"{field} : ({match})"
+
+    try:
+        limit = parse_page_size(request.args.get("limit"))
+        after = (
+            decode_cursor(request.args["after"]) if request.args.get("after") else None
+        )
+    except (ValueError, TypeError):
+        return jsonify({"error": "Invalid limit or cursor"}), 400
+
+    params = [match]
+    filter_sql = ""
+    if request.args.get("theme"):
+        filter_sql += " AND b.theme_id = (SELECT id FROM themes WHERE name = ?)"
+        params.append(request.args["theme"])
+    if after:
+        filter_sql += f" AND ({SEARCH_RANK}, b.id) > (?, ?)"
+        params.extend(after)
+
+    cursor.execute(
+        f"""
+        SELECT {CATALOG_COLUMNS}, {SEARCH_RANK} as score
+        FROM books_fts
+        JOIN books b ON b.id = books_fts.rowid
+        {CATALOG_JOINS}
+        WHERE books_fts MATCH ?{filter_sql}
+        ORDER BY score, b.id
+        LIMIT ?
+        """,
+        (*params, limit + 1),
+    )
+
+    books = with_lookup_names([dict(row) for row in cursor.fetchall()])
+    next_cursor = None
+    if len(books) > limit:
+        books = books[:limit]
+        next_cursor = encode_cursor(books[-1]["score"], books[-1]["id"])
+
+    return jsonify({"books": books, "next_cursor": next_cursor}), 200
+
+
+@app.route("/api/themes", methods=["GET"])
+@conditional(lambda: ["catalog"])
+def get_themes():
+    """Names of the themes at least one book is filed under"""
+    rows = get_db().execute(
+        """SELECT name FROM themes t
+           WHERE EXISTS (SELECT 1 FROM books WHERE theme_id = t.id)
+           ORDER BY name"""
+    ).fetchall()
+    return jsonify([row["name"] for row in rows]), 200
+
+
+def parse_recommendation_limit(value):
+    if value is None:
+        return 10
+    return max(1, min(int(value), recommend.SIMILAR_K))
+
+
+@app.route("/api/books/trending", methods=["GET"])
+@conditional(lambda: ["catalog", "recommendations"])
+def get_trending_books():
+    """Books ranked by recent loans and current waitlist, read from the
+    precomputed book_popularity table (see recommend.py)"""
+    try:
+        limit = parse_recommendation_limit(request.args.get("limit"))
+    except ValueError:
+        return jsonify({"error": "Invalid limit"}), 400
+
+    db = get_db()
+    rows = db.execute(
+        f"""
+        SELECT {CATALOG_COLUMNS}, p.score
+        FROM book_popularity p
+        -- CROSS JOIN keeps p as the outer loop, read down the score index
+        CROSS JOIN books b ON b.id = p.book_id
+        {CATALOG_JOINS}
+        WHERE p.score > 0
+        ORDER BY p.score DESC
+        LIMIT ?
+        """,
+        (limit,),
+    ).fetchall()
+
+    books = with_lookup_names([dict(row) for row in rows])
+    for book in books:
+        book["score"] = round(recommend.current_score(book["score"], db), 3)
     return jsonify(books), 200
 
 
+@app.route("/api/books/<int:book_id>/similar", methods=["GET"])
+@conditional(lambda book_id: ["catalog", "recommendations"])
+def get_similar_books(book_id):
+    """Books most often borrowed by readers of this one, read from the
+    precomputed book_similarity table (see recommend.py)"""
+    try:
+        limit = parse_recommendation_limit(request.args.get("limit"))
+    except ValueError:
+        return jsonify({"error": "Invalid limit"}), 400
+
+    db = get_db()
+    if not db.execute("SELECT 1 FROM books WHERE id = ?", (book_id,)).fetchone():
+        return jsonify({"error": "Book not found"}), 404
+
+    rows = db.execute(
+        f"""
+        SELECT {CATALOG_COLUMNS}, sim.score
+        FROM book_similarity sim
+        JOIN books b ON b.id = sim.similar_id
+        {CATALOG_JOINS}
+        WHERE sim.book_id = ?
+        ORDER BY sim.rank
+        LIMIT ?
+        """,
+        (book_id, limit),
+    ).fetchall()
+
+    books = with_lookup_names([dict(row) for row in rows])
+    for book in books:
+        book["score"] = round(book["score"], 3)
+    return jsonify(books), 200
+
+
+# Batch circulation. Copy ids are passed to SQLite as one JSON array and
+# expanded with json_each, so each step is a single statement over the
+# whole batch however many copies it holds.
+MAX_BATCH_SIZE = 1000
+BATCH_IDS = "(SELECT value FROM json_each(?))"
+
+
+def parse_copy_ids(data):
+    """Validated, de-duplicated copy ids from a batch request body, in order"""
+    copy_ids = (data or {}).get("copy_ids")
+    if not isinstance(copy_ids, list) or not copy_ids:
+        raise ValueError("copy_ids must be a non-empty list")
+    if len(copy_ids) > MAX_BATCH_SIZE:
+        raise ValueError(f"At most {MAX_BATCH_SIZE} copies per batch")
+    if not all(isinstance(copy_id, int) and not isinstance(copy_id, bool) for copy_id in copy_ids):
+        raise ValueError("copy_ids must be integers")
+    return list(dict.fromkeys(copy_ids))
+
+
+def existing_copies(db, copy_ids):
+    rows = db.execute(
+        f"SELECT copy_id FROM book_copies WHERE copy_id IN {BATCH_IDS}",
+        (json.dumps(copy_ids),),
+    ).fetchall()
+    return {row["copy_id"] for row in rows}
+
+
+@app.route("/api/books/copies/borrow:batch", methods=["POST"])
+@auth.login_required(role="admin")
+def borrow_book_copies():
+    """Lend a list of copies to one user in a single transaction"""
+    db = get_db()
+    data = request.json or {}
+    user_id = data.get("user_id")
+    due_date = data.get("due_date")
+
+    if not user_id:
+        return jsonify({"error": "user_id is required"}), 400
+    if not auth.may_act_for(user_id):
+        return jsonify({"error": "Forbidden"}), 403
+    try:
+        copy_ids = parse_copy_ids(data)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    try:
+        with write_transaction(db):
+            borrowed = {
+                row["copy_id"]
+                for row in db.execute(
+                    f"""
+                    UPDATE book_copies
+                    SET is_available = 0, borrowed_by = ?, borrowed_date = ?, due_date = ?,
+                        overdue = 0
+                    WHERE copy_id IN {BATCH_IDS} AND is_available = 1
+                    RETURNING copy_id
+                    """,
+                    (user_id, datetime.now().isoformat(), due_date, json.dumps(copy_ids)),
+                )
+            }
+            missing = set(copy_ids) - borrowed
+            found = existing_copies(db, list(missing)) if missing else set()
+
+        results = []
+        for copy_id in copy_ids:
+            if copy_id in borrowed:
+                results.append({"copy_id": copy_id, "status": 200})
+            elif copy_id in found:
+                results.append({"copy_id": copy_id, "status": 409, "error": "Copy is not available"})
+            else:
+                results.append({"copy_id": copy_id, "status": 404, "error": "Copy not found"})
+
+        return (
+            jsonify(
+                {
+                    "borrowed": len(borrowed),
+                    "failed": len(copy_ids) - len(borrowed),
+                    "results": results,
+                }
+            ),
+            200,
+        )
+
+    except Exception as e:
+        return jsonify({"error": "Server error", "details": str(e)}), 500
+
+
+@app.route("/api/books/copies/return:batch", methods=["POST"])
+@auth.login_required(role="admin")
+def return_book_copies():
+    """Check in a list of copies in a single transaction: decay their state,
+    retire worn-out copies and hand the rest to the head of their queues"""
+    db = get_db()
+    try:
+        copy_ids = parse_copy_ids(request.json)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    try:
+        with write_transaction(db):
+            returned = {
+                row["copy_id"]: row["state"]
+                for row in db.execute(
+                    f"""
+                    UPDATE book_copies SET state = MAX(0, COALESCE(state, 100) - 20)
+                    WHERE copy_id IN {BATCH_IDS} AND is_available = 0
+                    RETURNING copy_id, state
+                    """,
+                    (json.dumps(copy_ids),),
+                )
+            }
+            missing = set(copy_ids) - set(returned)
+            found = existing_copies(db, list(missing)) if missing else set()
+
+            retired = [copy_id for copy_id, state in returned.items() if state <= 0]
+            kept = [copy_id for copy_id, state in returned.items() if state > 0]
+
+            if retired:
+                db.execute(
+                    f"DELETE FROM book_requests WHERE copy_id IN {BATCH_IDS}",
+                    (json.dumps(retired),),
+                )
+                db.execute(
+                    f"DELETE FROM book_copies WHERE copy_id IN {BATCH_IDS}",
+                    (json.dumps(retired),),
+                )
+
+            # Pop the head of every affected queue in one statement
+            next_users = {}
+            if kept:
+                next_users = {
+                    row["copy_id"]: row["user_id"]
+                    for row in db.execute(
+                        f"""
+                        DELETE FROM book_requests
+                        WHERE request_id IN (
+                            SELECT request_id FROM (
+                                SELECT request_id, ROW_NUMBER() OVER (
+                                    PARTITION BY copy_id ORDER BY position
+                                ) AS rank
+                                FROM book_requests
+                                WHERE copy_id IN {BATCH_IDS} AND status = 'waiting'
+                            )
+                            WHERE rank = 1
+                        )
+                        RETURNING copy_id, user_id
+                        """,
+                        (json.dumps(kept),),
+                    )
+                }
+
+            if next_users:
+                now = datetime.now()
+                db.execute(
+                    f"""
+                    UPDATE book_copies
+                    SET borrowed_by = handoff.value, borrowed_date = ?, due_date = ?,
+                        overdue = 0
+                    FROM json_each(?) AS handoff
+                    WHERE book_copies.copy_id = CAST(handoff.key AS INTEGER)
+                    """,
+                    (
+                        now.isoformat(),
+                        (now + timedelta(days=15)).isoformat(),
+                        json.dumps({str(k): v for k, v in next_users.items()}),
+                    ),
+                )
+
+            shelved = [copy_id for copy_id in kept if copy_id not in next_users]
+            if shelved:
+                db.execute(
+                    f"""
+                    UPDATE book_copies
+                    SET is_available = 1, borrowed_by = NULL, borrowed_date = NULL, due_date = NULL,
+                        overdue = 0
+                    WHERE copy_id IN {BATCH_IDS}
+                    """,
+                    (json.dumps(shelved),),
+                )
+
+        results = []
+        for copy_id in copy_ids:
+            if copy_id in returned:
+                results.append(
+                    {
+                        "copy_id": copy_id,
+                        "status": 200,
+                        "new_state": returned[copy_id],
+                        "removed": returned[copy_id] <= 0,
+                        "auto_borrowed": copy_id in next_users,
+                    }
+                )
+            elif copy_id in found:
+                results.append({"copy_id": copy_id, "status": 409, "error": "Copy is not borrowed"})
+            else:
+                results.append({"copy_id": copy_id, "status": 404, "error": "Copy not found"})
+
+        return (
+            jsonify(
+                {
+                    "returned": len(returned),
+                    "retired": len(retired),
+                    "auto_borrowed": len(next_users),
+                    "failed": len(copy_ids) - len(returned),
+                    "results": results,
+                }
+            ),
+            200,
+        )
+
+    except Exception as e:
+        return jsonify({"error": "Server error", "details": str(e)}), 500
+
+
 # requests functions
 
 
 @app.route("/api/books/copies/<int:copy_id>/request", methods=["POST"])
+@auth.login_required()
 def request_book_copy(copy_id):
     """Request a book copy that is currently borrowed"""
     db = get_db()
@@ -474,48 +1197,40 @@ def request_book_copy(copy_id):
 
     if not user_id:
         return jsonify({"error": "user_id is required"}), 400
+    if not auth.may_act_for(user_id):
+        return jsonify({"error": "Forbidden"}), 403
 
     try:
-        # Check if copy exists
-        cursor.execute(
-            "SELECT is_available FROM book_copies WHERE copy_id = ?", (copy_id,)
-        )
-        copy = cursor.fetchone()
-
-        if not copy:
-            return jsonify({"error": "Copy not found"}), 404
-
-        if copy["is_available"] == 1:
-            return (
-                jsonify({"error": "Copy is available, you can borrow it directly"}),
-                400,
+        with write_transaction(db):
+            # Check if copy exists
+            cursor.execute(
+                "SELECT is_available FROM book_copies WHERE copy_id = ?", (copy_id,)
             )
+            copy = cursor.fetchone()
 
-        # Check if user already requested this copy
-        cursor.execute(
-            "SELECT request_id FROM book_requests WHERE copy_id = ? AND user_id = ?",
-            (copy_id, user_id),
-        )
-        if cursor.fetchone():
-            return jsonify({"error": "You already requested this copy"}), 409
+            if not copy:
+                return jsonify({"error": "Copy not found"}), 404
 
-        # Get position in queue (count existing requests + 1)
-        cursor.execute(
-            "SELECT COUNT(*) as count FROM book_requests WHERE copy_id = ?", (copy_id,)
-        )
-        position = cursor.fetchone()["count"] + 1
+            if copy["is_available"] == 1:
+                return (
+                    jsonify({"error": "Copy is available, you can borrow it directly"}),
+                    400,
+                )
 
-        # Create request
-        cursor.execute(
-            """
-            INSERT INTO book_requests (copy_id, user_id, position, status)
-            VALUES (?, ?, ?, 'waiting')
-            """,
-            (copy_id, user_id, position),
-        )
+            # position is an ever-increasing sequence per copy, so joining the
+            # queue writes one row and never renumbers the others
+            cursor.execute(
+                """
+                INSERT INTO book_requests (copy_id, user_id, position, status)
+                SELECT ?, ?, COALESCE(MAX(position), 0) + 1, 'waiting'
+                FROM book_requests
+                WHERE copy_id = ? AND status = 'waiting'
+                """,
+                (copy_id, user_id, copy_id),
+            )
+            request_id = cursor.lastrowid
 
-        db.commit()
-        request_id = cursor.lastrowid
+            position = queue_rank(db, request_id)
 
         return (
             jsonify(
@@ -528,12 +1243,34 @@ def request_book_copy(copy_id):
             201,
         )
 
+    except sqlite3.IntegrityError as e:
+        # The copy was checked above, so a broken reference is the user
+        if "FOREIGN KEY" in str(e):
+            return jsonify({"error": "User not found"}), 404
+        return jsonify({"error": "You already requested this copy"}), 409
+
     except Exception as e:
-        db.rollback()
         return jsonify({"error": "Server error", "details": str(e)}), 500
 
 
+# 1-based place of a request in its copy's waiting queue, counted on the
+# (copy_id, status, position) index
+QUEUE_RANK_SQL = """(SELECT COUNT(*) FROM book_requests q
+                 WHERE q.copy_id = br.copy_id AND q.status = br.status
+                 AND q.position <= br.position)"""
+
+
+def queue_rank(db, request_id):
+    row = db.execute(
+        f"SELECT {QUEUE_RANK_SQL} FROM book_requests br WHERE br.request_id = ?",
+        (request_id,),
+    ).fetchone()
+    return row[0] if row else None
+
+
 @app.route("/api/users/<int:user_id>/requests", methods=["GET"])
+@auth.login_required(owner="user_id")
+@conditional(lambda user_id: [f"user:{user_id}", "requests", "catalog"])
 def get_user_requests(user_id):
     """Get all book requests for a user"""
     db = get_db()
@@ -541,11 +1278,11 @@ def get_user_requests(user_id):
 
     try:
         cursor.execute(
-            """
+            f"""
             SELECT 
                 br.request_id,
                 br.copy_id,
-                br.position,
+                {QUEUE_RANK_SQL} as position,
                 br.status,
                 br.requested_date,
                 b.title,
@@ -557,19 +1294,20 @@ def get_user_requests(user_id):
             JOIN books b ON bc.book_id = b.id
             LEFT JOIN publishers p ON bc.publisher_id = p.id
             WHERE br.user_id = ?
-            ORDER BY br.status DESC, br.position ASC
+            ORDER BY br.status DESC, position ASC
             """,
             (user_id,),
         )
 
-        requests = [dict(row) for row in cursor.fetchall()]
-        return jsonify(requests), 200
+        return stream_rows(cursor), 200
 
     except Exception as e:
         return jsonify({"error": "Server error", "details": str(e)}), 500
 
 
 @app.route("/api/books/copies/<int:copy_id>/requests", methods=["GET"])
+@auth.login_required(role="admin")
+@conditional(lambda copy_id: [f"copy:{copy_id}", "users"])
 def get_copy_requests(copy_id):
     """Get request queue for a specific copy"""
     db = get_db()
@@ -581,7 +1319,7 @@ def get_copy_requests(copy_id):
             SELECT 
                 br.request_id,
                 br.user_id,
-                br.position,
+                ROW_NUMBER() OVER (ORDER BY br.position) as position,
                 br.requested_date,
                 u.fname,
                 u.lname,
@@ -594,47 +1332,36 @@ def get_copy_requests(copy_id):
             (copy_id,),
         )
 
-        queue = [dict(row) for row in cursor.fetchall()]
-        return jsonify(queue), 200
+        return stream_rows(cursor), 200
 
     except Exception as e:
         return jsonify({"error": "Server error", "details": str(e)}), 500
 
 
 @app.route("/api/books/requests/<int:request_id>/cancel", methods=["POST"])
+@auth.login_required()
 def cancel_book_request(request_id):
     """Cancel a book request"""
     db = get_db()
     cursor = db.cursor()
 
     try:
-        cursor.execute(
-            "SELECT copy_id, position FROM book_requests WHERE request_id = ?",
-            (request_id,),
-        )
-        request = cursor.fetchone()
-
-        if not request:
+        row = cursor.execute(
+            "SELECT user_id FROM book_requests WHERE request_id = ?", (request_id,)
+        ).fetchone()
+        if row is None:
             return jsonify({"error": "Request not found"}), 404
+        if not auth.may_act_for(row["user_id"]):
+            return jsonify({"error": "Forbidden"}), 403
 
-        copy_id = request["copy_id"]
-        position = request["position"]
-
-        # Delete request
+        # Later requests keep their sequence numbers, so cancelling only
+        # removes this row
         cursor.execute("DELETE FROM book_requests WHERE request_id = ?", (request_id,))
-
-        # Decrement positions for requests after this one
-        cursor.execute(
-            """
-            UPDATE book_requests 
-            SET position = position - 1 
-            WHERE copy_id = ? AND position > ?
-            """,
-            (copy_id, position),
-        )
-
         db.commit()
 
+        if cursor.rowcount == 0:
+            return jsonify({"error": "Request not found"}), 404
+
         return jsonify({"message": "Request cancelled successfully"}), 200
 
     except Exception as e:
@@ -642,24 +1369,144 @@ def cancel_book_request(request_id):
         return jsonify({"error": "Server error", "details": str(e)}), 500
 
 
+@app.route("/api/stats", methods=["GET"])
+@auth.login_required(role="admin")
+def get_library_stats():
+    """Dashboard totals, read from the trigger-maintained counters"""
+    db = get_db()
+
+    try:
+        stats = {row["name"]: row["value"] for row in db.execute("SELECT name, value FROM library_stats")}
+        users_by_state = {
+            state: stats.pop(f"users_{state}", 0) for state in ("kid", "student", "pro")
+        }
+        return jsonify({**stats, "users_by_state": users_by_state}), 200
+
+    except Exception as e:
+        return jsonify({"error": "Server error", "details": str(e)}), 500
+
+
+@app.route("/api/cache/stats", methods=["GET"])
+@auth.login_required(role="admin")
+def cache_stats():
+    """Hit/miss counters of the in-process lookup and response caches"""
+    return (
+        jsonify({"lookups": lookup_cache.stats(), "responses": response_cache.stats()}),
+        200,
+    )
+
+
 # users manipulation functions
+
+# Columns clients may ask for with fields=; password is never one of them
+USER_FIELDS = (
+    "user_id",
+    "fname",
+    "lname",
+    "age",
+    "state",
+    "username",
+    "email",
+    "address",
+    "phone",
+    "role",
+    "is_subscribed",
+    "join_datetime",
+)
+USER_COLUMNS = ", ".join(USER_FIELDS)
+# What the users list returns unless fields= asks for more
+USER_LIST_FIELDS = ("user_id", "fname", "lname", "username", "email", "state", "role", "is_subscribed")
+
+
+def parse_fields(value, default):
+    """Turn a comma-separated fields= value into a column list, always
+    starting with user_id. Raises ValueError on columns outside USER_FIELDS."""
+    if not value:
+        fields = list(default)
+    elif value == "all":
+        fields = list(USER_FIELDS)
+    else:
+        fields = [field.strip() for field in value.split(",") if field.strip()]
+        unknown = [field for field in fields if field not in USER_FIELDS]
+        if unknown:
+            raise ValueError(f"Unknown fields {unknown}, expected any of {list(USER_FIELDS)}")
+    return ["user_id"] + [field for field in dict.fromkeys(fields) if field != "user_id"]
+
+
 @app.route("/api/users", methods=["GET"])
+@auth.login_required(role="admin")
+@conditional(lambda: ["users"])
 def get_users():
-    conn = get_db()
-    cur = conn.cursor()
-    rows = cur.execute("SELECT * FROM users").fetchall()
-    return jsonify([dict(row) for row in rows])
+    """List users without their passwords.
+
+    Rows hold USER_LIST_FIELDS unless fields= names other columns (or
+    "all"). Without limit/after or a state/role/is_subscribed filter the
+    whole list is streamed; with any of them the response is a page
+    {"users": [...], "next_cursor": ...} ordered by user_id.
+    """
+    args = request.args
+    try:
+        columns = ", ".join(parse_fields(args.get("fields"), USER_LIST_FIELDS))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    cur = get_db().cursor()
+
+    if not args.keys() - {"fields"}:
+        cur.execute(f"SELECT {columns} FROM users ORDER BY user_id")
+        return stream_rows(cur)
+
+    try:
+        limit = parse_page_size(args.get("limit"))
+        after = decode_cursor(args["after"])[1] if args.get("after") else None
+    except (ValueError, TypeError):
+        return jsonify({"error": "Invalid limit or cursor"}), 400
+
+    where = []
+    params = []
+    for column in ("state", "role"):
+        if args.get(column):
+            where.append(f"{column} = ?")
+            params.append(args[column])
+    if args.get("is_subscribed") is not None:
+        where.append("is_subscribed = ?")
+        params.append(1 if args["is_subscribed"] in ("1", "true") else 0)
+    if after is not None:
+        where.append("user_id > ?")
+        params.append(after)
+    where_sql = f"WHERE {' AND '.join(where)}" if where else ""
+
+    cur.execute(
+        f"SELECT {columns} FROM users {where_sql} ORDER BY user_id LIMIT ?",
+        (*params, limit + 1),
+    )
+    users = [dict(row) for row in cur.fetchall()]
+    next_cursor = None
+    if len(users) > limit:
+        users = users[:limit]
+        next_cursor = encode_cursor(None, users[-1]["user_id"])
+
+    return jsonify({"users": users, "next_cursor": next_cursor}), 200
 
 
 @app.route("/api/users/<int:user_id>", methods=["GET", "PUT", "DELETE"])
+@auth.login_required(owner="user_id")
+@conditional(lambda user_id: [f"user:{user_id}"])
 def manage_user(user_id):
+    if request.method != "GET" and not auth.is_admin():
+        return jsonify({"error": "Forbidden"}), 403
+
     conn = get_db()
     cur = conn.cursor()
 
     if request.method == "GET":
-        # Get a single user
+        # Get a single user, every column but the password by default
+        try:
+            columns = ", ".join(parse_fields(request.args.get("fields"), USER_FIELDS))
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
         row = cur.execute(
-            "SELECT * FROM users WHERE user_id = ?", (user_id,)
+            f"SELECT {columns} FROM users WHERE user_id = ?", (user_id,)
         ).fetchone()
         if not row:
             return jsonify({"error": f"User {user_id} not found"}), 404
@@ -684,7 +1531,7 @@ def manage_user(user_id):
 
         # Return updated user
         row = cur.execute(
-            "SELECT * FROM users WHERE user_id = ?", (user_id,)
+            f"SELECT {USER_COLUMNS} FROM users WHERE user_id = ?", (user_id,)
         ).fetchone()
         return jsonify(dict(row))
 
@@ -705,19 +1552,61 @@ def login():
     email = data.get("email")
     password = data.get("password")
 
+    # Throttle before touching the database or the KDF
+    retry_after = auth.login_retry_after(email)
+    if retry_after:
+        response = jsonify({"success": False, "msg": "Too many login attempts"})
+        response.headers["Retry-After"] = str(int(retry_after) + 1)
+        return response, 429
+
     conn = get_db()
     cur = conn.cursor()
 
-    cur.execute("SELECT * FROM users WHERE email = ?", (email,))
+    cur.execute(f"SELECT {USER_COLUMNS}, password FROM users WHERE email = ?", (email,))
     user = cur.fetchone()
 
-    if user is None:
-        return jsonify({"success": False, "msg": "Email not found"})
+    # Don't hold a pooled connection while the KDF runs
+    release_db()
+
+    try:
+        if user is None:
+            # Same answer and about the same time as a wrong password
+            ok = auth.verify_unknown(password)
+        else:
+            ok, new_hash = auth.verify_password(user["password"], password)
+    except auth.KDFBusy:
+        return jsonify({"success": False, "msg": "Server busy, try again"}), 503
+
+    if not ok:
+        return jsonify({"success": False, "msg": "Invalid email or password"})
+
+    if new_hash:
+        # Upgrade a plaintext or outdated hash, unless it changed meanwhile
+        conn = get_db()
+        with write_transaction(conn):
+            conn.execute(
+                "UPDATE users SET password = ? WHERE user_id = ? AND password = ?",
+                (new_hash, user["user_id"], user["password"]),
+            )
+
+    profile = dict(user)
+    del profile["password"]
+    return jsonify(
+        {"success": True, "msg": "Logged in", "user": profile, "token": auth.issue_token(profile)}
+    )
 
-    if user["password"] != password:
-        return jsonify({"success": False, "msg": "Wrong password"})
 
-    return jsonify({"success": True, "msg": "Logged in", "user": dict(user)})
+@app.route("/api/session", methods=["GET"])
+@auth.login_required()
+def get_session():
+    """Who the bearer token belongs to, read from the token alone"""
+    session = auth.current_session()
+    return (
+        jsonify(
+            {"user_id": session["uid"], "role": session["role"], "is_subscribed": session["sub"]}
+        ),
+        200,
+    )
 
 
 @app.route("/api/users", methods=["POST"])
@@ -729,7 +1618,7 @@ def add_user():
     state = data.get("state")
     username = data.get("username")
     email = data.get("email")
-    password = data.get("password")  # 3 : change this to hashed later
+    password = data.get("password")
     address = data.get("address")
     phone = data.get("phone")
     role = data.get("role")
@@ -747,10 +1636,19 @@ def add_user():
         phone,
         role,
     ]
-    conn = get_db()
-    cur = conn.cursor()
     if any(field is None for field in required):
         return jsonify({"message": "Missing required fields"}), 400
+    if role != "user" and not auth.is_admin():
+        return jsonify({"message": "Only admins can create admin accounts"}), 403
+
+    # Hash before taking a pooled connection
+    try:
+        password = auth.hash_password(password)
+    except auth.KDFBusy:
+        return jsonify({"message": "Server busy, try again"}), 503
+
+    conn = get_db()
+    cur = conn.cursor()
     cur.execute("SELECT 1 FROM users WHERE email = ?", (email,))
     exists = cur.fetchone()
 
@@ -784,4 +1682,7 @@ def add_user():
 
 
 if __name__ == "__main__":
+    # The reloader runs this file twice; only its child serves requests
+    if os.environ.get("WERKZEUG_RUN_MAIN") == "true":
+        scheduler.init_app(app)
     app.run(debug=True)
@@ -0,0 +1,338 @@
+"""Reproducible benchmark harness for the library API.
+
+Builds a synthetic library in a throwaway database and drives a mixed
+workload against backend.py. The workload covers browse, search, copies,
+borrow, return, request and cancel. It runs either through Flask's test
+client, which measures the app alone, or through a real threaded HTTP
+server. Latency percentiles and requests per second are reported per
+operation. Results are written as JSON so runs can be compared between
+commits.
+
+    python benchmark.py --books 2000 --users 500 --duration 15 --out before.json
+    python benchmark.py --books 2000 --users 500 --duration 15 --compare before.json
+"""
+
+import argparse
+import http.client
+import json
+import logging
+import os
+import random
+import subprocess
+import tempfile
+import threading
+import time
+from datetime import datetime, timezone
+
+import database
+from loadgen import print_report, summarize
+
+# Relative frequency of each operation in the mixed workload
+DEFAULT_MIX = {
+    "browse": 30,
+    "search": 20,
+    "copies": 15,
+    "borrow": 10,
+    "return": 10,
+    "request": 10,
+    "cancel": 5,
+}
+
+SEARCH_TERMS = ["the", "war", "lord", "orwell", "king", "fantasy", "mystery", "love", "ha"]
+SORTS = ["id", "title", "-created_at"]
+
+# Status codes that are correct answers to a contended operation, e.g. a
+# borrow that lost the copy to another user
+EXPECTED_CONFLICTS = {400, 404, 409}
+
+
+def build_library(path, args):
+    """Create and populate a fresh database at `path`"""
+    from seed_books import seed_library
+
+    database.init_db(path)
+    conn = database.connect(path)
+    counts = seed_library(
+        conn,
+        users=args.users,
+        books=args.books,
+        copies=args.copies,
+        loans=args.loans,
+        requests=args.requests,
+        keywords=args.keywords,
+        seed=args.seed,
+    )
+    conn.close()
+    return counts
+
+
+class TestClientTransport:
+    """Calls the app in-process through Flask's test client"""
+
+    def __init__(self, app):
+        self.app = app
+
+    def session(self, headers=None):
+        client = self.app.test_client()
+
+        def call(method, path, body=None):
+            response = client.open(path, method=method, json=body, headers=headers)
+            return response.status_code, response.get_json(silent=True)
+
+        return call
+
+    def close(self):
+        pass
+
+
+class HTTPTransport:
+    """Serves the app from a real threaded HTTP server on a local port"""
+
+    def __init__(self, app):
+        from werkzeug.serving import make_server
+
+        logging.getLogger("werkzeug").setLevel(logging.WARNING)
+        self.server = make_server("127.0.0.1", 0, app, threaded=True)
+        self.port = self.server.server_port
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+
+    def session(self, headers=None):
+        conn = http.client.HTTPConnection("127.0.0.1", self.port, timeout=30)
+
+        def call(method, path, body=None):
+            payload = json.dumps(body) if body is not None else None
+            request_headers = dict(headers or {})
+            if payload:
+                request_headers["Content-Type"] = "application/json"
+            conn.request(method, path, body=payload, headers=request_headers)
+            response = conn.getresponse()
+            data = response.read()
+            try:
+                return response.status, json.loads(data) if data else None
+            except ValueError:
+                return response.status, None
+
+        return call
+
+    def close(self):
+        self.server.shutdown()
+
+
+class Worker:
+    """One simulated user working through the weighted operation mix"""
+
+    def __init__(self, call, rng, user_id, limits):
+        self.call = call
+        self.rng = rng
+        self.user_id = user_id
+        self.limits = limits
+        self.borrowed = []
+        self.requests = []
+
+    def browse(self):
+        path = f"/api/books?limit=20&sort={self.rng.choice(SORTS)}"
+        status, body = self.call("GET", path)
+        # Follow the cursor to the next page half of the time
+        if status == 200 and body and body.get("next_cursor") and self.rng.random() < 0.5:
+            status, _ = self.call("GET", f"{path}&after={body['next_cursor']}")
+        return status
+
+    def search(self):
+        status, _ = self.call("GET", f"/api/books/search?q={self.rng.choice(SEARCH_TERMS)}")
+        return status
+
+    def copies(self):
+        book_id = self.rng.randint(1, self.limits["books"])
+        status, _ = self.call("GET", f"/api/books/{book_id}/copies")
+        return status
+
+    def borrow(self):
+        copy_id = self.rng.randint(1, self.limits["copies"])
+        status, _ = self.call(
+            "POST", f"/api/books/copies/{copy_id}/borrow", {"user_id": self.user_id}
+        )
+        if status == 200:
+            self.borrowed.append(copy_id)
+        return status
+
+    def return_(self):
+        if not self.borrowed:
+            return self.borrow()
+        copy_id = self.borrowed.pop(self.rng.randrange(len(self.borrowed)))
+        status, _ = self.call("POST", f"/api/books/copies/{copy_id}/return")
+        return status
+
+    def request(self):
+        copy_id = self.rng.randint(1, self.limits["copies"])
+        status, body = self.call(
+            "POST", f"/api/books/copies/{copy_id}/request", {"user_id": self.user_id}
+        )
+        if status == 201 and body:
+            self.requests.append(body["request_id"])
+        return status
+
+    def cancel(self):
+        if not self.requests:
+            return self.request()
+        request_id = self.requests.pop()
+        status, _ = self.call("POST", f"/api/books/requests/{request_id}/cancel")
+        return status
+
+    def run(self, operation):
+        handler = self.return_ if operation == "return" else getattr(self, operation)
+        return handler()
+
+
+def session_headers(user_id):
+    """Authenticate as `user_id` without a login, which would spend the
+    run's time in the password KDF"""
+    import auth
+
+    token = auth.issue_token({"user_id": user_id, "role": "user", "is_subscribed": 0})
+    return {"Authorization": f"Bearer {token}"}
+
+
+def run_workload(transport, mix, limits, concurrency, duration, seed):
+    operations = list(mix)
+    weights = [mix[op] for op in operations]
+    latencies = {op: [] for op in operations}
+    errors = {op: 0 for op in operations}
+    lock = threading.Lock()
+    deadline = time.perf_counter() + duration
+
+    def worker(index):
+        rng = random.Random(seed * 1000 + index)
+        user_id = rng.randint(1, limits["users"])
+        user = Worker(transport.session(session_headers(user_id)), rng, user_id, limits)
+        local = {op: [] for op in operations}
+        local_errors = {op: 0 for op in operations}
+
+        while time.perf_counter() < deadline:
+            op = rng.choices(operations, weights)[0]
+            start = time.perf_counter()
+            try:
+                status = user.run(op)
+            except (OSError, http.client.HTTPException):
+                status = 599
+            elapsed = time.perf_counter() - start
+            if status < 400 or status in EXPECTED_CONFLICTS:
+                local[op].append(elapsed)
+            else:
+                local_errors[op] += 1
+
+        with lock:
+            for op in operations:
+                latencies[op].extend(local[op])
+                errors[op] += local_errors[op]
+
+    start = time.perf_counter()
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    return {
+        "duration_s": round(elapsed, 2),
+        "total": summarize(
+            [value for values in latencies.values() for value in values],
+            elapsed,
+            sum(errors.values()),
+        ),
+        "paths": {op: summarize(latencies[op], elapsed, errors[op]) for op in operations},
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        ).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def compare(current, baseline, threshold):
+    """Print per-operation changes against a previous result file and
+    return the operations whose p95 or throughput regressed"""
+    regressions = []
+    print(f"\ncompared with {baseline.get('commit')} ({baseline.get('timestamp')}):")
+    for op, stats in current["results"]["paths"].items():
+        before = baseline["results"]["paths"].get(op)
+        if not before or not before["p95_ms"] or not stats["p95_ms"]:
+            continue
+        p95_change = (stats["p95_ms"] - before["p95_ms"]) / before["p95_ms"] * 100
+        rps_change = (stats["rps"] - before["rps"]) / before["rps"] * 100
+        flag = ""
+        if p95_change > threshold or rps_change < -threshold:
+            flag = "  REGRESSION"
+            regressions.append(op)
+        print(f"  {op:10} p95 {p95_change:+6.1f}%   req/s {rps_change:+6.1f}%{flag}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the library API")
+    parser.add_argument("--books", type=int, default=1000)
+    parser.add_argument("--copies", type=int, default=3, help="mean copies per book")
+    parser.add_argument("--users", type=int, default=200, help="synthetic users")
+    parser.add_argument("--keywords", type=int, default=100, help="synthetic keywords")
+    parser.add_argument("--loans", type=int, default=300)
+    parser.add_argument("--requests", type=int, default=300, help="queued requests")
+    parser.add_argument("--transport", choices=["client", "http"], default="client")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--duration", type=float, default=10.0)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--out", help="write the JSON result here")
+    parser.add_argument("--compare", help="previous JSON result to diff against")
+    parser.add_argument("--threshold", type=float, default=10.0, help="regression threshold in percent")
+    args = parser.parse_args()
+
+    path = os.path.join(tempfile.mkdtemp(prefix="library-bench-"), "bench.db")
+    database.configure_db(path, pool_size=max(8, args.concurrency))
+    counts = build_library(path, args)
+    print(f"library: {counts}")
+
+    from backend import app
+
+    transport = (HTTPTransport if args.transport == "http" else TestClientTransport)(app)
+    limits = {
+        "users": counts["users"],
+        "books": counts["books"],
+        "copies": counts["book_copies"],
+    }
+    try:
+        results = run_workload(
+            transport, DEFAULT_MIX, limits, args.concurrency, args.duration, args.seed
+        )
+    finally:
+        transport.close()
+
+    print_report(results)
+
+    report = {
+        "commit": git_commit(),
+        "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "params": vars(args),
+        "library": counts,
+        "mix": DEFAULT_MIX,
+        "results": results,
+    }
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(report, f, indent=2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(report, json.load(f), args.threshold)
+        if regressions:
+            raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,391 @@
+"""Live change feed over Server-Sent Events.
+
+Triggers append every borrow, return, request, cancellation and copy
+addition or removal to the `changes` table, in the same transaction as
+the change. GET /api/changes/stream sends them to clients as SSE, one
+event per change, with the change's seq as the event id:
+
+    id: 1042
+    data: {"seq": 1042, "kind": "copy_returned", "book_id": 7, ...}
+
+Clients can narrow the stream with book_id=, copy_id= and user_id=.
+Anyone may open the stream, but without a session it carries only
+PUBLIC_FIELDS: what changed, not who borrowed or requested it or when
+it's due. A user_id= filter needs token=, a stream token from
+GET /api/changes/token (EventSource can't send an Authorization
+header), for that user or an admin; it then gets the full events, as
+does an admin's token on any stream. A reconnecting EventSource sends Last-Event-ID and resumes after that seq;
+?since= does the same for the first connection. If the requested seq has
+already been pruned (see scheduler.prune_changes), the stream sends an
+`event: reset` first, and the client should reload what it shows.
+
+One hub per process polls the table every LIBRARY_CHANGES_POLL seconds
+(default 0.5) on its own connection and keeps the last
+LIBRARY_CHANGES_BUFFER changes in memory. Every subscriber reads from
+that buffer, so the database cost doesn't grow with the number of open
+streams. Only a client resuming from further back than the buffer reads
+the table itself.
+
+Streams end after LIBRARY_CHANGES_STREAM_TTL seconds (default 300) and
+the browser reconnects. Under the dev server each open stream holds a
+request thread. serve.py instead answers the stream on its event loop
+(see serve_asgi), so streams don't take executor threads.
+"""
+
+import asyncio
+import json
+import logging
+import os
+import threading
+import time
+from collections import deque
+from urllib.parse import parse_qs
+
+from flask import Response, jsonify, request, stream_with_context
+
+import auth
+from database import connect
+
+POLL_INTERVAL = float(os.environ.get("LIBRARY_CHANGES_POLL", "0.5"))
+BUFFER_SIZE = int(os.environ.get("LIBRARY_CHANGES_BUFFER", "10000"))
+STREAM_TTL = float(os.environ.get("LIBRARY_CHANGES_STREAM_TTL", "300"))
+KEEPALIVE = 15
+BACKLOG_LIMIT = 1000
+RETRY_MS = 3000
+
+STREAM_PATH = "/api/changes/stream"
+FILTERS = ("book_id", "copy_id", "user_id")
+COLUMNS = "seq, kind, book_id, copy_id, user_id, payload, created_at"
+PUBLIC_FIELDS = ("seq", "kind", "book_id", "copy_id", "created_at")
+
+logger = logging.getLogger("library.changes")
+
+
+def to_event(row):
+    event = dict(row)
+    payload = event.pop("payload")
+    if payload:
+        event.update(json.loads(payload))
+    return event
+
+
+class ChangeHub:
+    """Polls the changes table and fans new rows out to every subscriber"""
+
+    def __init__(self, path=None, interval=POLL_INTERVAL, buffer_size=BUFFER_SIZE):
+        self.path = path
+        self.interval = interval
+        self.latest = 0
+        self._events = deque(maxlen=buffer_size)
+        # Everything after this seq is in the buffer
+        self._floor = 0
+        self._cond = threading.Condition()
+        self._watchers = set()
+        self._stop = threading.Event()
+        self._thread = None
+        self._conn = None
+        self._db_lock = threading.Lock()
+
+    def start(self):
+        with self._cond:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._stop.clear()
+            self._conn = connect(self.path)
+            self.latest = self._floor = self._conn.execute(
+                "SELECT COALESCE(MAX(seq), 0) FROM changes"
+            ).fetchone()[0]
+            self._events.clear()
+            self._thread = threading.Thread(target=self.run, name="library-changes", daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout=10):
+        self._stop.set()
+        with self._cond:
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    @property
+    def stopped(self):
+        return self._stop.is_set()
+
+    def run(self):
+        while not self._stop.is_set():
+            try:
+                self.poll()
+            except Exception:
+                logger.exception("polling changes failed")
+            self._stop.wait(self.interval)
+
+    def poll(self):
+        with self._db_lock:
+            rows = self._conn.execute(
+                f"SELECT {COLUMNS} FROM changes WHERE seq > ? ORDER BY seq LIMIT ?",
+                (self.latest, BACKLOG_LIMIT),
+            ).fetchall()
+        if not rows:
+            return
+        events = [to_event(row) for row in rows]
+        with self._cond:
+            if len(self._events) + len(events) > self._events.maxlen:
+                dropped = len(self._events) + len(events) - self._events.maxlen
+                self._floor = (list(self._events) + events)[dropped - 1]["seq"]
+            self._events.extend(events)
+            self.latest = events[-1]["seq"]
+            self._cond.notify_all()
+            watchers = list(self._watchers)
+        for wake in watchers:
+            wake()
+
+    def watch(self, wake):
+        """Call `wake()` from the polling thread whenever changes arrive"""
+        with self._cond:
+            self._watchers.add(wake)
+
+    def unwatch(self, wake):
+        with self._cond:
+            self._watchers.discard(wake)
+
+    def buffered(self, since):
+        """Changes after `since` from the buffer, or None if they start
+        before it"""
+        with self._cond:
+            if since == self.latest:
+                return []
+            if self._floor <= since < self.latest:
+                return [event for event in self._events if event["seq"] > since]
+        return None
+
+    def read(self, since):
+        """Changes after `since`, without waiting. Returns (events, reset),
+        where reset means changes after `since` were already pruned."""
+        events = self.buffered(since)
+        if events is None:
+            return self.backlog(since)
+        return events, False
+
+    def wait(self, since, timeout):
+        """Like read(), but wait up to `timeout` seconds for new changes"""
+        with self._cond:
+            self._cond.wait_for(lambda: self.latest > since or self.stopped, timeout)
+        return self.read(since)
+
+    def backlog(self, since):
+        """Read changes older than the buffer from the table"""
+        with self._db_lock:
+            oldest, newest = self._conn.execute(
+                "SELECT MIN(seq), MAX(seq) FROM changes"
+            ).fetchone()
+            # Pruned already, or a seq from another database
+            if oldest is None or not oldest - 1 <= since <= newest:
+                return [], True
+            rows = self._conn.execute(
+                f"SELECT {COLUMNS} FROM changes WHERE seq > ? AND seq <= ? ORDER BY seq LIMIT ?",
+                (since, self.latest, BACKLOG_LIMIT),
+            ).fetchall()
+        return [to_event(row) for row in rows], False
+
+
+hub = ChangeHub()
+
+
+def parse_stream_args(args, last_event_id):
+    """(since, filters) from the query arguments and Last-Event-ID. Raises
+    ValueError on non-integer values."""
+    filters = {name: int(args[name]) for name in FILTERS if args.get(name)}
+    since = last_event_id or args.get("since")
+    return (int(since) if since else None), filters
+
+
+class StreamDenied(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+
+def stream_access(filters, token):
+    """Whether the stream may send full events rather than PUBLIC_FIELDS.
+    Raises StreamDenied if the user_id filter isn't the token's user's."""
+    session = auth.stream_session(token)
+    is_admin = session is not None and session.get("role") == "admin"
+    if "user_id" in filters:
+        if session is None:
+            raise StreamDenied(401, "A stream token is required to filter by user_id")
+        if not is_admin and session.get("uid") != filters["user_id"]:
+            raise StreamDenied(403, "Forbidden")
+        return True
+    return is_admin
+
+
+def matches(event, filters):
+    return all(event[name] == value for name, value in filters.items())
+
+
+def format_event(event, full):
+    if not full:
+        event = {name: event[name] for name in PUBLIC_FIELDS}
+    return f"id: {event['seq']}\ndata: {json.dumps(event, separators=(',', ':'))}\n\n"
+
+
+def stream_chunks(since, filters, full, next_batch):
+    """Generate the SSE text of one stream. `next_batch(since)` returns
+    (events, reset) or None when the stream should end."""
+    yield f"retry: {RETRY_MS}\n\n"
+    if since is None:
+        since = hub.latest
+    while True:
+        batch = next_batch(since)
+        if batch is None:
+            return
+        events, reset = batch
+        if reset:
+            since = hub.latest
+            yield f"id: {since}\nevent: reset\ndata: {{}}\n\n"
+            continue
+        if not events:
+            yield ": keepalive\n\n"
+            continue
+        chunk = "".join(format_event(event, full) for event in events if matches(event, filters))
+        since = events[-1]["seq"]
+        if chunk:
+            yield chunk
+
+
+def init_app(app):
+    """Register the change stream and its token endpoint"""
+
+    @app.route("/api/changes/token", methods=["GET"])
+    @auth.login_required()
+    def stream_token():
+        return jsonify({"token": auth.issue_stream_token(), "expires_in": auth.STREAM_TOKEN_TTL}), 200
+
+    @app.route(STREAM_PATH, methods=["GET"])
+    def stream_changes():
+        try:
+            since, filters = parse_stream_args(
+                request.args, request.headers.get("Last-Event-ID")
+            )
+        except ValueError:
+            return jsonify({"error": "since, Last-Event-ID and filters must be integers"}), 400
+        try:
+            full = stream_access(filters, request.args.get("token"))
+        except StreamDenied as denied:
+            return jsonify({"error": denied.message}), denied.status
+        hub.start()
+        deadline = time.monotonic() + STREAM_TTL
+
+        def next_batch(since):
+            remaining = deadline - time.monotonic()
+            if hub.stopped or remaining <= 0:
+                return None
+            return hub.wait(since, min(KEEPALIVE, remaining))
+
+        return Response(
+            stream_with_context(stream_chunks(since, filters, full, next_batch)),
+            mimetype="text/event-stream",
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        )
+
+
+async def send_error(send, status, message):
+    await send(
+        {
+            "type": "http.response.start",
+            "status": status,
+            "headers": [(b"content-type", b"application/json")],
+        }
+    )
+    await send({"type": "http.response.body", "body": json.dumps({"error": message}).encode()})
+
+
+async def serve_asgi(scope, receive, send):
+    """Answer the change stream on the event loop instead of a request
+    thread. Used by serve.py."""
+    query = {k: v[-1] for k, v in parse_qs(scope["query_string"].decode("latin-1")).items()}
+    headers = {name.decode("latin-1").lower(): value.decode("latin-1") for name, value in scope["headers"]}
+    try:
+        since, filters = parse_stream_args(query, headers.get("last-event-id"))
+        full = stream_access(filters, query.get("token"))
+    except ValueError:
+        await send_error(send, 400, "since, Last-Event-ID and filters must be integers")
+        return
+    except StreamDenied as denied:
+        await send_error(send, denied.status, denied.message)
+        return
+
+    loop = asyncio.get_running_loop()
+    await loop.run_in_executor(None, hub.start)
+    woken = asyncio.Event()
+    disconnected = asyncio.Event()
+
+    def wake():
+        loop.call_soon_threadsafe(woken.set)
+
+    async def watch_disconnect():
+        while (await receive())["type"] != "http.disconnect":
+            pass
+        disconnected.set()
+        woken.set()
+
+    async def next_chunk(since):
+        # Same framing as stream_chunks, driven by wake-ups instead of a
+        # blocking wait
+        woken.clear()
+        events = hub.buffered(since)
+        if events is None:
+            # Resuming from before the buffer reads the table
+            events, reset = await loop.run_in_executor(None, hub.backlog, since)
+            if events or reset:
+                return events, reset
+        elif events:
+            return events, False
+        try:
+            await asyncio.wait_for(woken.wait(), min(KEEPALIVE, deadline - loop.time()))
+        except asyncio.TimeoutError:
+            pass
+        return [], False
+
+    async def send_text(text):
+        await send({"type": "http.response.body", "body": text.encode(), "more_body": True})
+
+    hub.watch(wake)
+    listener = asyncio.ensure_future(watch_disconnect())
+    deadline = loop.time() + STREAM_TTL
+    try:
+        await send(
+            {
+                "type": "http.response.start",
+                "status": 200,
+                "headers": [
+                    (b"content-type", b"text/event-stream; charset=utf-8"),
+                    (b"cache-control", b"no-cache"),
+                    (b"x-accel-buffering", b"no"),
+                ],
+            }
+        )
+        await send_text(f"retry: {RETRY_MS}\n\n")
+        if since is None:
+            since = hub.latest
+        while not disconnected.is_set() and not hub.stopped and loop.time() < deadline:
+            events, reset = await next_chunk(since)
+            if reset:
+                since = hub.latest
+                await send_text(f"id: {since}\nevent: reset\ndata: {{}}\n\n")
+            elif events:
+                text = "".join(format_event(event, full) for event in events if matches(event, filters))
+                since = events[-1]["seq"]
+                if text:
+                    await send_text(text)
+            elif not woken.is_set():
+                await send_text(": keepalive\n\n")
+        if not disconnected.is_set():
+            await send({"type": "http.response.body", "body": b""})
+    finally:
+        hub.unwatch(wake)
+        listener.cancel()
@@ -0,0 +1,8 @@
+// fetch() that sends the signed-in user's session token, if there is one.
+// The token comes from the saved session, so any component can use it.
+export default function authFetch(url, options = {}) {
+  const saved = JSON.parse(localStorage.getItem("librix_currUser") || "null");
+  const headers = { ...options.headers };
+  if (saved?.token) headers.Authorization = `Bearer ${saved.token}`;
+  return fetch(url, { ...options, headers });
+}
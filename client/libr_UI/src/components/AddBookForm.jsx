@@ -20,7 +20,7 @@ import ChipInput from "./ChipInput";
 import "./compStyles/addbook.css";
 export default function AddBookForm() {
   const { submitNewBook, setBooks } = useBooksData();
-  const { fetchBooks } = useOutletContext();
+  const { refreshStats } = useOutletContext();
 
   const [bookInputVal, setBookInputVal] = useState({
     title: "",
@@ -112,7 +112,7 @@ export default function AddBookForm() {
       setBooks((prev) => [...prev, result]);
       setSuccess(true);
       resetForm();
-      fetchBooks();
+      refreshStats();
 
       setTimeout(() => setSuccess(false), 4000);
     } catch (err) {
@@ -22,6 +22,8 @@ import {
   MenuBook as MenuBookIcon,
   CheckCircle as CheckCircleIcon,
 } from "@mui/icons-material";
+import useChanges from "../hooks/useChanges";
+import authFetch from "../authFetch";
 
 export default function BookInfos({ book, setCloseDialog, currUser }) {
   const [copies, setCopies] = useState([]);
@@ -57,7 +59,7 @@ export default function BookInfos({ book, setCloseDialog, currUser }) {
 
   const fetchUserBorrowedBooks = async () => {
     try {
-      const response = await fetch(
+      const response = await authFetch(
         `/api/users/${currUser?.user?.user_id}/borrowed`
       );
       if (!response.ok) {
@@ -75,6 +77,24 @@ export default function BookInfos({ book, setCloseDialog, currUser }) {
     fetchUserBorrowedBooks();
   }, [book.id, currUser?.user?.user_id]);
 
+  // Keep availability current without re-fetching the copies
+  useChanges({ book_id: book.id }, (change) => {
+    if (change.kind === "copy_borrowed" || change.kind === "copy_returned") {
+      const is_available = change.kind === "copy_returned" ? 1 : 0;
+      setCopies((list) =>
+        list.map((c) =>
+          c.copy_id === change.copy_id ? { ...c, is_available } : c
+        )
+      );
+    } else if (
+      change.kind === "copy_added" ||
+      change.kind === "copy_deleted" ||
+      change.kind === "reset"
+    ) {
+      fetchCopies();
+    }
+  });
+
   const selectedCopyData = copies.find((c) => c.copy_id === selectedCopy);
   const isBorrowed = selectedCopyData?.is_available === 0;
   const isUserBorrowedCopy = userBorrowedBooks.includes(selectedCopy);
@@ -96,7 +116,7 @@ export default function BookInfos({ book, setCloseDialog, currUser }) {
       const dueDate = new Date();
       dueDate.setDate(dueDate.getDate() + 15);
 
-      const response = await fetch(`/api/books/copies/${selectedCopy}/borrow`, {
+      const response = await authFetch(`/api/books/copies/${selectedCopy}/borrow`, {
         method: "POST",
         headers: {
           "Content-Type": "application/json",
@@ -140,7 +160,7 @@ export default function BookInfos({ book, setCloseDialog, currUser }) {
       setLoading(true);
       setError(null);
 
-      const response = await fetch(
+      const response = await authFetch(
         `/api/books/copies/${selectedCopy}/request`,
         {
           method: "POST",
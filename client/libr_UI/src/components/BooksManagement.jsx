@@ -20,7 +20,6 @@ import {
   TableHead,
   TableRow,
   Paper,
-  Pagination,
   CircularProgress,
   Alert,
   Stack,
@@ -35,11 +34,19 @@ import {
   Clear as ClearIcon,
 } from "@mui/icons-material";
 import "../components/compStyles/booksmanagement.css";
+import authFetch from "../authFetch";
+
+const PAGE_SIZE = 5;
 
 export default function BooksManagement() {
-  const { books, loading, fetchBooks } = useOutletContext();
+  const { refreshStats } = useOutletContext();
 
   // --- States ---
+  const [books, setBooks] = useState([]);
+  const [loading, setLoading] = useState(false);
+  // Keyset paging: the cursor each visited page starts after, and the next one
+  const [pageCursors, setPageCursors] = useState([null]);
+  const [nextCursor, setNextCursor] = useState(null);
   const [searchTerm, setSearchTerm] = useState("");
   const [expandedBook, setExpandedBook] = useState(null);
   const [bookCopies, setBookCopies] = useState({});
@@ -52,30 +59,51 @@ export default function BooksManagement() {
   const [msg, setMsg] = useState(null);
   const [page, setPage] = useState(1);
   const [loadingCopies, setLoadingCopies] = useState(false);
-  const itemsPerPage = 5;
 
-  useEffect(() => {
-    fetchBooks();
-  }, []);
+  // Only one page of the catalog (or of the search results) is loaded
+  const fetchBooks = async (after = pageCursors[page - 1]) => {
+    const params = new URLSearchParams({ limit: PAGE_SIZE });
+    if (after) params.set("after", after);
+    const query = searchTerm.trim();
+    if (query) params.set("q", query);
+    try {
+      setLoading(true);
+      const response = await fetch(
+        `/api/books${query ? "/search" : ""}?${params}`
+      );
+      const data = await response.json();
+      setBooks(data.books || []);
+      setNextCursor(data.next_cursor);
+    } catch (err) {
+      setError(`Failed to load books, Error:${err}`);
+    } finally {
+      setLoading(false);
+    }
+  };
 
-  const filteredBooks = books.filter(
-    (book) =>
-      book.title.toLowerCase().includes(searchTerm.toLowerCase()) ||
-      book.catalog_code.toLowerCase().includes(searchTerm.toLowerCase()) ||
-      book.theme.toLowerCase().includes(searchTerm.toLowerCase())
-  );
+  // A new search starts again from the first page
+  useEffect(() => {
+    const timer = setTimeout(() => {
+      setPage(1);
+      setPageCursors([null]);
+      fetchBooks(null);
+    }, 300);
+    return () => clearTimeout(timer);
+  }, [searchTerm]);
 
-  const totalPages = Math.ceil(filteredBooks.length / itemsPerPage);
-  const paginatedBooks = filteredBooks.slice(
-    (page - 1) * itemsPerPage,
-    page * itemsPerPage
-  );
+  const goToPage = (newPage) => {
+    const cursors =
+      newPage > page ? [...pageCursors.slice(0, page), nextCursor] : pageCursors;
+    setPageCursors(cursors);
+    setPage(newPage);
+    fetchBooks(cursors[newPage - 1]);
+  };
 
   // --- Handlers ---
   const fetchCopies = async (bookId) => {
     try {
       setLoadingCopies(true);
-      const response = await fetch(
+      const response = await authFetch(
         `http://127.0.0.1:5000/api/books/${bookId}/copies`
       );
       const data = await response.json();
@@ -96,13 +124,14 @@ export default function BooksManagement() {
 
   const handleConfirmDelete = async () => {
     try {
-      const response = await fetch(
+      const response = await authFetch(
         `http://127.0.0.1:5000/api/books/${bookToDelete.id}/delete`,
         { method: "DELETE" }
       );
       if (response.ok) {
         setMsg("Book deleted successfully.");
         fetchBooks();
+        refreshStats();
       }
     } catch (err) {
       setError(`Server connection failed, Error:${err}`);
@@ -115,7 +144,7 @@ export default function BooksManagement() {
   const handleAddCopy = async () => {
     if (!newCopy.location.trim()) return setError("Location is required");
     try {
-      const response = await fetch(
+      const response = await authFetch(
         `http://127.0.0.1:5000/api/books/${selectedBook.id}/copies`,
         {
           method: "POST",
@@ -128,6 +157,7 @@ export default function BooksManagement() {
       );
       if (response.ok) {
         fetchCopies(selectedBook.id);
+        refreshStats();
         setOpenDialog(false);
         setNewCopy({ location: "", publisher: "" });
       }
@@ -138,7 +168,7 @@ export default function BooksManagement() {
 
   const handleDeleteCopy = async (copyId, bookId) => {
     try {
-      const response = await fetch(
+      const response = await authFetch(
         `http://127.0.0.1:5000/api/books/copies/${copyId}`,
         {
           method: "DELETE",
@@ -147,6 +177,7 @@ export default function BooksManagement() {
 
       if (response.ok) {
         fetchCopies(bookId);
+        refreshStats();
       } else {
         const data = await response.json();
         setError(data.error || "Failed to delete copy.");
@@ -173,10 +204,7 @@ export default function BooksManagement() {
         fullWidth
         placeholder="Search books..."
         value={searchTerm}
-        onChange={(e) => {
-          setSearchTerm(e.target.value);
-          setPage(1);
-        }}
+        onChange={(e) => setSearchTerm(e.target.value)}
         sx={{ mb: 3, backgroundColor: "white" }}
         InputProps={{
           startAdornment: (
@@ -203,7 +231,7 @@ export default function BooksManagement() {
         </Alert>
       )}
 
-      {paginatedBooks.map((book) => (
+      {books.map((book) => (
         <Accordion
           key={book.id}
           expanded={expandedBook === book.id}
@@ -344,13 +372,22 @@ export default function BooksManagement() {
         </Accordion>
       ))}
 
-      <Box sx={{ mt: 3, display: "flex", justifyContent: "center" }}>
-        <Pagination
-          count={totalPages}
-          page={page}
-          onChange={(e, v) => setPage(v)}
-          color="primary"
-        />
+      <Box
+        sx={{
+          mt: 3,
+          display: "flex",
+          justifyContent: "center",
+          alignItems: "center",
+          gap: 2,
+        }}
+      >
+        <Button disabled={page === 1 || loading} onClick={() => goToPage(page - 1)}>
+          Previous
+        </Button>
+        <Typography>Page {page}</Typography>
+        <Button disabled={!nextCursor || loading} onClick={() => goToPage(page + 1)}>
+          Next
+        </Button>
       </Box>
 
       {/* DELETE BOOK DIALOG */}
@@ -9,6 +9,7 @@ import {
 } from "@mui/icons-material";
 import "./compStyles/userlist.css";
 import { useUsersData } from "../contexts/userDataContext";
+import authFetch from "../authFetch";
 
 export default function UsersList() {
   const { setCurrUser, currUser } = useUsersData();
@@ -39,7 +40,7 @@ export default function UsersList() {
   const fetchUsers = async () => {
     try {
       setLoading(true);
-      const response = await fetch("/api/users");
+      const response = await authFetch("/api/users");
       if (!response.ok) throw new Error("Failed to fetch users");
       const data = await response.json();
       setUsers(data);
@@ -77,6 +78,13 @@ export default function UsersList() {
   const handleUserClick = async (user) => {
     setDetailPanelUser(user);
     setDetailDialogOpen(true);
+    // The list only carries the compact fields; load the full profile
+    try {
+      const response = await authFetch(`/api/users/${user.user_id}`);
+      if (response.ok) setDetailPanelUser(await response.json());
+    } catch (err) {
+      setError(err.message);
+    }
     await fetchUserBorrowedBooks(user.user_id);
     await fetchUserRequests(user.user_id);
   };
@@ -84,7 +92,7 @@ export default function UsersList() {
   const fetchUserBorrowedBooks = async (userId) => {
     try {
       setLoadingBooks(true);
-      const response = await fetch(`/api/users/${userId}/borrowed`);
+      const response = await authFetch(`/api/users/${userId}/borrowed`);
       if (!response.ok) throw new Error("Failed to fetch borrowed books");
       const data = await response.json();
       setBorrowedBooks(data);
@@ -98,7 +106,7 @@ export default function UsersList() {
   const fetchUserRequests = async (userId) => {
     try {
       setLoadingRequests(true);
-      const response = await fetch(`/api/users/${userId}/requests`);
+      const response = await authFetch(`/api/users/${userId}/requests`);
       if (!response.ok) throw new Error("Failed to fetch user requests");
       const data = await response.json();
       setUserRequests(data);
@@ -145,7 +153,7 @@ export default function UsersList() {
         method = "DELETE";
       }
 
-      const response = await fetch(endpoint, {
+      const response = await authFetch(endpoint, {
         method,
         headers: { "Content-Type": "application/json" },
         body: method === "DELETE" ? undefined : JSON.stringify(body),
@@ -182,7 +190,7 @@ export default function UsersList() {
   const handleCancelUserRequest = async (requestId) => {
     try {
       setCancellingRequest(true);
-      const response = await fetch(`/api/books/requests/${requestId}/cancel`, {
+      const response = await authFetch(`/api/books/requests/${requestId}/cancel`, {
         method: "POST",
         headers: { "Content-Type": "application/json" },
       });
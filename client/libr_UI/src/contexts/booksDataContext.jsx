@@ -1,4 +1,5 @@
 import { createContext, useContext, useState } from "react";
+import authFetch from "../authFetch";
 const API_BASE = "http://localhost:5000/api/books";
 const BooksContext = createContext(null);
 
@@ -7,7 +8,7 @@ export function BooksProvider({ children }) {
   const [searchQuery, setSearchQuery] = useState("");
 
   const submitNewBook = async (bookData) => {
-    const response = await fetch(`${API_BASE}`, {
+    const response = await authFetch(`${API_BASE}`, {
       method: "POST",
       headers: {
         "Content-Type": "application/json",
@@ -1,4 +1,5 @@
 import { createContext, useContext, useState, useEffect } from "react";
+import authFetch from "../authFetch";
 const API_BASE = "http://localhost:5000/api/";
 const UsersContext = createContext(null);
 
@@ -22,7 +23,7 @@ export function UsersProvider({ children }) {
   async function addUser(userData) {
     setUserLoading(true);
     try {
-      const res = await fetch(`${API_BASE}users`, {
+      const res = await authFetch(`${API_BASE}users`, {
         method: "POST",
         headers: { "Content-Type": "application/json" },
         body: JSON.stringify(userData),
@@ -42,7 +43,7 @@ export function UsersProvider({ children }) {
   async function fetchUsers() {
     setUserLoading(true);
     try {
-      const res = await fetch(`${API_BASE}users`);
+      const res = await authFetch(`${API_BASE}users`);
       if (!res.ok) throw new Error("Failed to fetch users");
       const data = await res.json();
       setUsers(data || []);
@@ -53,9 +54,11 @@ export function UsersProvider({ children }) {
     }
   }
 
+  // The user list is admin-only
+  const isAdmin = currUser?.user?.role === "admin";
   useEffect(() => {
-    fetchUsers();
-  }, []);
+    if (isAdmin) fetchUsers();
+  }, [isAdmin]);
 
   async function loginUser(userData) {
     setUserLoading(true);
@@ -75,7 +78,7 @@ export function UsersProvider({ children }) {
         return data;
       }
 
-      setCurrUser({ success: true, user: data.user });
+      setCurrUser({ success: true, user: data.user, token: data.token });
       return data;
     } finally {
       setUserLoading(false);
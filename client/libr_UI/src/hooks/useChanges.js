@@ -0,0 +1,59 @@
+import { useEffect, useRef } from "react";
+import authFetch from "../authFetch";
+
+// Subscribe to the server's change feed, narrowed with e.g. { user_id: 3 }.
+// onChange gets each change ({ kind, book_id, copy_id, user_id, ... }), or
+// { kind: "reset" } when the client missed changes and should reload.
+// Signed-in users get a short-lived stream token first: EventSource can't
+// send the Authorization header, and without one the server leaves out
+// who changed what (and refuses user_id filters).
+// EventSource reconnects by itself and resumes after the last change seen.
+// Once the token expires the server refuses the reconnect, so the stream
+// is reopened with a fresh token, from the last change seen.
+export default function useChanges(filters, onChange) {
+  const handler = useRef(onChange);
+  handler.current = onChange;
+
+  const query = new URLSearchParams(
+    Object.entries(filters).filter(([, value]) => value != null)
+  ).toString();
+
+  useEffect(() => {
+    if (!query) return;
+    let source = null;
+    let closed = false;
+    let lastId = null;
+
+    const open = async () => {
+      const params = new URLSearchParams(query);
+      if (lastId) params.set("since", lastId);
+      try {
+        const res = await authFetch("/api/changes/token");
+        if (res.ok) params.set("token", (await res.json()).token);
+      } catch (err) {
+        console.log("Error fetching stream token:", err);
+      }
+      if (closed) return;
+      source = new EventSource(`/api/changes/stream?${params}`);
+      source.onmessage = (e) => {
+        lastId = e.lastEventId;
+        handler.current(JSON.parse(e.data));
+      };
+      source.addEventListener("reset", (e) => {
+        lastId = e.lastEventId;
+        handler.current({ kind: "reset" });
+      });
+      source.onerror = () => {
+        if (source.readyState === EventSource.CLOSED && !closed) {
+          setTimeout(open, 3000);
+        }
+      };
+    };
+
+    open();
+    return () => {
+      closed = true;
+      source?.close();
+    };
+  }, [query]);
+}
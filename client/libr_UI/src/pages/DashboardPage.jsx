@@ -11,6 +11,7 @@ import {
   SpaceDashboard as SpaceDashboardIcon,
 } from "@mui/icons-material";
 import "../styles/dashboardpg.css";
+import authFetch from "../authFetch";
 
 const StatCard = ({ title, value, icon: Icon, color }) => (
   <Card className="stat-card">
@@ -32,37 +33,24 @@ const StatCard = ({ title, value, icon: Icon, color }) => (
 );
 
 export default function DashboardPage() {
-  const [books, setBooks] = useState([]);
-  const [users, setUsers] = useState([]);
-  const [loading, setLoading] = useState(false);
+  const [libraryStats, setLibraryStats] = useState({});
   const [tabValue, setTabValue] = useState(0);
   const location = useLocation();
 
-  // Fetch all data
-  const fetchBooks = async () => {
+  // Totals come precomputed from the server, whatever the library size.
+  // The catalog itself is paged by BooksManagement, never loaded here.
+  const fetchStats = async () => {
     try {
-      setLoading(true);
-      const response = await fetch("/api/books");
+      const response = await authFetch("/api/stats");
       const data = await response.json();
-      setBooks(data);
-    } finally {
-      setLoading(false);
-    }
-  };
-
-  const fetchUsers = async () => {
-    try {
-      const response = await fetch("/api/users");
-      const data = await response.json();
-      setUsers(data);
+      setLibraryStats(data);
     } catch {
       // Error handled silently or can be set to state
     }
   };
 
   useEffect(() => {
-    fetchBooks();
-    fetchUsers();
+    fetchStats();
   }, []);
 
   useEffect(() => {
@@ -76,18 +64,11 @@ export default function DashboardPage() {
   }, [location.pathname]);
   // Calculate statistics
   const stats = {
-    totalBooks: books.length,
-    totalUsers: users.length,
-    subscribers: users.filter((u) => u.is_subscribed).length,
-    availableBooks: books.reduce(
-      (sum, book) => sum + (book.available_copies || 0),
-      0
-    ),
-    borrowedBooks: books.reduce(
-      (sum, book) =>
-        sum + ((book.total_copies || 0) - (book.available_copies || 0)),
-      0
-    ),
+    totalBooks: libraryStats.books ?? 0,
+    totalUsers: libraryStats.users ?? 0,
+    subscribers: libraryStats.subscribers ?? 0,
+    availableBooks: libraryStats.available_copies ?? 0,
+    borrowedBooks: libraryStats.active_loans ?? 0,
   };
 
   const handleTabChange = (event, newValue) => {
@@ -188,12 +169,7 @@ export default function DashboardPage() {
         <div id="display-area" className="dashboard-display-area">
           <Outlet
             context={{
-              books,
-              loading,
-              fetchBooks,
-              setBooks,
-              users,
-              fetchUsers,
+              refreshStats: fetchStats,
             }}
           />
         </div>
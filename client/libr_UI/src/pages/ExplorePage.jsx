@@ -6,6 +6,7 @@ import {
   Box,
   Alert,
   CircularProgress,
+  Button,
 } from "@mui/material";
 import { useUsersData } from "../contexts/userDataContext";
 import { useBooksData } from "../contexts/booksDataContext";
@@ -14,6 +15,31 @@ import PersonIcon from "@mui/icons-material/Person";
 import ExploreIcon from "@mui/icons-material/Explore";
 import "../styles/explorePage.css";
 import { useOutletContext } from "react-router-dom";
+
+const PAGE_SIZE = 24;
+// Search box categories -> /api/books/search fields. Publisher isn't in
+// the search index, so it filters the listing by name instead.
+const SEARCH_FIELDS = {
+  title: "title",
+  keywords: "keywords",
+  catCode: "catalog_code",
+};
+
+// The endpoint and parameters for one page of what the page shows
+const pageUrl = (query, filterType, theme, after) => {
+  const params = new URLSearchParams({ limit: PAGE_SIZE });
+  if (theme !== "All") params.set("theme", theme);
+  if (after) params.set("after", after);
+  if (!query) return `/api/books?${params}`;
+  if (filterType === "publisher") {
+    params.set("publisher", query);
+    return `/api/books?${params}`;
+  }
+  params.set("q", query);
+  if (SEARCH_FIELDS[filterType]) params.set("field", SEARCH_FIELDS[filterType]);
+  return `/api/books/search?${params}`;
+};
+
 export default function ExplorePage() {
   const { filterType } = useOutletContext();
   const { currUser } = useUsersData();
@@ -22,7 +48,10 @@ export default function ExplorePage() {
   const [isOpenBookDialog, setIsOperBookDialog] = useState(false);
   const [currBook, setCurrBook] = useState(null);
   const [books, setBooks] = useState([]);
+  const [nextCursor, setNextCursor] = useState(null);
+  const [themes, setThemes] = useState([]);
   const [loading, setLoading] = useState(true);
+  const [loadingMore, setLoadingMore] = useState(false);
   const [error, setError] = useState(null);
   const [selectedTheme, setSelectedTheme] = useState("All");
 
@@ -41,29 +70,58 @@ export default function ExplorePage() {
     return themeMap[lowerTheme] || "#1976d2";
   };
 
+  // Only the pages the user has scrolled to are loaded; the server does
+  // the searching and filtering
+  const fetchPage = async (after) => {
+    const url = pageUrl(searchQuery.trim(), filterType, selectedTheme, after);
+    const response = await fetch(url);
+    if (!response.ok) throw new Error("Failed to fetch books");
+    return response.json();
+  };
+
   useEffect(() => {
-    const fetchBooks = async () => {
+    fetch("/api/themes")
+      .then((res) => (res.ok ? res.json() : []))
+      .then(setThemes)
+      .catch((err) => console.log("Error fetching themes:", err));
+  }, []);
+
+  // A new search or theme starts again from the first page. Typing is
+  // debounced so each keystroke doesn't send a request.
+  useEffect(() => {
+    let cancelled = false;
+    const timer = setTimeout(async () => {
       try {
         setLoading(true);
-        const response = await fetch("/api/books");
-        if (!response.ok) throw new Error("Failed to fetch books");
-        const data = await response.json();
-        setBooks(data);
+        const data = await fetchPage(null);
+        if (cancelled) return;
+        setBooks(data.books);
+        setNextCursor(data.next_cursor);
+        setError(null);
       } catch (err) {
-        setError(err.message);
+        if (!cancelled) setError(err.message);
       } finally {
-        setLoading(false);
+        if (!cancelled) setLoading(false);
       }
+    }, 300);
+    return () => {
+      cancelled = true;
+      clearTimeout(timer);
     };
-    fetchBooks();
-  }, []);
+  }, [searchQuery, filterType, selectedTheme]);
 
-  if (loading)
-    return (
-      <Box sx={{ display: "flex", justifyContent: "center", mt: 10 }}>
-        <CircularProgress />
-      </Box>
-    );
+  const loadMore = async () => {
+    try {
+      setLoadingMore(true);
+      const data = await fetchPage(nextCursor);
+      setBooks((list) => [...list, ...data.books]);
+      setNextCursor(data.next_cursor);
+    } catch (err) {
+      setError(err.message);
+    } finally {
+      setLoadingMore(false);
+    }
+  };
 
   if (error)
     return (
@@ -90,7 +148,7 @@ export default function ExplorePage() {
             mb: 4,
           }}
         >
-          {["All", ...new Set(books.map((b) => b.theme).filter(Boolean))].map(
+          {["All", ...themes].map(
             (theme) => {
               const isSelected = selectedTheme === theme;
               const themeColor = getThemeColor(theme);
@@ -125,81 +183,62 @@ export default function ExplorePage() {
         </Box>
         {/* Books Grid */}
 
-        {books.length > 0 ? (
+        {loading ? (
+          <Box sx={{ display: "flex", justifyContent: "center", mt: 10 }}>
+            <CircularProgress />
+          </Box>
+        ) : books.length > 0 ? (
           <div className="books-grid">
-            {books
-              .filter((book) => {
-                const matchesChip =
-                  selectedTheme === "All" || book.theme === selectedTheme;
-
-                const query = searchQuery.toLowerCase();
-
-                if (!query) return matchesChip;
-
-                const matchesSearch = {
-                  title: book.title?.toLowerCase().includes(query),
-                  publisher: book.publisher?.toLowerCase().includes(query),
-                  keywords: book.keywords?.toLowerCase().includes(query),
-                  catCode: book.catalog_code?.toLowerCase().includes(query),
-                };
-
-                const isSearchMatch =
-                  filterType === "all"
-                    ? Object.values(matchesSearch).some(Boolean)
-                    : matchesSearch[filterType];
-
-                return matchesChip && isSearchMatch;
-              })
-              .map((book) => {
-                const themeColor = getThemeColor(book.theme);
-
-                return (
-                  <div
-                    key={book.id}
-                    className="book-card"
-                    onClick={() => {
-                      setCurrBook(book);
-                      setIsOperBookDialog(true);
-                    }}
-                  >
-                    <div className="book-image-wrapper">
-                      <img
-                        src={book.poster}
-                        alt={book.title}
-                        className="book-image"
-                      />
-                    </div>
-                    <div className="book-info">
-                      <h3 className="book-title">{book.title}</h3>
-                      <Box
-                        sx={{
-                          display: "flex",
-                          alignItems: "center",
-                          gap: "6px",
-                          mt: 0.2,
-                        }}
-                      >
-                        <PersonIcon sx={{ fontSize: 11, opacity: 0.6 }} />
-                        <p className="book-author">{book.publisher}</p>
-                      </Box>
-                      <Chip
-                        label={book.theme || "General"}
-                        size="small"
-                        sx={{
-                          marginTop: "auto",
-                          width: "fit-content",
-                          mb: 1,
-                          fontSize: "0.65rem",
-                          fontWeight: "700",
-                          textTransform: "uppercase",
-                          backgroundColor: `${themeColor}15`,
-                          color: themeColor,
-                        }}
-                      />
-                    </div>
+            {books.map((book) => {
+              const themeColor = getThemeColor(book.theme);
+
+              return (
+                <div
+                  key={book.id}
+                  className="book-card"
+                  onClick={() => {
+                    setCurrBook(book);
+                    setIsOperBookDialog(true);
+                  }}
+                >
+                  <div className="book-image-wrapper">
+                    <img
+                      src={book.poster}
+                      alt={book.title}
+                      className="book-image"
+                    />
                   </div>
-                );
-              })}
+                  <div className="book-info">
+                    <h3 className="book-title">{book.title}</h3>
+                    <Box
+                      sx={{
+                        display: "flex",
+                        alignItems: "center",
+                        gap: "6px",
+                        mt: 0.2,
+                      }}
+                    >
+                      <PersonIcon sx={{ fontSize: 11, opacity: 0.6 }} />
+                      <p className="book-author">{book.publisher}</p>
+                    </Box>
+                    <Chip
+                      label={book.theme || "General"}
+                      size="small"
+                      sx={{
+                        marginTop: "auto",
+                        width: "fit-content",
+                        mb: 1,
+                        fontSize: "0.65rem",
+                        fontWeight: "700",
+                        textTransform: "uppercase",
+                        backgroundColor: `${themeColor}15`,
+                        color: themeColor,
+                      }}
+                    />
+                  </div>
+                </div>
+              );
+            })}
           </div>
         ) : (
           /* Styled Empty State */
@@ -213,6 +252,18 @@ export default function ExplorePage() {
           </div>
         )}
 
+        {!loading && nextCursor && (
+          <Box sx={{ display: "flex", justifyContent: "center", mt: 4 }}>
+            <Button
+              variant="outlined"
+              onClick={loadMore}
+              disabled={loadingMore}
+            >
+              {loadingMore ? "Loading..." : "Load more"}
+            </Button>
+          </Box>
+        )}
+
         {isOpenBookDialog && currBook && (
           <BookInfos
             book={currBook}
@@ -26,7 +26,9 @@ import {
   Close as CloseIcon,
 } from "@mui/icons-material";
 import { useUsersData } from "../contexts/userDataContext";
+import useChanges from "../hooks/useChanges";
 import "../styles/mybookspg.css";
+import authFetch from "../authFetch";
 
 export default function MyBooks() {
   const { currUser } = useUsersData();
@@ -47,7 +49,7 @@ export default function MyBooks() {
     try {
       setLoading(true);
       setError(null);
-      const response = await fetch(
+      const response = await authFetch(
         `/api/users/${currUser.user.user_id}/borrowed`
       );
       if (!response.ok) throw new Error("Failed to fetch borrowed books");
@@ -63,7 +65,7 @@ export default function MyBooks() {
   const fetchUserRequests = async () => {
     if (!currUser?.user?.user_id) return;
     try {
-      const response = await fetch(
+      const response = await authFetch(
         `/api/users/${currUser.user.user_id}/requests`
       );
       if (!response.ok) throw new Error("Failed to fetch requests");
@@ -79,6 +81,26 @@ export default function MyBooks() {
     fetchUserRequests();
   }, [currUser?.user?.user_id]);
 
+  // Apply this user's loan and request changes as they happen
+  useChanges({ user_id: currUser?.user?.user_id }, (change) => {
+    if (change.kind === "copy_returned" || change.kind === "copy_deleted") {
+      setBorrowedBooks((books) =>
+        books.filter((b) => b.copy_id !== change.copy_id)
+      );
+    } else if (change.kind === "request_removed") {
+      setRequestedBooks((requests) =>
+        requests.filter((r) => r.request_id !== change.request_id)
+      );
+    } else if (change.kind === "request_added") {
+      fetchUserRequests();
+    } else if (change.kind === "reset") {
+      fetchBorrowedBooks();
+      fetchUserRequests();
+    } else {
+      fetchBorrowedBooks();
+    }
+  });
+
   const getDueStatus = (dueDate) => {
     const due = new Date(dueDate);
     const today = new Date();
@@ -103,7 +125,7 @@ export default function MyBooks() {
     try {
       setReturning(true);
       setError(null);
-      const response = await fetch(`/api/books/copies/${copyId}/return`, {
+      const response = await authFetch(`/api/books/copies/${copyId}/return`, {
         method: "POST",
         headers: { "Content-Type": "application/json" },
       });
@@ -116,10 +138,6 @@ export default function MyBooks() {
         }`
       );
 
-      // Refresh both borrowed and requested books
-      await fetchBorrowedBooks();
-      await fetchUserRequests();
-
       setTimeout(() => {
         setOpenDialog(false);
         setSelectedBook(null);
@@ -136,7 +154,7 @@ export default function MyBooks() {
     try {
       setCancelling(true);
       setError(null);
-      const response = await fetch(`/api/books/requests/${requestId}/cancel`, {
+      const response = await authFetch(`/api/books/requests/${requestId}/cancel`, {
         method: "POST",
         headers: { "Content-Type": "application/json" },
       });
@@ -146,9 +164,6 @@ export default function MyBooks() {
 
       setSuccess("Request cancelled successfully");
 
-      // Refresh requested books
-      await fetchUserRequests();
-
       setTimeout(() => {
         setOpenDialog(false);
         setSelectedBook(null);
@@ -1,19 +1,334 @@
+import os
+import queue
 import sqlite3
-from flask import g
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from flask import g, has_request_context, request
+
+import metrics
+
+DB_PATH = os.environ.get("LIBRARY_DB_PATH", "data.db")
+POOL_SIZE = int(os.environ.get("LIBRARY_DB_POOL_SIZE", "8"))
+# 0 keeps a single pool shared by readers and writers
+WRITER_POOL_SIZE = int(os.environ.get("LIBRARY_DB_WRITERS", "0"))
+
+# Applied once to every pooled connection when it is opened
+CONNECTION_PRAGMAS = (
+    "PRAGMA foreign_keys = ON",
+    "PRAGMA synchronous = NORMAL",
+    "PRAGMA cache_size = -65536",  # 64 MiB
+    "PRAGMA mmap_size = 268435456",  # 256 MiB
+    "PRAGMA temp_store = MEMORY",
+    "PRAGMA busy_timeout = 5000",
+)
+
+
+# Name column of each cached lookup table
+LOOKUP_TABLES = {
+    "themes": "name",
+    "publishers": "name",
+    "authors": "name",
+    "keyword": "word",
+}
+LOOKUP_CACHE_SIZE = int(os.environ.get("LIBRARY_LOOKUP_CACHE_SIZE", "50000"))
+LOOKUP_CHECK_INTERVAL = 5.0
+
+
+class LookupCache:
+    """Process-wide, bounded name <-> id cache for the lookup tables.
+
+    Name -> id pairs never change once created, except through UPDATE or
+    DELETE on a lookup table. Triggers count those in lookup_version, and
+    the cache drops everything when that row changes, which catches
+    out-of-process edits at most LOOKUP_CHECK_INTERVAL seconds late.
+    New names inserted elsewhere, e.g. by seed_books.py, are just misses.
+    """
+
+    def __init__(self, max_entries=LOOKUP_CACHE_SIZE):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._by_name = {table: OrderedDict() for table in LOOKUP_TABLES}
+        self._by_id = {table: {} for table in LOOKUP_TABLES}
+        self._version = None
+        self._checked_at = 0.0
+
+    def validate(self, db):
+        """Drop the cache if lookup rows were changed since the last check"""
+        now = time.monotonic()
+        if now - self._checked_at < LOOKUP_CHECK_INTERVAL:
+            return
+        self._checked_at = now
+        row = db.execute("SELECT token, version FROM lookup_version").fetchone()
+        version = tuple(row) if row else None
+        if version != self._version:
+            self.invalidate()
+            self._version = version
+
+    def get_ids(self, table, names):
+        """Split names into cached {name: id} and the list still to resolve"""
+        found = {}
+        missing = []
+        with self._lock:
+            by_name = self._by_name[table]
+            for name in names:
+                row_id = by_name.get(name)
+                if row_id is None:
+                    missing.append(name)
+                else:
+                    by_name.move_to_end(name)
+                    found[name] = row_id
+            self.hits += len(found)
+            self.misses += len(missing)
+        return found, missing
+
+    def get_names(self, table, ids):
+        found = {}
+        missing = []
+        with self._lock:
+            by_id = self._by_id[table]
+            for row_id in ids:
+                name = by_id.get(row_id)
+                if name is None:
+                    missing.append(row_id)
+                else:
+                    found[row_id] = name
+            self.hits += len(found)
+            self.misses += len(missing)
+        return found, missing
+
+    def put(self, table, pairs):
+        """Remember (name, id) pairs, evicting the least recently used"""
+        with self._lock:
+            by_name = self._by_name[table]
+            by_id = self._by_id[table]
+            for name, row_id in pairs:
+                by_name[name] = row_id
+                by_name.move_to_end(name)
+                by_id[row_id] = name
+            while len(by_name) > self.max_entries:
+                name, row_id = by_name.popitem(last=False)
+                by_id.pop(row_id, None)
+
+    def invalidate(self, table=None):
+        with self._lock:
+            for name in [table] if table else LOOKUP_TABLES:
+                self._by_name[name].clear()
+                self._by_id[name].clear()
+
+    def warm(self, db):
+        """Preload the lookup tables up to the cache bound"""
+        self.validate(db)
+        for table, column in LOOKUP_TABLES.items():
+            rows = db.execute(
+                f"SELECT {column}, id FROM {table} WHERE {column} IS NOT NULL LIMIT ?",
+                (self.max_entries,),
+            ).fetchall()
+            self.put(table, [tuple(row) for row in rows])
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / lookups, 4) if lookups else None,
+                "entries": {table: len(names) for table, names in self._by_name.items()},
+                "max_entries": self.max_entries,
+            }
+
+
+lookup_cache = LookupCache()
+
+
+class LibraryConnection(sqlite3.Connection):
+    """Connection that publishes lookup ids to the cache only once the
+    transaction that may have created them has committed"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.pending_lookups = []
+
+    def commit(self):
+        super().commit()
+        for table, pairs in self.pending_lookups:
+            lookup_cache.put(table, pairs)
+        self.pending_lookups.clear()
+
+    def rollback(self):
+        super().rollback()
+        self.pending_lookups.clear()
+
+
+class ProfiledCursor(metrics.TimedExecute, sqlite3.Cursor):
+    pass
+
+
+class ProfiledConnection(metrics.TimedExecute, LibraryConnection):
+    """LibraryConnection whose statements are timed for /metrics"""
+
+    def cursor(self, factory=ProfiledCursor):
+        return super().cursor(factory)
+
+
+def connect(path=None):
+    """Open a tuned connection to the library database"""
+    conn = sqlite3.connect(
+        path or DB_PATH,
+        check_same_thread=False,
+        factory=ProfiledConnection if metrics.ENABLED else LibraryConnection,
+    )
+    conn.row_factory = sqlite3.Row
+    for pragma in CONNECTION_PRAGMAS:
+        conn.execute(pragma)
+    return conn
+
+
+class ConnectionPool:
+    """Bounded pool of open connections shared by the worker threads of one
+    process. Connections are opened lazily up to `size` and reused LIFO so
+    the hottest ones keep their page cache warm."""
+
+    def __init__(self, path, size):
+        self.path = path
+        self.size = size
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._opened = 0
+
+    def acquire(self, timeout=30):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+
+        with self._lock:
+            if self._opened < self.size:
+                self._opened += 1
+                return connect(self.path)
+
+        try:
+            return self._idle.get(timeout=timeout)
+        except queue.Empty:
+            raise RuntimeError("Timed out waiting for a database connection")
+
+    def release(self, conn):
+        if conn.in_transaction:
+            conn.rollback()
+        self._idle.put(conn)
+
+    def close(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
+
+
+_pool = None
+_write_pool = None
+_pool_lock = threading.Lock()
+
+
+def configure_db(path=None, pool_size=None, writers=None):
+    """Point the app at a database file and (re)size the connection pools.
+
+    With writers > 0, requests that may write (anything but GET/HEAD/OPTIONS)
+    take their connection from a separate pool of that size. The write path
+    is then serialized in-process and never competes with readers for a
+    pool slot.
+    """
+    global DB_PATH, POOL_SIZE, WRITER_POOL_SIZE, _pool, _write_pool
+    with _pool_lock:
+        if path is not None:
+            DB_PATH = path
+        if pool_size is not None:
+            POOL_SIZE = pool_size
+        if writers is not None:
+            WRITER_POOL_SIZE = writers
+        for pool in (_pool, _write_pool):
+            if pool is not None:
+                pool.close()
+        _pool = ConnectionPool(DB_PATH, POOL_SIZE)
+        _write_pool = (
+            ConnectionPool(DB_PATH, WRITER_POOL_SIZE) if WRITER_POOL_SIZE else None
+        )
+    return _pool
+
+
+def get_pool(write=False):
+    if _pool is None:
+        configure_db()
+    if write and _write_pool is not None:
+        return _write_pool
+    return _pool
+
+
+def close_pools():
+    for pool in (_pool, _write_pool):
+        if pool is not None:
+            pool.close()
 
 
 def get_db():
     if "db" not in g:
-        g.db = sqlite3.connect("./data.db")
-        g.db.row_factory = sqlite3.Row
-        g.db.execute("PRAGMA foreign_keys = ON;")
+        write = has_request_context() and request.method not in (
+            "GET",
+            "HEAD",
+            "OPTIONS",
+        )
+        g.db_pool = get_pool(write)
+        g.db = g.db_pool.acquire()
     return g.db
 
 
-def init_db():
-    conn = sqlite3.connect("data.db")
-    cur = conn.cursor()
+@contextmanager
+def write_transaction(db):
+    """Run the block inside BEGIN IMMEDIATE ... COMMIT.
+
+    The write lock is taken up front so concurrent writers queue on
+    busy_timeout instead of failing mid-transaction. If the connection is
+    already inside a transaction the block simply joins it.
+    """
+    if db.in_transaction:
+        yield db
+        return
+
+    db.execute("BEGIN IMMEDIATE")
+    try:
+        yield db
+    except BaseException:
+        db.rollback()
+        raise
+    db.commit()
+
+
+def release_db(exception=None):
+    """Hand the request's connection back to the pool it came from"""
+    db = g.pop("db", None)
+    pool = g.pop("db_pool", None)
+    if db is not None:
+        (pool or get_pool()).release(db)
+
+
+FTS_AUTHORS_SQL = """SELECT COALESCE(GROUP_CONCAT(a.name, ' '), '')
+        FROM book_authors ba JOIN authors a ON ba.author_id = a.id
+        WHERE ba.book_id = {book_id}"""
 
+FTS_KEYWORDS_SQL = """SELECT COALESCE(GROUP_CONCAT(k.word, ' '), '')
+        FROM book_keywords bk JOIN keyword k ON bk.keyword_id = k.id
+        WHERE bk.book_id = {book_id}"""
+
+SUMMARY_KEYWORDS_SQL = """SELECT GROUP_CONCAT(k.word)
+        FROM book_keywords bk JOIN keyword k ON bk.keyword_id = k.id
+        WHERE bk.book_id = {book_id}"""
+
+
+def migration_001_base_schema(cur):
+    """Core library tables"""
     # Users Table
     cur.execute(
         """
@@ -155,55 +470,1034 @@ def init_db():
     """
     )
 
-    conn.commit()
+
+def migration_002_search_index(cur):
+    """Full-text search index over titles, catalog codes, authors and keywords,
+    kept in sync with books/book_authors/book_keywords by triggers"""
+    cur.execute(
+        """
+    CREATE VIRTUAL TABLE IF NOT EXISTS books_fts USING fts5(
+        title,
+        catalog_code,
+        authors,
+        keywords,
+        tokenize = 'unicode61 remove_diacritics 2',
+        prefix = '2 3'
+    );
+    """
+    )
+
+    cur.execute(
+        """
+    CREATE TRIGGER IF NOT EXISTS books_fts_ai
+    AFTER INSERT ON books BEGIN
+        INSERT INTO books_fts (rowid, title, catalog_code, authors, keywords)
+        VALUES (NEW.id, NEW.title, NEW.catalog_code, '', '');
+    END;
+    """
+    )
+
+    cur.execute(
+        """
+    CREATE TRIGGER IF NOT EXISTS books_fts_au
+    AFTER UPDATE OF title, catalog_code ON books BEGIN
+        UPDATE books_fts SET title = NEW.title, catalog_code = NEW.catalog_code
+        WHERE rowid = NEW.id;
+    END;
+    """
+    )
+
+    cur.execute(
+        """
+    CREATE TRIGGER IF NOT EXISTS books_fts_ad
+    AFTER DELETE ON books BEGIN
+        DELETE FROM books_fts WHERE rowid = OLD.id;
+    END;
+    """
+    )
+
+    cur.execute(
+        f"""
+    CREATE TRIGGER IF NOT EXISTS book_authors_fts_ai
+    AFTER INSERT ON book_authors BEGIN
+        UPDATE books_fts SET authors = ({FTS_AUTHORS_SQL.format(book_id="NEW.book_id")})
+        WHERE rowid = NEW.book_id;
+    END;
+    """
+    )
+
+    cur.execute(
+        f"""
+    CREATE TRIGGER IF NOT EXISTS book_authors_fts_ad
+    AFTER DELETE ON book_authors BEGIN
+        UPDATE books_fts SET authors = ({FTS_AUTHORS_SQL.format(book_id="OLD.book_id")})
+        WHERE rowid = OLD.book_id;
+    END;
+    """
+    )
+
+    cur.execute(
+        f"""
+    CREATE TRIGGER IF NOT EXISTS book_keywords_fts_ai
+    AFTER INSERT ON book_keywords BEGIN
+        UPDATE books_fts SET keywords = ({FTS_KEYWORDS_SQL.format(book_id="NEW.book_id")})
+        WHERE rowid = NEW.book_id;
+    END;
+    """
+    )
+
+    cur.execute(
+        f"""
+    CREATE TRIGGER IF NOT EXISTS book_keywords_fts_ad
+    AFTER DELETE ON book_keywords BEGIN
+        UPDATE books_fts SET keywords = ({FTS_KEYWORDS_SQL.format(book_id="OLD.book_id")})
+        WHERE rowid = OLD.book_id;
+    END;
+    """
+    )
+
+    # Index the current catalog so databases created before this migration
+    # start with a complete index
+    rebuild_search_index(cur)
+
+
+def rebuild_search_index(cur):
+    """Recompute books_fts from the catalog tables"""
+    cur.execute("DELETE FROM books_fts")
+    cur.execute(
+        f"""
+        INSERT INTO books_fts (rowid, title, catalog_code, authors, keywords)
+        SELECT b.id, b.title, b.catalog_code,
+               ({FTS_AUTHORS_SQL.format(book_id="b.id")}),
+               ({FTS_KEYWORDS_SQL.format(book_id="b.id")})
+        FROM books b
+        """
+    )
+
+
+def migration_003_book_summary(cur):
+    """Per-book summary of copy counts and keywords, maintained by triggers so
+    catalog listings read one row per book with no aggregation"""
+    cur.execute(
+        """
+    CREATE TABLE IF NOT EXISTS book_summary (
+        book_id INTEGER PRIMARY KEY,
+        total_copies INTEGER NOT NULL DEFAULT 0,
+        available_copies INTEGER NOT NULL DEFAULT 0,
+        keywords TEXT,
+        FOREIGN KEY (book_id) REFERENCES books(id) ON DELETE CASCADE
+    );
+    """
+    )
+
+    cur.execute(
+        """
+    CREATE TRIGGER IF NOT EXISTS book_summary_books_ai
+    AFTER INSERT ON books BEGIN
+        INSERT OR IGNORE INTO book_summary (book_id) VALUES (NEW.id);
+    END;
+    """
+    )
+
+    cur.execute(
+        """
+    CREATE TRIGGER IF NOT EXISTS book_summary_copies_ai
+    AFTER INSERT ON book_copies BEGIN
+        UPDATE book_summary
+        SET total_copies = total_copies + 1,
+            available_copies = available_copies + (NEW.is_available = 1)
+        WHERE book_id = NEW.book_id;
+    END;
+    """
+    )
+
+    cur.execute(
+        """
+    CREATE TRIGGER IF NOT EXISTS book_summary_copies_ad
+    AFTER DELETE ON book_copies BEGIN
+        UPDATE book_summary
+        SET total_copies = total_copies - 1,
+            available_copies = available_copies - (OLD.is_available = 1)
+        WHERE book_id = OLD.book_id;
+    END;
+    """
+    )
+
+    cur.execute(
+        """
+    CREATE TRIGGER IF NOT EXISTS book_summary_copies_au
+    AFTER UPDATE OF book_id, is_available ON book_copies BEGIN
+        UPDATE book_summary
+        SET total_copies = total_copies - 1,
+            available_copies = available_copies - (OLD.is_available = 1)
+        WHERE book_id = OLD.book_id;
+        UPDATE book_summary
+        SET total_copies = total_copies + 1,
+            available_copies = available_copies + (NEW.is_available = 1)
+        WHERE book_id = NEW.book_id;
+    END;
+    """
+    )
+
+    cur.execute(
+        f"""
+    CREATE TRIGGER IF NOT EXISTS book_summary_keywords_ai
+    AFTER INSERT ON book_keywords BEGIN
+        UPDATE book_summary SET keywords = ({SUMMARY_KEYWORDS_SQL.format(book_id="NEW.book_id")})
+        WHERE book_id = NEW.book_id;
+    END;
+    """
+    )
+
+    cur.execute(
+        f"""
+    CREATE TRIGGER IF NOT EXISTS book_summary_keywords_ad
+    AFTER DELETE ON book_keywords BEGIN
+        UPDATE book_summary SET keywords = ({SUMMARY_KEYWORDS_SQL.format(book_id="OLD.book_id")})
+        WHERE book_id = OLD.book_id;
+    END;
+    """
+    )
+
+    rebuild_book_summary(cur)
+
+
+def rebuild_book_summary(cur):
+    """Recompute book_summary from books, book_copies and book_keywords"""
+    cur.execute(
+        f"""
+        INSERT OR REPLACE INTO book_summary (book_id, total_copies, available_copies, keywords)
+        SELECT b.id,
+               (SELECT COUNT(*) FROM book_copies bc WHERE bc.book_id = b.id),
+               (SELECT COUNT(*) FROM book_copies bc
+                WHERE bc.book_id = b.id AND bc.is_available = 1),
+               ({SUMMARY_KEYWORDS_SQL.format(book_id="b.id")})
+        FROM books b
+        """
+    )
+
+
+def migration_004_secondary_indexes(cur):
+    """Indexes backing the per-book, per-user and request-queue lookups"""
+    cur.execute(
+        "CREATE INDEX IF NOT EXISTS idx_book_copies_book ON book_copies(book_id, is_available)"
+    )
+    cur.execute(
+        "CREATE INDEX IF NOT EXISTS idx_book_copies_borrower ON book_copies(borrowed_by, is_available)"
+    )
+    cur.execute(
+        "CREATE INDEX IF NOT EXISTS idx_book_requests_queue ON book_requests(copy_id, status, position)"
+    )
+    cur.execute(
+        "CREATE INDEX IF NOT EXISTS idx_book_requests_user ON book_requests(user_id, status)"
+    )
+    cur.execute(
+        "CREATE INDEX IF NOT EXISTS idx_book_keywords_keyword ON book_keywords(keyword_id)"
+    )
+    cur.execute(
+        "CREATE INDEX IF NOT EXISTS idx_book_authors_author ON book_authors(author_id)"
+    )
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_books_theme ON books(theme_id)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_books_publisher ON books(publisher_id)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_books_title ON books(title)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_books_created ON books(created_at)")
+
+
+def migration_005_lookup_version(cur):
+    """Change counter for UPDATE/DELETE on the lookup tables, used to
+    invalidate the in-process lookup cache"""
+    cur.execute(
+        """
+    CREATE TABLE IF NOT EXISTS lookup_version (
+        id INTEGER PRIMARY KEY CHECK (id = 1),
+        token TEXT NOT NULL,
+        version INTEGER NOT NULL DEFAULT 0
+    );
+    """
+    )
+    # The random token tells a recreated database apart from the old one
+    cur.execute(
+        "INSERT OR IGNORE INTO lookup_version (id, token) VALUES (1, hex(randomblob(8)))"
+    )
+
+    for table in LOOKUP_TABLES:
+        for event in ("UPDATE", "DELETE"):
+            cur.execute(
+                f"""
+    CREATE TRIGGER IF NOT EXISTS {table}_lookup_{event.lower()}
+    AFTER {event} ON {table} BEGIN
+        UPDATE lookup_version SET version = version + 1 WHERE id = 1;
+    END;
+    """
+            )
+
+
+# Cache scopes touched by a row change in each table, as SQL expressions over
+# the changed row. Read endpoints derive their ETags from these versions.
+CACHE_SCOPES = {
+    "books": ["'catalog'", "'book:' || {row}.id"],
+    "book_copies": [
+        "'catalog'",
+        "'book:' || {row}.book_id",
+        "'copy:' || {row}.copy_id",
+        "'user:' || {row}.borrowed_by",
+    ],
+    "book_authors": ["'catalog'", "'book:' || {row}.book_id"],
+    "book_keywords": ["'catalog'", "'book:' || {row}.book_id"],
+    "book_requests": ["'requests'", "'copy:' || {row}.copy_id", "'user:' || {row}.user_id"],
+    "users": ["'users'", "'user:' || {row}.user_id"],
+    "themes": ["'catalog'"],
+    "publishers": ["'catalog'"],
+}
+
+
+def migration_006_cache_versions(cur):
+    """Per-scope change counters (whole catalog, one book, copy or user)
+    bumped by triggers in the same transaction as every write"""
+    cur.execute(
+        """
+    CREATE TABLE IF NOT EXISTS cache_versions (
+        scope TEXT PRIMARY KEY,
+        version INTEGER NOT NULL,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    ) WITHOUT ROWID;
+    """
+    )
+
+    for table, scopes in CACHE_SCOPES.items():
+        create_cache_triggers(cur, table, scopes)
+
+
+def create_cache_triggers(cur, table, scopes):
+    """Triggers bumping the given cache scopes on every change to `table`"""
+    for event, rows in (
+        ("INSERT", ["NEW"]),
+        ("UPDATE", ["OLD", "NEW"]),
+        ("DELETE", ["OLD"]),
+    ):
+        selects = " UNION ".join(
+            f"SELECT {scope.format(row=row)} AS scope"
+            for row in rows
+            for scope in scopes
+        )
+        cur.execute(
+            f"""
+    CREATE TRIGGER IF NOT EXISTS {table}_cache_{event.lower()}
+    AFTER {event} ON {table} BEGIN
+        INSERT INTO cache_versions (scope, version, updated_at)
+        SELECT scope, 1, CURRENT_TIMESTAMP FROM ({selects})
+        WHERE scope IS NOT NULL
+        ON CONFLICT (scope) DO UPDATE
+        SET version = version + 1, updated_at = excluded.updated_at;
+    END;
+    """
+        )
+
+
+def migration_007_overdue_sweeps(cur):
+    """Overdue flag on loans, the partial indexes the background sweeps walk,
+    and the notification outbox they write to"""
+    cur.execute(
+        "ALTER TABLE book_copies ADD COLUMN overdue INTEGER NOT NULL DEFAULT 0"
+    )
+    # Only lent copies are indexed; the sweep reads the not-yet-flagged ones
+    # in due_date order and stops at the cutoff
+    cur.execute(
+        """CREATE INDEX IF NOT EXISTS idx_book_copies_due
+           ON book_copies(overdue, due_date) WHERE is_available = 0"""
+    )
+    cur.execute(
+        """CREATE INDEX IF NOT EXISTS idx_book_requests_waiting_since
+           ON book_requests(requested_date) WHERE status = 'waiting'"""
+    )
+
+    cur.execute(
+        """
+    CREATE TABLE IF NOT EXISTS notifications (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER NOT NULL,
+        kind TEXT NOT NULL CHECK (kind IN ('overdue', 'request_expired')),
+        copy_id INTEGER,
+        payload TEXT,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        sent_at TIMESTAMP,
+        FOREIGN KEY (user_id) REFERENCES users(user_id) ON DELETE CASCADE
+    );
+    """
+    )
+    cur.execute(
+        """CREATE INDEX IF NOT EXISTS idx_notifications_pending
+           ON notifications(id) WHERE sent_at IS NULL"""
+    )
+    cur.execute(
+        "CREATE INDEX IF NOT EXISTS idx_notifications_user ON notifications(user_id)"
+    )
+
+
+# Copies whose location is only given as text are filed under the first
+# branch, which is created by the migration
+DEFAULT_BRANCH = "Main branch"
+DEFAULT_BRANCH_SQL = "(SELECT id FROM locations WHERE parent_id IS NULL ORDER BY id LIMIT 1)"
+LOCATION_ID_SQL = """(SELECT id FROM locations
+                WHERE COALESCE(parent_id, 0) = {branch} AND name = {name})"""
+
+
+def migration_008_locations(cur):
+    """Locations as a branch -> shelf hierarchy referenced by book_copies,
+    and the availability index over (book_id, is_available, location_id)"""
+    cur.execute(
+        """
+    CREATE TABLE IF NOT EXISTS locations (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        name TEXT NOT NULL,
+        parent_id INTEGER,
+        FOREIGN KEY (parent_id) REFERENCES locations(id) ON DELETE CASCADE
+    );
+    """
+    )
+    # One name per parent; branches have no parent
+    cur.execute(
+        """CREATE UNIQUE INDEX IF NOT EXISTS idx_locations_parent_name
+           ON locations(COALESCE(parent_id, 0), name)"""
+    )
+    cur.execute("INSERT OR IGNORE INTO locations (name) VALUES (?)", (DEFAULT_BRANCH,))
+
+    cur.execute(
+        "ALTER TABLE book_copies ADD COLUMN location_id INTEGER REFERENCES locations(id)"
+    )
+
+    # The free-text location stays for existing clients; these triggers file
+    # any copy that only has one under the default branch
+    cur.execute(
+        f"""
+    CREATE TRIGGER IF NOT EXISTS book_copies_location_ai
+    AFTER INSERT ON book_copies
+    WHEN NEW.location_id IS NULL AND NEW.location IS NOT NULL BEGIN
+        INSERT OR IGNORE INTO locations (name, parent_id)
+        VALUES (NEW.location, {DEFAULT_BRANCH_SQL});
+        UPDATE book_copies
+        SET location_id = {LOCATION_ID_SQL.format(branch=DEFAULT_BRANCH_SQL, name="NEW.location")}
+        WHERE copy_id = NEW.copy_id;
+    END;
+    """
+    )
+    cur.execute(
+        f"""
+    CREATE TRIGGER IF NOT EXISTS book_copies_location_au
+    AFTER UPDATE OF location ON book_copies
+    WHEN NEW.location IS NOT OLD.location AND NEW.location IS NOT NULL BEGIN
+        INSERT OR IGNORE INTO locations (name, parent_id)
+        VALUES (NEW.location, {DEFAULT_BRANCH_SQL});
+        UPDATE book_copies
+        SET location_id = {LOCATION_ID_SQL.format(branch=DEFAULT_BRANCH_SQL, name="NEW.location")}
+        WHERE copy_id = NEW.copy_id;
+    END;
+    """
+    )
+
+    cur.execute(
+        f"""INSERT OR IGNORE INTO locations (name, parent_id)
+            SELECT DISTINCT location, {DEFAULT_BRANCH_SQL} FROM book_copies
+            WHERE location IS NOT NULL"""
+    )
+    cur.execute(
+        f"""UPDATE book_copies
+            SET location_id = {LOCATION_ID_SQL.format(branch=DEFAULT_BRANCH_SQL, name="book_copies.location")}
+            WHERE location_id IS NULL"""
+    )
+
+    # Covers availability per location; (book_id, is_available) is a prefix
+    # of it, so the older index is dropped
+    cur.execute(
+        """CREATE INDEX IF NOT EXISTS idx_book_copies_availability
+           ON book_copies(book_id, is_available, location_id)"""
+    )
+    cur.execute("DROP INDEX IF EXISTS idx_book_copies_book")
+
+    create_cache_triggers(cur, "locations", ["'locations'"])
+
+
+# Dashboard counters: the table each one counts and the condition a row
+# must meet, as SQL over {row}. Triggers apply the change of every write,
+# and rebuild_library_stats() recounts from scratch with the same SQL.
+LIBRARY_STATS = {
+    "books": ("books", "1"),
+    "copies": ("book_copies", "1"),
+    "available_copies": ("book_copies", "{row}.is_available = 1"),
+    "active_loans": ("book_copies", "{row}.is_available = 0"),
+    "overdue_loans": ("book_copies", "{row}.is_available = 0 AND {row}.overdue = 1"),
+    "waitlist": ("book_requests", "{row}.status = 'waiting'"),
+    "users": ("users", "1"),
+    "users_kid": ("users", "{row}.state = 'kid'"),
+    "users_student": ("users", "{row}.state = 'student'"),
+    "users_pro": ("users", "{row}.state = 'pro'"),
+    "subscribers": ("users", "{row}.is_subscribed = 1"),
+}
+# Columns whose updates can move a counter
+LIBRARY_STATS_COLUMNS = {
+    "book_copies": "is_available, overdue",
+    "book_requests": "status",
+    "users": "state, is_subscribed",
+}
+
+
+def rebuild_library_stats(cur):
+    """Recount every dashboard counter from the underlying tables"""
+    for name, (table, condition) in LIBRARY_STATS.items():
+        cur.execute(
+            f"""INSERT INTO library_stats (name, value)
+                SELECT ?, COUNT(*) FROM {table} r WHERE {condition.format(row="r")}
+                ON CONFLICT (name) DO UPDATE SET value = excluded.value""",
+            (name,),
+        )
+
+
+def migration_009_library_stats(cur):
+    """Dashboard counters kept current by triggers"""
+    cur.execute(
+        """
+    CREATE TABLE IF NOT EXISTS library_stats (
+        name TEXT PRIMARY KEY,
+        value INTEGER NOT NULL DEFAULT 0
+    ) WITHOUT ROWID;
+    """
+    )
+    rebuild_library_stats(cur)
+
+    tables = {table for table, _ in LIBRARY_STATS.values()}
+    for table in sorted(tables):
+        counters = [
+            (name, condition)
+            for name, (counted, condition) in LIBRARY_STATS.items()
+            if counted == table
+        ]
+        events = [
+            ("INSERT", "", "IFNULL(({new}), 0)"),
+            ("DELETE", "", "-IFNULL(({old}), 0)"),
+        ]
+        if table in LIBRARY_STATS_COLUMNS:
+            events.append(
+                (
+                    "UPDATE",
+                    f" OF {LIBRARY_STATS_COLUMNS[table]}",
+                    "IFNULL(({new}), 0) - IFNULL(({old}), 0)",
+                )
+            )
+        for event, columns, delta in events:
+            # Plain row counts only move on insert and delete
+            moved = [
+                (name, condition)
+                for name, condition in counters
+                if event != "UPDATE" or condition != "1"
+            ]
+            cases = " ".join(
+                f"WHEN '{name}' THEN "
+                + delta.format(new=condition.format(row="NEW"), old=condition.format(row="OLD"))
+                for name, condition in moved
+            )
+            names = ", ".join(f"'{name}'" for name, _ in moved)
+            cur.execute(
+                f"""
+    CREATE TRIGGER IF NOT EXISTS {table}_stats_{event.lower()}
+    AFTER {event}{columns} ON {table} BEGIN
+        UPDATE library_stats SET value = value + CASE name {cases} ELSE 0 END
+        WHERE name IN ({names});
+    END;
+    """
+            )
+
+
+def migration_010_user_indexes(cur):
+    """Indexes behind the filtered user listing. Each one ends in the rowid,
+    so a filtered page is read in user_id order without sorting."""
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_users_state ON users(state)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_users_role ON users(role)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_users_subscribed ON users(is_subscribed)")
+
+
+# Conditions, in an UPDATE trigger on book_copies, for a loan ending and
+# for one starting. A return that hands the copy to the next requester
+# keeps it lent and only changes borrowed_by, so it is both.
+LOAN_ENDED_SQL = (
+    "OLD.is_available = 0 AND OLD.borrowed_by IS NOT NULL"
+    " AND (NEW.is_available = 1 OR NEW.borrowed_by IS NOT OLD.borrowed_by)"
+)
+LOAN_STARTED_SQL = (
+    "NEW.is_available = 0 AND NEW.borrowed_by IS NOT NULL"
+    " AND (OLD.is_available = 1 OR NEW.borrowed_by IS NOT OLD.borrowed_by)"
+)
+
+# Triggers writing the changes feed: trigger suffix -> (event, rows), each
+# row being (kind, book_id, copy_id, user_id, payload, condition)
+CHANGE_EVENTS = {
+    "copy_insert": (
+        "INSERT ON book_copies",
+        [
+            (
+                "copy_added",
+                "NEW.book_id",
+                "NEW.copy_id",
+                "NULL",
+                "json_object('location', NEW.location, 'location_id', NEW.location_id)",
+                "1",
+            )
+        ],
+    ),
+    "copy_delete": (
+        "DELETE ON book_copies",
+        [("copy_deleted", "OLD.book_id", "OLD.copy_id", "OLD.borrowed_by", "NULL", "1")],
+    ),
+    # A hand-off to the next requester is logged as a return, then a borrow
+    "copy_loan": (
+        "UPDATE OF is_available, borrowed_by ON book_copies",
+        [
+            (
+                "copy_returned",
+                "NEW.book_id",
+                "NEW.copy_id",
+                "OLD.borrowed_by",
+                "NULL",
+                LOAN_ENDED_SQL,
+            ),
+            (
+                "copy_borrowed",
+                "NEW.book_id",
+                "NEW.copy_id",
+                "NEW.borrowed_by",
+                "json_object('due_date', NEW.due_date)",
+                LOAN_STARTED_SQL,
+            ),
+        ],
+    ),
+    "copy_overdue": (
+        "UPDATE OF overdue ON book_copies",
+        [
+            (
+                "copy_overdue",
+                "NEW.book_id",
+                "NEW.copy_id",
+                "NEW.borrowed_by",
+                "json_object('due_date', NEW.due_date)",
+                "NEW.overdue = 1 AND OLD.overdue = 0",
+            )
+        ],
+    ),
+    "request_insert": (
+        "INSERT ON book_requests",
+        [
+            (
+                "request_added",
+                "(SELECT book_id FROM book_copies WHERE copy_id = NEW.copy_id)",
+                "NEW.copy_id",
+                "NEW.user_id",
+                "json_object('request_id', NEW.request_id, 'position', NEW.position)",
+                "1",
+            )
+        ],
+    ),
+    "request_delete": (
+        "DELETE ON book_requests",
+        [
+            (
+                "request_removed",
+                "(SELECT book_id FROM book_copies WHERE copy_id = OLD.copy_id)",
+                "OLD.copy_id",
+                "OLD.user_id",
+                "json_object('request_id', OLD.request_id)",
+                "1",
+            )
+        ],
+    ),
+}
+
+
+def migration_011_changes(cur):
+    """Append-only feed of circulation changes, written by triggers in the
+    same transaction as the change itself"""
+    # AUTOINCREMENT keeps seq increasing even after old rows are pruned, so
+    # clients can resume from the last seq they saw
+    cur.execute(
+        """
+    CREATE TABLE IF NOT EXISTS changes (
+        seq INTEGER PRIMARY KEY AUTOINCREMENT,
+        kind TEXT NOT NULL,
+        book_id INTEGER,
+        copy_id INTEGER,
+        user_id INTEGER,
+        payload TEXT,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+    """
+    )
+    for name, (event, rows) in CHANGE_EVENTS.items():
+        inserts = "\n".join(
+            f"""        INSERT INTO changes (kind, book_id, copy_id, user_id, payload)
+        SELECT '{kind}', {book}, {copy}, {user}, {payload} WHERE {condition};"""
+            for kind, book, copy, user, payload, condition in rows
+        )
+        cur.execute(
+            f"""
+    CREATE TRIGGER IF NOT EXISTS changes_{name}
+    AFTER {event} BEGIN
+{inserts}
+    END;
+    """
+        )
+
+
+# Same format as the isoformat() timestamps the app writes to book_copies
+NOW_ISO_SQL = "strftime('%Y-%m-%dT%H:%M:%f', 'now', 'localtime')"
+LOAN_COLUMNS = (
+    "loan_id, copy_id, book_id, user_id, borrowed_date, due_date, returned_date, overdue, retired"
+)
+LOANS_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS {schema}loans (
+        loan_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        copy_id INTEGER NOT NULL,
+        book_id INTEGER NOT NULL,
+        user_id INTEGER NOT NULL,
+        borrowed_date TIMESTAMP NOT NULL,
+        due_date TIMESTAMP,
+        returned_date TIMESTAMP,
+        overdue INTEGER NOT NULL DEFAULT 0,
+        retired INTEGER NOT NULL DEFAULT 0
+    );
+"""
+
+
+def rebuild_open_loans(cur):
+    """Open a loans row for every lent copy that doesn't have one"""
+    cur.execute(
+        f"""
+        INSERT INTO loans (copy_id, book_id, user_id, borrowed_date, due_date, overdue)
+        SELECT bc.copy_id, bc.book_id, bc.borrowed_by,
+               COALESCE(bc.borrowed_date, {NOW_ISO_SQL}), bc.due_date, bc.overdue
+        FROM book_copies bc
+        WHERE bc.is_available = 0 AND bc.borrowed_by IS NOT NULL
+        AND NOT EXISTS (
+            SELECT 1 FROM loans l WHERE l.copy_id = bc.copy_id AND l.returned_date IS NULL
+        )
+        """
+    )
+
+
+def migration_012_loans(cur):
+    """Loan history: a row per loan, opened on borrow and closed on return.
+    book_copies only holds the current loan."""
+    # Old closed loans are moved out to archive files (scheduler.archive_loans);
+    # AUTOINCREMENT keeps their ids from being reused
+    cur.execute(LOANS_SCHEMA.format(schema=""))
+    cur.execute(
+        "CREATE INDEX IF NOT EXISTS idx_loans_user ON loans(user_id, borrowed_date)"
+    )
+    cur.execute(
+        "CREATE INDEX IF NOT EXISTS idx_loans_book ON loans(book_id, borrowed_date)"
+    )
+    # The loan a return closes, and the closed loans due for archiving
+    cur.execute(
+        """CREATE INDEX IF NOT EXISTS idx_loans_open
+           ON loans(copy_id) WHERE returned_date IS NULL"""
+    )
+    cur.execute(
+        """CREATE INDEX IF NOT EXISTS idx_loans_returned
+           ON loans(returned_date) WHERE returned_date IS NOT NULL"""
+    )
+    rebuild_open_loans(cur)
+
+    open_loan = f"""
+        INSERT INTO loans (copy_id, book_id, user_id, borrowed_date, due_date)
+        SELECT NEW.copy_id, NEW.book_id, NEW.borrowed_by,
+               COALESCE(NEW.borrowed_date, {NOW_ISO_SQL}), NEW.due_date"""
+    close_loan = f"""
+        UPDATE loans SET returned_date = {NOW_ISO_SQL}, overdue = OLD.overdue{{retired}}
+        WHERE copy_id = OLD.copy_id AND returned_date IS NULL"""
+    cur.execute(
+        f"""
+    CREATE TRIGGER IF NOT EXISTS loans_copy_insert
+    AFTER INSERT ON book_copies
+    WHEN NEW.is_available = 0 AND NEW.borrowed_by IS NOT NULL BEGIN
+        {open_loan};
+    END;
+    """
+    )
+    cur.execute(
+        f"""
+    CREATE TRIGGER IF NOT EXISTS loans_copy_loan
+    AFTER UPDATE OF is_available, borrowed_by ON book_copies BEGIN
+        {close_loan.format(retired="")} AND {LOAN_ENDED_SQL};
+        {open_loan} WHERE {LOAN_STARTED_SQL};
+    END;
+    """
+    )
+    # Copies retired or deleted while lent
+    cur.execute(
+        f"""
+    CREATE TRIGGER IF NOT EXISTS loans_copy_delete
+    AFTER DELETE ON book_copies WHEN OLD.is_available = 0 BEGIN
+        {close_loan.format(retired=", retired = 1")};
+    END;
+    """
+    )
+
+
+def migration_013_recommendations(cur):
+    """Precomputed popularity and co-borrow similarity, kept up to date by
+    recommend.update_recommendations"""
+    # score is in forward-decay units (see recommend.py), so ranking by it
+    # needs no rewrite of old rows as time passes
+    cur.execute(
+        """
+    CREATE TABLE IF NOT EXISTS book_popularity (
+        book_id INTEGER PRIMARY KEY,
+        readers INTEGER NOT NULL DEFAULT 0,
+        loan_score REAL NOT NULL DEFAULT 0,
+        waitlist INTEGER NOT NULL DEFAULT 0,
+        score REAL NOT NULL DEFAULT 0
+    );
+    """
+    )
+    cur.execute(
+        "CREATE INDEX IF NOT EXISTS idx_book_popularity_score ON book_popularity(score)"
+    )
+    cur.execute(
+        """CREATE INDEX IF NOT EXISTS idx_book_popularity_waitlist
+           ON book_popularity(book_id) WHERE waitlist > 0"""
+    )
+    # Working state of the incremental job: who has read what, and how many
+    # readers each pair of books has in common (stored in both directions)
+    cur.execute(
+        """
+    CREATE TABLE IF NOT EXISTS book_readers (
+        user_id INTEGER NOT NULL,
+        book_id INTEGER NOT NULL,
+        last_read TIMESTAMP NOT NULL,
+        PRIMARY KEY (user_id, book_id)
+    ) WITHOUT ROWID;
+    """
+    )
+    cur.execute(
+        "CREATE INDEX IF NOT EXISTS idx_book_readers_recent ON book_readers(user_id, last_read)"
+    )
+    cur.execute(
+        """
+    CREATE TABLE IF NOT EXISTS book_pairs (
+        book_id INTEGER NOT NULL,
+        other_id INTEGER NOT NULL,
+        together INTEGER NOT NULL,
+        PRIMARY KEY (book_id, other_id)
+    ) WITHOUT ROWID;
+    """
+    )
+    # The top similar books of each book, in rank order
+    cur.execute(
+        """
+    CREATE TABLE IF NOT EXISTS book_similarity (
+        book_id INTEGER NOT NULL,
+        rank INTEGER NOT NULL,
+        similar_id INTEGER NOT NULL,
+        score REAL NOT NULL,
+        PRIMARY KEY (book_id, rank)
+    ) WITHOUT ROWID;
+    """
+    )
+    cur.execute(
+        """
+    CREATE TABLE IF NOT EXISTS recommend_state (
+        name TEXT PRIMARY KEY,
+        value
+    ) WITHOUT ROWID;
+    """
+    )
+
+
+def migration_014_copy_location_ids(cur):
+    """Let an update that sets location_id itself keep it: the free-text
+    trigger only files copies whose location_id the statement left alone"""
+    cur.execute("DROP TRIGGER IF EXISTS book_copies_location_au")
+    cur.execute(
+        f"""
+    CREATE TRIGGER book_copies_location_au
+    AFTER UPDATE OF location ON book_copies
+    WHEN NEW.location IS NOT OLD.location AND NEW.location IS NOT NULL
+         AND NEW.location_id IS OLD.location_id BEGIN
+        INSERT OR IGNORE INTO locations (name, parent_id)
+        VALUES (NEW.location, {DEFAULT_BRANCH_SQL});
+        UPDATE book_copies
+        SET location_id = {LOCATION_ID_SQL.format(branch=DEFAULT_BRANCH_SQL, name="NEW.location")}
+        WHERE copy_id = NEW.copy_id;
+    END;
+    """
+    )
+
+
+def migration_015_copy_added_location(cur):
+    """copy_added events carry the location_id the copy ends up with. For a
+    free-text location that is set by book_copies_location_ai, which runs
+    after this trigger, so the id is looked up here the same way"""
+    location_id = LOCATION_ID_SQL.format(branch=DEFAULT_BRANCH_SQL, name="NEW.location")
+    cur.execute("DROP TRIGGER IF EXISTS changes_copy_insert")
+    cur.execute(
+        f"""
+    CREATE TRIGGER changes_copy_insert
+    AFTER INSERT ON book_copies BEGIN
+        INSERT OR IGNORE INTO locations (name, parent_id)
+        SELECT NEW.location, {DEFAULT_BRANCH_SQL}
+        WHERE NEW.location_id IS NULL AND NEW.location IS NOT NULL;
+        INSERT INTO changes (kind, book_id, copy_id, user_id, payload)
+        SELECT 'copy_added', NEW.book_id, NEW.copy_id, NULL,
+               json_object('location', NEW.location,
+                           'location_id', COALESCE(NEW.location_id, {location_id}));
+    END;
+    """
+    )
+
+
+def migration_016_drop_waiting_since_index(cur):
+    """Requests now expire when their copy is long overdue, found through
+    idx_book_copies_due, not by age"""
+    cur.execute("DROP INDEX IF EXISTS idx_book_requests_waiting_since")
+
+
+# Ordered schema migrations. The database records how many have been applied
+# in PRAGMA user_version; append new migrations, never edit applied ones.
+MIGRATIONS = [
+    migration_001_base_schema,
+    migration_002_search_index,
+    migration_003_book_summary,
+    migration_004_secondary_indexes,
+    migration_005_lookup_version,
+    migration_006_cache_versions,
+    migration_007_overdue_sweeps,
+    migration_008_locations,
+    migration_009_library_stats,
+    migration_010_user_indexes,
+    migration_011_changes,
+    migration_012_loans,
+    migration_013_recommendations,
+    migration_014_copy_location_ids,
+    migration_015_copy_added_location,
+    migration_016_drop_waiting_since_index,
+]
+
+
+def migrate(conn):
+    """Apply pending migrations, each in its own transaction"""
+    version = conn.execute("PRAGMA user_version").fetchone()[0]
+
+    for number, migration in enumerate(MIGRATIONS[version:], start=version + 1):
+        cur = conn.cursor()
+        cur.execute("BEGIN")
+        try:
+            migration(cur)
+            cur.execute(f"PRAGMA user_version = {number}")
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+
+    return len(MIGRATIONS)
+
+
+def init_db(path=None):
+    conn = sqlite3.connect(path or DB_PATH)
+    # WAL is persistent in the database file: readers no longer block on
+    # the borrow/return writers and vice versa
+    conn.execute("PRAGMA journal_mode = WAL")
+    migrate(conn)
     conn.close()
 
 
-# Utility functions to manipulate the database
+# Utility functions to manipulate the database. None of them commit: they run
+# inside the caller's transaction so a failed request leaves nothing behind.
 
+# Keep IN (...) lists well under SQLite's host parameter limit
+IN_BATCH = 500
 
-def get_or_create_id(table_name, name_value, name_column="name"):
-    """Get ID from table or create new entry and return ID"""
-    db = get_db()
-    cursor = db.cursor()
 
-    query = f"SELECT id FROM {table_name} WHERE {name_column} = ?"
-    cursor.execute(query, (name_value,))
+def get_or_create_ids(table_name, names, name_column="name", db=None):
+    """Map each name to its ID, creating the missing entries"""
+    db = db or get_db()
+    names = list(dict.fromkeys(names))
+    if not names:
+        return {}
 
-    result = cursor.fetchone()
-    if result:
-        return result[0]
+    lookup_cache.validate(db)
+    ids, missing = lookup_cache.get_ids(table_name, names)
+    if not missing:
+        return ids
 
-    insert_query = f"INSERT INTO {table_name} ({name_column}) VALUES (?)"
-    cursor.execute(insert_query, (name_value,))
-    db.commit()
+    db.executemany(
+        f"INSERT OR IGNORE INTO {table_name} ({name_column}) VALUES (?)",
+        [(name,) for name in missing],
+    )
+
+    resolved = []
+    for start in range(0, len(missing), IN_BATCH):
+        batch = missing[start : start + IN_BATCH]
+        placeholders = ",".join("?" * len(batch))
+        rows = db.execute(
+            f"SELECT {name_column}, id FROM {table_name} WHERE {name_column} IN ({placeholders})",
+            batch,
+        )
+        resolved.extend(tuple(row) for row in rows)
+
+    ids.update(resolved)
+    # Cached once the surrounding transaction commits
+    db.pending_lookups.append((table_name, resolved))
+    return ids
 
-    return cursor.lastrowid
+
+def get_lookup_names(table_name, ids, db=None):
+    """Map lookup IDs back to their names, served from the cache when possible"""
+    db = db or get_db()
+    ids = list({row_id for row_id in ids if row_id is not None})
+    if not ids:
+        return {}
+
+    lookup_cache.validate(db)
+    names, missing = lookup_cache.get_names(table_name, ids)
+    if not missing:
+        return names
+
+    column = LOOKUP_TABLES[table_name]
+    resolved = []
+    for start in range(0, len(missing), IN_BATCH):
+        batch = missing[start : start + IN_BATCH]
+        placeholders = ",".join("?" * len(batch))
+        rows = db.execute(
+            f"SELECT {column}, id FROM {table_name} WHERE id IN ({placeholders})",
+            batch,
+        )
+        resolved.extend(tuple(row) for row in rows)
+
+    names.update((row_id, name) for name, row_id in resolved)
+    if db.in_transaction:
+        db.pending_lookups.append((table_name, resolved))
+    else:
+        lookup_cache.put(table_name, resolved)
+    return names
+
+
+def get_or_create_id(table_name, name_value, name_column="name"):
+    """Get ID from table or create new entry and return ID"""
+    return get_or_create_ids(table_name, [name_value], name_column)[name_value]
 
 
 def insert_book_authors(book_id, author_names):
     """Insert authors for a book"""
     db = get_db()
-    cursor = db.cursor()
-
-    for author_name in author_names:
-        author_id = get_or_create_id("authors", author_name, "name")
-        cursor.execute(
-            """INSERT INTO book_authors (book_id, author_id) VALUES (?, ?)""",
-            (book_id, author_id),
-        )
-    db.commit()
+    author_ids = get_or_create_ids("authors", author_names or [], "name")
+    db.executemany(
+        """INSERT INTO book_authors (book_id, author_id) VALUES (?, ?)""",
+        [(book_id, author_id) for author_id in author_ids.values()],
+    )
 
 
 def insert_book_keywords(book_id, keyword_words):
     """Insert keywords for a book"""
     db = get_db()
-    cursor = db.cursor()
-
-    for keyword_word in keyword_words:
-        keyword_id = get_or_create_id("keyword", keyword_word, "word")
-        cursor.execute(
-            """INSERT INTO book_keywords (book_id, keyword_id) VALUES (?, ?)""",
-            (book_id, keyword_id),
-        )
-    db.commit()
+    keyword_ids = get_or_create_ids("keyword", keyword_words or [], "word")
+    db.executemany(
+        """INSERT INTO book_keywords (book_id, keyword_id) VALUES (?, ?)""",
+        [(book_id, keyword_id) for keyword_id in keyword_ids.values()],
+    )
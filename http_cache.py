@@ -0,0 +1,154 @@
+"""Conditional GET and response caching for the read endpoints.
+
+Every write bumps per-scope counters in cache_versions through triggers
+(see CACHE_SCOPES in database.py). A read endpoint declares the scopes it
+depends on. Its ETag is derived from their versions, so one small indexed
+query decides whether to answer 304, serve the cached body, or run the
+view again.
+"""
+
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from datetime import datetime, timezone
+from functools import wraps
+
+from flask import Response, make_response, request
+
+from database import get_db
+
+RESPONSE_CACHE_SIZE = int(os.environ.get("LIBRARY_RESPONSE_CACHE_SIZE", "1024"))
+# Larger bodies are still answered with ETags but not kept in memory
+MAX_CACHED_BODY = 1024 * 1024
+
+
+class ResponseCache:
+    """LRU of rendered GET responses keyed by path and query string"""
+
+    def __init__(self, max_entries=RESPONSE_CACHE_SIZE):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, etag):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry["etag"] != etag:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self, key, etag, response):
+        entry = {
+            "etag": etag,
+            "body": response.get_data(),
+            "status": response.status_code,
+            "mimetype": response.mimetype,
+        }
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+            }
+
+
+response_cache = ResponseCache()
+
+
+def scope_versions(db, scopes):
+    """Return the ETag and Last-Modified time for a set of cache scopes"""
+    placeholders = ",".join("?" * len(scopes))
+    rows = db.execute(
+        f"""SELECT scope, version, updated_at FROM cache_versions
+            WHERE scope IN ({placeholders})""",
+        scopes,
+    ).fetchall()
+
+    versions = {row["scope"]: row["version"] for row in rows}
+    digest = hashlib.sha1(
+        "|".join(f"{scope}={versions.get(scope, 0)}" for scope in sorted(scopes)).encode()
+    ).hexdigest()[:20]
+
+    stamps = [row["updated_at"] for row in rows if row["updated_at"]]
+    last_modified = (
+        datetime.fromisoformat(max(stamps)).replace(tzinfo=timezone.utc)
+        if stamps
+        else None
+    )
+    return digest, last_modified
+
+
+def not_modified(etag, last_modified):
+    if request.if_none_match:
+        return request.if_none_match.contains(etag)
+    if request.if_modified_since and last_modified:
+        return last_modified <= request.if_modified_since
+    return False
+
+
+def conditional(scopes):
+    """Decorate a GET view with ETag/Last-Modified handling and caching.
+
+    `scopes` receives the view's URL arguments and returns the cache scopes
+    the response depends on, e.g. lambda user_id: [f"user:{user_id}"].
+    Other methods on the same route pass straight through.
+    """
+
+    def decorator(view):
+        @wraps(view)
+        def wrapper(**kwargs):
+            if request.method != "GET":
+                return view(**kwargs)
+
+            etag, last_modified = scope_versions(get_db(), scopes(**kwargs))
+
+            if not_modified(etag, last_modified):
+                response = Response(status=304)
+            else:
+                key = (
+                    request.path,
+                    request.query_string,
+                    request.headers.get("Accept", ""),
+                )
+                entry = response_cache.get(key, etag)
+                if entry:
+                    response = Response(
+                        entry["body"], status=entry["status"], mimetype=entry["mimetype"]
+                    )
+                else:
+                    response = make_response(view(**kwargs))
+                    if (
+                        response.status_code == 200
+                        and not response.is_streamed
+                        and response.content_length is not None
+                        and response.content_length <= MAX_CACHED_BODY
+                    ):
+                        response_cache.put(key, etag, response)
+
+            response.set_etag(etag)
+            if last_modified:
+                response.last_modified = last_modified
+            response.headers["Cache-Control"] = "no-cache"
+            return response
+
+        return wrapper
+
+    return decorator
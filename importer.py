@@ -0,0 +1,303 @@
+"""Bulk catalog import from CSV or JSONL.
+
+Rows use the same field names as POST /api/books: title, catCode (or
+catalog_code), theme, publisher, authors, keywords, poster, location, and
+an optional copies count. In CSV, authors and keywords are separated with
+";".
+
+    python importer.py books.csv
+    python importer.py books.jsonl --chunk-size 10000 --db data.db
+
+Rows are processed in chunks. Each chunk is written in one transaction
+with executemany. Invalid rows are reported and skipped without aborting
+the chunk.
+"""
+
+import argparse
+import csv
+import io
+import json
+import sys
+import time
+
+from database import (
+    IN_BATCH,
+    LOOKUP_TABLES,
+    connect,
+    get_or_create_ids,
+    init_db,
+    write_transaction,
+)
+
+DEFAULT_CHUNK_SIZE = 5000
+
+
+def read_rows(stream, fmt):
+    """Yield row dicts from a text stream in csv or jsonl format"""
+    if fmt == "csv":
+        for row in csv.DictReader(stream):
+            yield row
+    elif fmt == "jsonl":
+        for line in stream:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError as e:
+                # Passed on so the row is reported with the other errors
+                yield e
+    else:
+        raise ValueError(f"Unsupported format: {fmt}")
+
+
+def split_names(value):
+    if not value:
+        return []
+    if isinstance(value, str):
+        value = value.split(";")
+    return [name.strip() for name in value if name and name.strip()]
+
+
+def normalize_row(row):
+    """Validate one input row, returning the cleaned book or raising ValueError"""
+    if isinstance(row, json.JSONDecodeError):
+        raise ValueError(f"Malformed JSON: {row}")
+    copies = row.get("copies")
+    book = {
+        "title": (row.get("title") or "").strip(),
+        "catalog_code": (row.get("catCode") or row.get("catalog_code") or "").strip(),
+        "theme": (row.get("theme") or "").strip(),
+        "publisher": (row.get("publisher") or "").strip(),
+        "poster": (row.get("poster") or "").strip(),
+        "location": (row.get("location") or "").strip(),
+        "authors": split_names(row.get("authors")),
+        "keywords": split_names(row.get("keywords")),
+        "copies": 1 if copies is None or copies == "" else int(copies),
+    }
+
+    missing = [
+        field
+        for field in ("title", "catalog_code", "theme", "publisher", "poster", "location")
+        if not book[field]
+    ]
+    if not book["authors"]:
+        missing.append("authors")
+    if missing:
+        raise ValueError(f"Missing required fields: {', '.join(missing)}")
+    if book["copies"] < 0:
+        raise ValueError("copies must not be negative")
+
+    return book
+
+
+def chunked(items, size):
+    for start in range(0, len(items), size):
+        yield items[start : start + size]
+
+
+class BulkImporter:
+    """Writes validated rows in batches, resolving lookup names through
+    in-memory maps so each distinct name is only looked up once"""
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.lookups = {table: {} for table in LOOKUP_TABLES}
+
+    def resolve(self, table, names):
+        """Map names to ids, creating the missing ones"""
+        column = LOOKUP_TABLES[table]
+        known = self.lookups[table]
+        missing = list({name for name in names if name not in known})
+
+        if missing:
+            known.update(get_or_create_ids(table, missing, column, db=self.conn))
+
+        return known
+
+    def existing_codes(self, codes):
+        found = set()
+        for batch in chunked(codes, IN_BATCH):
+            placeholders = ",".join("?" * len(batch))
+            found.update(
+                row[0]
+                for row in self.conn.execute(
+                    f"SELECT catalog_code FROM books WHERE catalog_code IN ({placeholders})",
+                    batch,
+                )
+            )
+        return found
+
+    def write_chunk(self, chunk, first_line, errors):
+        """Validate and insert one chunk of raw rows in a single transaction"""
+        books = []
+        seen_codes = set()
+
+        for line, row in enumerate(chunk, start=first_line):
+            try:
+                book = normalize_row(row)
+            except (ValueError, TypeError, AttributeError) as e:
+                errors.append({"row": line, "error": str(e)})
+                continue
+            if book["catalog_code"] in seen_codes:
+                errors.append({"row": line, "error": "Duplicate catalog code in input"})
+                continue
+            seen_codes.add(book["catalog_code"])
+            book["line"] = line
+            books.append(book)
+
+        try:
+            return self.insert_books(books, errors)
+        except Exception:
+            # Names created by the rolled back transaction no longer exist
+            self.lookups = {table: {} for table in LOOKUP_TABLES}
+            raise
+
+    def insert_books(self, books, errors):
+        with write_transaction(self.conn):
+            taken = self.existing_codes([book["catalog_code"] for book in books])
+            for book in books:
+                if book["catalog_code"] in taken:
+                    errors.append(
+                        {"row": book["line"], "error": "Catalog code already exists"}
+                    )
+            books = [book for book in books if book["catalog_code"] not in taken]
+            if not books:
+                return 0
+
+            themes = self.resolve("themes", [book["theme"] for book in books])
+            publishers = self.resolve("publishers", [book["publisher"] for book in books])
+            authors = self.resolve(
+                "authors", [name for book in books for name in book["authors"]]
+            )
+            keywords = self.resolve(
+                "keyword", [word for book in books for word in book["keywords"]]
+            )
+
+            self.conn.executemany(
+                """INSERT INTO books (catalog_code, title, theme_id, publisher_id, poster)
+                   VALUES (?, ?, ?, ?, ?)""",
+                [
+                    (
+                        book["catalog_code"],
+                        book["title"],
+                        themes[book["theme"]],
+                        publishers[book["publisher"]],
+                        book["poster"],
+                    )
+                    for book in books
+                ],
+            )
+
+            book_ids = {}
+            for batch in chunked([book["catalog_code"] for book in books], IN_BATCH):
+                placeholders = ",".join("?" * len(batch))
+                book_ids.update(
+                    (code, book_id)
+                    for book_id, code in self.conn.execute(
+                        f"SELECT id, catalog_code FROM books WHERE catalog_code IN ({placeholders})",
+                        batch,
+                    )
+                )
+
+            self.conn.executemany(
+                "INSERT OR IGNORE INTO book_authors (book_id, author_id) VALUES (?, ?)",
+                [
+                    (book_ids[book["catalog_code"]], authors[name])
+                    for book in books
+                    for name in book["authors"]
+                ],
+            )
+            self.conn.executemany(
+                "INSERT OR IGNORE INTO book_keywords (book_id, keyword_id) VALUES (?, ?)",
+                [
+                    (book_ids[book["catalog_code"]], keywords[word])
+                    for book in books
+                    for word in book["keywords"]
+                ],
+            )
+            self.conn.executemany(
+                """INSERT INTO book_copies (book_id, location, publisher_id, is_available)
+                   VALUES (?, ?, ?, 1)""",
+                [
+                    (
+                        book_ids[book["catalog_code"]],
+                        book["location"],
+                        publishers[book["publisher"]],
+                    )
+                    for book in books
+                    for _ in range(book["copies"])
+                ],
+            )
+
+        return len(books)
+
+
+def import_books(conn, rows, chunk_size=DEFAULT_CHUNK_SIZE, progress=None):
+    """Import an iterable of row dicts and return a summary report"""
+    importer = BulkImporter(conn)
+    errors = []
+    imported = 0
+    total = 0
+    chunk = []
+    start = time.perf_counter()
+
+    def flush():
+        nonlocal imported
+        imported += importer.write_chunk(chunk, total - len(chunk) + 1, errors)
+        chunk.clear()
+        if progress:
+            progress(total, imported, time.perf_counter() - start)
+
+    for row in rows:
+        chunk.append(row)
+        total += 1
+        if len(chunk) >= chunk_size:
+            flush()
+    if chunk:
+        flush()
+
+    elapsed = time.perf_counter() - start
+    return {
+        "rows": total,
+        "imported": imported,
+        "failed": len(errors),
+        "errors": errors,
+        "seconds": round(elapsed, 3),
+        "rows_per_second": round(total / elapsed, 1) if elapsed else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bulk import books from CSV or JSONL")
+    parser.add_argument("path", help="input file, or - for stdin")
+    parser.add_argument("--format", choices=["csv", "jsonl"])
+    parser.add_argument("--db", help="database file (defaults to LIBRARY_DB_PATH)")
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE)
+    args = parser.parse_args()
+
+    fmt = args.format or ("jsonl" if args.path.endswith((".jsonl", ".ndjson")) else "csv")
+    if args.path == "-":
+        stream = io.TextIOWrapper(sys.stdin.buffer, encoding="utf-8", newline="")
+    else:
+        stream = open(args.path, encoding="utf-8", newline="")
+
+    def progress(total, imported, elapsed):
+        print(f"{total} rows read, {imported} imported, {total / elapsed:.0f} rows/s")
+
+    init_db(args.db)
+    conn = connect(args.db)
+    with stream:
+        report = import_books(conn, read_rows(stream, fmt), args.chunk_size, progress)
+    conn.close()
+
+    for error in report["errors"]:
+        print(f"row {error['row']}: {error['error']}", file=sys.stderr)
+    print(
+        f"Imported {report['imported']} of {report['rows']} rows "
+        f"in {report['seconds']}s ({report['rows_per_second']} rows/s)"
+    )
+
+
+if __name__ == "__main__":
+    main()
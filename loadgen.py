@@ -0,0 +1,140 @@
+"""HTTP load generator for the library API.
+
+    python loadgen.py --url http://127.0.0.1:5000 --concurrency 32 --duration 10
+    python loadgen.py /api/books?limit=20 /api/books/search?q=the --json out.json
+
+Each worker thread keeps one keep-alive connection and requests the given
+paths in random order until the time is up. The report has requests per
+second and p50/p95/p99 latency, overall and per path. User endpoints
+such as /api/users/1/borrowed need --token, a session token of that user
+or an admin (the "token" field of the /api/login response).
+"""
+
+import argparse
+import http.client
+import json
+import random
+import sys
+import threading
+import time
+from urllib.parse import urlsplit
+
+DEFAULT_PATHS = [
+    "/api/books?limit=20",
+    "/api/books/search?q=the",
+    "/api/books/1/copies",
+    "/api/users/1/borrowed",
+]
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, int(round(pct / 100 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def summarize(latencies, elapsed, errors=0):
+    """Latency percentiles in milliseconds plus throughput"""
+    ordered = sorted(latencies)
+    return {
+        "requests": len(ordered),
+        "errors": errors,
+        "rps": round(len(ordered) / elapsed, 1) if elapsed else None,
+        "p50_ms": round(percentile(ordered, 50) * 1000, 2) if ordered else None,
+        "p95_ms": round(percentile(ordered, 95) * 1000, 2) if ordered else None,
+        "p99_ms": round(percentile(ordered, 99) * 1000, 2) if ordered else None,
+    }
+
+
+def run_load(base_url, paths, concurrency=32, duration=10.0, seed=1, token=None):
+    """Hammer the server and return a report dict"""
+    url = urlsplit(base_url)
+    latencies = {path: [] for path in paths}
+    errors = {path: 0 for path in paths}
+    lock = threading.Lock()
+    deadline = time.perf_counter() + duration
+    headers = {"Authorization": f"Bearer {token}"} if token else {}
+
+    def worker(worker_id):
+        rng = random.Random(seed + worker_id)
+        conn = http.client.HTTPConnection(url.hostname, url.port or 80, timeout=30)
+        local = {path: [] for path in paths}
+        local_errors = {path: 0 for path in paths}
+
+        while time.perf_counter() < deadline:
+            path = rng.choice(paths)
+            start = time.perf_counter()
+            try:
+                conn.request("GET", path, headers=headers)
+                response = conn.getresponse()
+                response.read()
+                ok = response.status < 400
+            except (OSError, http.client.HTTPException):
+                conn.close()
+                conn = http.client.HTTPConnection(url.hostname, url.port or 80, timeout=30)
+                ok = False
+            if ok:
+                local[path].append(time.perf_counter() - start)
+            else:
+                local_errors[path] += 1
+
+        conn.close()
+        with lock:
+            for path in paths:
+                latencies[path].extend(local[path])
+                errors[path] += local_errors[path]
+
+    start = time.perf_counter()
+    workers = [threading.Thread(target=worker, args=(i,)) for i in range(concurrency)]
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    return {
+        "url": base_url,
+        "concurrency": concurrency,
+        "duration_s": round(elapsed, 2),
+        "total": summarize(
+            [value for values in latencies.values() for value in values],
+            elapsed,
+            sum(errors.values()),
+        ),
+        "paths": {
+            path: summarize(latencies[path], elapsed, errors[path]) for path in paths
+        },
+    }
+
+
+def print_report(report, out=sys.stdout):
+    rows = [("TOTAL", report["total"])] + list(report["paths"].items())
+    print(f"{'path':45} {'req/s':>9} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'errors':>7}", file=out)
+    for name, stats in rows:
+        print(
+            f"{name[:45]:45} {stats['rps'] or 0:>9} {stats['p50_ms'] or 0:>8} "
+            f"{stats['p95_ms'] or 0:>8} {stats['p99_ms'] or 0:>8} {stats['errors']:>7}",
+            file=out,
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load-test the library API over HTTP")
+    parser.add_argument("paths", nargs="*", default=DEFAULT_PATHS)
+    parser.add_argument("--url", default="http://127.0.0.1:5000")
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--duration", type=float, default=10.0)
+    parser.add_argument("--json", help="also write the report to this file")
+    parser.add_argument("--token", help="session token sent as a bearer token")
+    args = parser.parse_args()
+
+    report = run_load(args.url, args.paths, args.concurrency, args.duration, token=args.token)
+    print_report(report)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,219 @@
+"""Request timing, SQL statement profiling and a Prometheus /metrics endpoint.
+
+Enabled with LIBRARY_METRICS=1. When it is off, no hooks are registered
+and connect() hands out plain connections, so nothing is measured and
+nothing costs anything.
+
+When enabled, every request is timed from before_request to
+after_request. For streamed responses that covers the handler only, not
+sending the body. Every statement run through a connection from
+connect() is timed too, which covers execution up to the first row, and
+statements slower than LIBRARY_SLOW_QUERY_MS are logged. Metrics live in
+the process, so with several server workers each one reports its own.
+"""
+
+import logging
+import os
+import re
+import threading
+import time
+
+from flask import Response, g, has_request_context, request
+
+ENABLED = os.environ.get("LIBRARY_METRICS", "0") == "1"
+SLOW_QUERY_MS = float(os.environ.get("LIBRARY_SLOW_QUERY_MS", "100"))
+
+REQUEST_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+SQL_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1)
+COUNT_BUCKETS = (1, 2, 3, 5, 10, 20, 50, 100, 500)
+
+logger = logging.getLogger("library.metrics")
+
+
+class Histogram:
+    """Cumulative-bucket histogram with a fixed label set, rendered in the
+    Prometheus text format"""
+
+    def __init__(self, name, help_text, labels, buckets):
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels
+        self.buckets = buckets
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][i] += 1
+                    break
+            series[1] += value
+            series[2] += 1
+
+    def render(self):
+        lines = [
+            f"# HELP {self.name} {self.help_text}",
+            f"# TYPE {self.name} histogram",
+        ]
+        with self._lock:
+            snapshot = [(key, list(counts), total, count) for key, (counts, total, count) in self._series.items()]
+        for key, counts, total, count in sorted(snapshot):
+            labels = ",".join(f'{name}="{escape(value)}"' for name, value in zip(self.labels, key))
+            prefix = labels + "," if labels else ""
+            cumulative = 0
+            for bound, bucket in zip(self.buckets, counts):
+                cumulative += bucket
+                lines.append(f'{self.name}_bucket{{{prefix}le="{bound}"}} {cumulative}')
+            lines.append(f'{self.name}_bucket{{{prefix}le="+Inf"}} {count}')
+            lines.append(f"{self.name}_sum{{{labels}}} {total}")
+            lines.append(f"{self.name}_count{{{labels}}} {count}")
+        return lines
+
+
+class Counter:
+    def __init__(self, name, help_text, labels):
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + 1
+
+    def render(self):
+        lines = [
+            f"# HELP {self.name} {self.help_text}",
+            f"# TYPE {self.name} counter",
+        ]
+        with self._lock:
+            snapshot = sorted(self._values.items())
+        for key, value in snapshot:
+            labels = ",".join(f'{name}="{escape(v)}"' for name, v in zip(self.labels, key))
+            lines.append(f"{self.name}{{{labels}}} {value}")
+        return lines
+
+
+def escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+request_duration = Histogram(
+    "library_http_request_duration_seconds",
+    "Time spent handling a request, by route template.",
+    ("method", "route", "status"),
+    REQUEST_BUCKETS,
+)
+request_statements = Histogram(
+    "library_http_request_sql_statements",
+    "SQL statements executed per request.",
+    ("method", "route"),
+    COUNT_BUCKETS,
+)
+sql_duration = Histogram(
+    "library_sql_statement_duration_seconds",
+    "SQL statement execution time, by operation and main table.",
+    ("operation", "table"),
+    SQL_BUCKETS,
+)
+slow_statements = Counter(
+    "library_sql_slow_statements_total",
+    "Statements slower than the slow-query threshold.",
+    ("operation", "table"),
+)
+REGISTRY = [request_duration, request_statements, sql_duration, slow_statements]
+
+# The first table a statement reads or writes, used as a metric label
+TABLE_RE = re.compile(r"\b(?:FROM|INTO|UPDATE|JOIN)\s+([A-Za-z_]\w*)", re.IGNORECASE)
+OPERATIONS = ("SELECT", "INSERT", "UPDATE", "DELETE", "REPLACE")
+_labels_cache = {}
+
+
+def statement_labels(sql):
+    """(operation, table) labels for a statement, memoized per SQL string"""
+    labels = _labels_cache.get(sql)
+    if labels is None:
+        words = sql.split(None, 1)
+        operation = words[0].upper() if words else "OTHER"
+        if operation == "WITH":
+            upper = sql.upper()
+            found = [(upper.rfind(op), op) for op in OPERATIONS if op in upper]
+            # The main statement follows the CTEs, so take the last verb
+            operation = max(found)[1] if found else "WITH"
+        match = TABLE_RE.search(sql)
+        labels = (operation, match.group(1) if match else "")
+        if len(_labels_cache) < 10000:
+            _labels_cache[sql] = labels
+    return labels
+
+
+def record_statement(sql, elapsed):
+    operation, table = statement_labels(sql)
+    sql_duration.observe(elapsed, operation, table)
+    if has_request_context():
+        g.sql_statements = g.get("sql_statements", 0) + 1
+    if elapsed * 1000 >= SLOW_QUERY_MS:
+        slow_statements.inc(operation, table)
+        logger.warning(
+            "slow query %.1f ms%s: %s",
+            elapsed * 1000,
+            f" ({request.method} {request.path})" if has_request_context() else "",
+            " ".join(sql.split())[:500],
+        )
+
+
+class TimedExecute:
+    """Mixin for sqlite3 connections and cursors that times execute and
+    executemany"""
+
+    def execute(self, sql, *args):
+        start = time.perf_counter()
+        try:
+            return super().execute(sql, *args)
+        finally:
+            record_statement(sql, time.perf_counter() - start)
+
+    def executemany(self, sql, *args):
+        start = time.perf_counter()
+        try:
+            return super().executemany(sql, *args)
+        finally:
+            record_statement(sql, time.perf_counter() - start)
+
+
+def render():
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+def init_app(app):
+    """Register the timing hooks and /metrics when metrics are enabled"""
+    if not ENABLED:
+        return
+
+    @app.before_request
+    def start_timer():
+        g.request_start = time.perf_counter()
+        g.sql_statements = 0
+
+    @app.after_request
+    def record_request(response):
+        start = g.get("request_start")
+        if start is not None:
+            route = request.url_rule.rule if request.url_rule else "unmatched"
+            request_duration.observe(
+                time.perf_counter() - start, request.method, route, str(response.status_code)
+            )
+            request_statements.observe(g.get("sql_statements", 0), request.method, route)
+        return response
+
+    @app.route("/metrics", methods=["GET"])
+    def metrics():
+        return Response(render(), mimetype="text/plain; version=0.0.4")
@@ -0,0 +1,282 @@
+"""Trending and "readers also borrowed" recommendations.
+
+    python recommend.py --db data.db          # process new loans
+    python recommend.py --db data.db --full   # recompute from all loans
+
+update_recommendations() reads the loans added since its last run (by
+loan_id) and folds them into a few precomputed tables. The scheduler
+calls it every LIBRARY_RECOMMEND_INTERVAL seconds (default 900).
+
+- book_popularity.score ranks /api/books/trending. It adds up the book's
+  loans, each one halving in weight every LIBRARY_TRENDING_HALF_LIFE_DAYS
+  (default 14), plus LIBRARY_TRENDING_WAITLIST_WEIGHT (default 0.5) per
+  request currently waiting. Scores use forward decay: a loan at time t
+  adds 2 ** ((t - epoch) / half-life), and dividing by the same factor
+  for "now" gives the decayed score. Old rows therefore never need
+  rewriting as time passes, and a run touches only the books that
+  changed. The only exception is when the epoch falls REBASE_AFTER
+  half-lives behind: the run then moves it up to now and scales every
+  stored score down to match, before the weights overflow a float.
+- book_similarity holds the SIMILAR_K books each book is most often
+  borrowed with, for /api/books/<id>/similar. The similarity of two books
+  is their readers in common over sqrt(readers a * readers b) + SHRINK,
+  which is cosine similarity damped for books with few readers. Each new
+  reader of a book is paired with their MAX_HISTORY most recent other
+  books only, so heavy readers don't blow up the pair counts.
+
+Both endpoints read k rows by primary key or index. Requests feed
+popularity through the waitlist. They don't feed similarity, because a
+request that is served becomes a loan anyway.
+
+Loans moved to the yearly archive files are no longer in the loans
+table, so a --full rebuild only covers the last LIBRARY_LOANS_ARCHIVE_DAYS.
+"""
+
+import argparse
+import json
+import os
+import time
+from collections import Counter
+from datetime import datetime
+
+from database import connect, init_db, write_transaction
+
+HALF_LIFE_DAYS = float(os.environ.get("LIBRARY_TRENDING_HALF_LIFE_DAYS", "14"))
+if HALF_LIFE_DAYS <= 0:
+    raise ValueError("LIBRARY_TRENDING_HALF_LIFE_DAYS must be positive")
+WAITLIST_WEIGHT = float(os.environ.get("LIBRARY_TRENDING_WAITLIST_WEIGHT", "0.5"))
+SIMILAR_K = int(os.environ.get("LIBRARY_SIMILAR_K", "20"))
+MAX_HISTORY = 50
+SHRINK = 5.0
+BATCH_SIZE = 2000
+
+# Initial forward-decay reference point, kept in recommend_state once a
+# run moves it. Weights double every half-life after it, so it is moved
+# up to the run's time once it is REBASE_AFTER half-lives old, far short
+# of 2 ** 1024 overflowing.
+EPOCH = datetime(2020, 1, 1)
+REBASE_AFTER = 256
+
+
+def half_lives(start, end):
+    return (end - start).total_seconds() / (HALF_LIFE_DAYS * 86400)
+
+
+def decay_factor(moment, epoch=EPOCH):
+    """Weight of an event at `moment` relative to one at `epoch`"""
+    return 2 ** half_lives(epoch, moment)
+
+
+def get_epoch(conn):
+    return datetime.fromisoformat(get_state(conn, "epoch", EPOCH.isoformat()))
+
+
+def rebase(conn, now):
+    """Move the epoch up to `now` if it is REBASE_AFTER half-lives old,
+    scaling the stored scores by the weight that drops out"""
+    elapsed = half_lives(get_epoch(conn), now)
+    if elapsed < REBASE_AFTER:
+        return
+    # Underflows to 0 after a very long pause, when the scores are ~0 anyway
+    scale = 2 ** -elapsed
+    conn.execute(
+        "UPDATE book_popularity SET loan_score = loan_score * ?, score = score * ?",
+        (scale, scale),
+    )
+    set_state(conn, "epoch", now.isoformat())
+
+
+def parse_time(value):
+    try:
+        return datetime.fromisoformat(value)
+    except (TypeError, ValueError):
+        return datetime.now()
+
+
+def get_state(conn, name, default=None):
+    row = conn.execute("SELECT value FROM recommend_state WHERE name = ?", (name,)).fetchone()
+    return row["value"] if row else default
+
+
+def set_state(conn, name, value):
+    conn.execute(
+        """INSERT INTO recommend_state (name, value) VALUES (?, ?)
+           ON CONFLICT (name) DO UPDATE SET value = excluded.value""",
+        (name, value),
+    )
+
+
+def current_score(score, conn):
+    """Turn a stored score into loans-equivalent as of the last run"""
+    scored_at = get_state(conn, "scored_at")
+    if not scored_at:
+        return 0.0
+    return score / decay_factor(datetime.fromisoformat(scored_at), get_epoch(conn))
+
+
+def fold_loans(conn, loans):
+    """Add a batch of loans to the popularity and pair counts. Returns the
+    books whose readers or pairs changed."""
+    epoch = get_epoch(conn)
+    loan_score = Counter()
+    readers = Counter()
+    pairs = Counter()
+    for loan in loans:
+        book_id, user_id = loan["book_id"], loan["user_id"]
+        loan_score[book_id] += decay_factor(parse_time(loan["borrowed_date"]), epoch)
+        new_reader = conn.execute(
+            "INSERT OR IGNORE INTO book_readers (user_id, book_id, last_read) VALUES (?, ?, ?)",
+            (user_id, book_id, loan["borrowed_date"]),
+        ).rowcount
+        if not new_reader:
+            conn.execute(
+                "UPDATE book_readers SET last_read = MAX(last_read, ?) WHERE user_id = ? AND book_id = ?",
+                (loan["borrowed_date"], user_id, book_id),
+            )
+            continue
+        readers[book_id] += 1
+        for (other_id,) in conn.execute(
+            """SELECT book_id FROM book_readers
+               WHERE user_id = ? AND book_id != ?
+               ORDER BY last_read DESC LIMIT ?""",
+            (user_id, book_id, MAX_HISTORY),
+        ):
+            pairs[book_id, other_id] += 1
+            pairs[other_id, book_id] += 1
+
+    conn.executemany(
+        """INSERT INTO book_popularity (book_id, readers, loan_score, score)
+           VALUES (?, ?, ?, ?)
+           ON CONFLICT (book_id) DO UPDATE SET
+               readers = readers + excluded.readers,
+               loan_score = loan_score + excluded.loan_score,
+               score = score + excluded.loan_score""",
+        [
+            (book_id, readers[book_id], loan_score[book_id], loan_score[book_id])
+            for book_id in sorted(loan_score)
+        ],
+    )
+    conn.executemany(
+        """INSERT INTO book_pairs (book_id, other_id, together) VALUES (?, ?, ?)
+           ON CONFLICT (book_id, other_id) DO UPDATE SET together = together + excluded.together""",
+        # In key order, so the upserts walk the primary key once
+        [(book_id, other_id, count) for (book_id, other_id), count in sorted(pairs.items())],
+    )
+    return set(readers) | {book_id for book_id, _ in pairs}
+
+
+def refresh_waitlist(conn, now):
+    """Store the current waiting requests per book and rescore the books
+    whose waitlist is or was non-empty"""
+    waiting = dict(
+        conn.execute(
+            """SELECT bc.book_id, COUNT(*) FROM book_requests r
+               JOIN book_copies bc ON bc.copy_id = r.copy_id
+               WHERE r.status = 'waiting'
+               GROUP BY bc.book_id"""
+        ).fetchall()
+    )
+    previous = [row[0] for row in conn.execute("SELECT book_id FROM book_popularity WHERE waitlist > 0")]
+    rows = [(book_id, waiting.get(book_id, 0)) for book_id in set(previous) | set(waiting)]
+    conn.executemany(
+        """INSERT INTO book_popularity (book_id, waitlist) VALUES (?, ?)
+           ON CONFLICT (book_id) DO UPDATE SET waitlist = excluded.waitlist""",
+        rows,
+    )
+    conn.execute(
+        "UPDATE book_popularity SET score = loan_score + ? * waitlist WHERE book_id IN (SELECT value FROM json_each(?))",
+        (WAITLIST_WEIGHT * decay_factor(now, get_epoch(conn)), json.dumps([book_id for book_id, _ in rows])),
+    )
+
+
+def refresh_similarity(conn, book_ids):
+    """Recompute the top SIMILAR_K list of each of `book_ids`"""
+    for book_id in book_ids:
+        top = conn.execute(
+            """
+            SELECT p.other_id, p.together / (sqrt(a.readers * b.readers) + ?) AS score
+            FROM book_pairs p
+            JOIN book_popularity a ON a.book_id = p.book_id
+            JOIN book_popularity b ON b.book_id = p.other_id
+            WHERE p.book_id = ?
+            ORDER BY score DESC, p.other_id
+            LIMIT ?
+            """,
+            (SHRINK, book_id, SIMILAR_K),
+        ).fetchall()
+        conn.execute("DELETE FROM book_similarity WHERE book_id = ?", (book_id,))
+        conn.executemany(
+            "INSERT INTO book_similarity (book_id, rank, similar_id, score) VALUES (?, ?, ?, ?)",
+            [(book_id, rank, row[0], row[1]) for rank, row in enumerate(top, start=1)],
+        )
+
+
+def clear(conn):
+    with write_transaction(conn):
+        for table in ("book_popularity", "book_readers", "book_pairs", "book_similarity", "recommend_state"):
+            conn.execute(f"DELETE FROM {table}")
+
+
+def update_recommendations(conn, now=None, batch_size=BATCH_SIZE):
+    """Fold the loans added since the last run into the recommendation
+    tables. Returns the number of loans processed."""
+    now = now or datetime.now()
+    with write_transaction(conn):
+        rebase(conn, now)
+    touched = set()
+    processed = 0
+    while True:
+        # Each batch commits with its high-water mark, so an interrupted
+        # run resumes where it stopped. The mark is read under the write
+        # lock: another process sweeping at the same time may have moved
+        # it, and folding the same loans twice would count them twice.
+        with write_transaction(conn):
+            last_loan = get_state(conn, "last_loan_id", 0)
+            loans = conn.execute(
+                """SELECT loan_id, book_id, user_id, borrowed_date FROM loans
+                   WHERE loan_id > ? ORDER BY loan_id LIMIT ?""",
+                (last_loan, batch_size),
+            ).fetchall()
+            if loans:
+                touched |= fold_loans(conn, loans)
+                last_loan = loans[-1]["loan_id"]
+                set_state(conn, "last_loan_id", last_loan)
+        processed += len(loans)
+        if len(loans) < batch_size:
+            break
+
+    touched = sorted(touched)
+    for start in range(0, len(touched), batch_size):
+        with write_transaction(conn):
+            refresh_similarity(conn, touched[start : start + batch_size])
+
+    with write_transaction(conn):
+        refresh_waitlist(conn, now)
+        set_state(conn, "scored_at", now.isoformat())
+        conn.execute(
+            """INSERT INTO cache_versions (scope, version, updated_at)
+               VALUES ('recommendations', 1, CURRENT_TIMESTAMP)
+               ON CONFLICT (scope) DO UPDATE
+               SET version = version + 1, updated_at = excluded.updated_at"""
+        )
+    return processed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Update the recommendation tables")
+    parser.add_argument("--db", default=os.environ.get("LIBRARY_DB_PATH", "data.db"))
+    parser.add_argument("--full", action="store_true", help="discard the tables and start over")
+    args = parser.parse_args()
+
+    init_db(args.db)
+    conn = connect(args.db)
+    start = time.perf_counter()
+    if args.full:
+        clear(conn)
+    processed = update_recommendations(conn)
+    print(f"{processed} loans processed in {time.perf_counter() - start:.1f}s")
+    conn.close()
+
+
+if __name__ == "__main__":
+    main()
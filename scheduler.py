@@ -0,0 +1,321 @@
+"""Background sweeps over loans and the request queues.
+
+A daemon thread wakes every
+LIBRARY_SWEEP_INTERVAL seconds (default 300) and does two sweeps:
+
+- it flags lent copies whose due_date has passed as overdue;
+- it drops the waiting requests on copies overdue by more than
+  LIBRARY_REQUEST_TTL_DAYS (default 30), which are presumably lost and
+  will never be handed on, so their readers can ask for another copy.
+  A request on a copy that comes back keeps its place however long the
+  queue ahead of it takes, since the copy is handed to it on return.
+
+It also prunes rows of the changes feed older than
+LIBRARY_CHANGES_RETENTION_HOURS (default 24). Clients resuming from a
+pruned seq are told to reload instead. Loans returned more than
+LIBRARY_LOANS_ARCHIVE_DAYS ago (default 365) are moved out of the loans
+table into one archive file per year, loans-<year>.db, in
+LIBRARY_ARCHIVE_DIR (default: next to the database). Attach those files
+to query old history. Loans not yet folded into the recommendation
+tables are kept until they are.
+
+Every LIBRARY_RECOMMEND_INTERVAL seconds (default 900, starting with the
+first sweep) it folds new loans into the recommendation tables, see
+recommend.py.
+
+About once every LIBRARY_STATS_RECOMPUTE_INTERVAL seconds (default
+3600) it recounts the library_stats dashboard counters from
+scratch, which corrects any drift, e.g. after rows were edited with
+triggers disabled.
+
+Each affected user gets a row in the notifications outbox, for a mailer
+or push worker to pick up. The sweeps use their own connection, so they
+never take a slot from the request pools. Both walk partial indexes, so
+the cost depends on the rows they change, not on the size of
+book_copies. They work in batches of LIBRARY_SWEEP_BATCH rows, each in a
+short BEGIN IMMEDIATE transaction, so request writers only ever wait for
+one batch.
+
+The thread is started by serve.py and by `python backend.py`, unless
+LIBRARY_SCHEDULER=0. Importing backend (scripts, tests, the reloader's
+parent process) doesn't start it.
+
+Several processes may run sweeps at once: each batch claims its rows
+with a conditional write, so nothing is flagged or notified twice.
+"""
+
+import json
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+
+import recommend
+from database import (
+    LOAN_COLUMNS,
+    LOANS_SCHEMA,
+    connect,
+    rebuild_library_stats,
+    write_transaction,
+)
+
+ENABLED = os.environ.get("LIBRARY_SCHEDULER", "1") == "1"
+SWEEP_INTERVAL = float(os.environ.get("LIBRARY_SWEEP_INTERVAL", "300"))
+SWEEP_BATCH = int(os.environ.get("LIBRARY_SWEEP_BATCH", "500"))
+REQUEST_TTL_DAYS = float(os.environ.get("LIBRARY_REQUEST_TTL_DAYS", "30"))
+CHANGES_RETENTION_HOURS = float(os.environ.get("LIBRARY_CHANGES_RETENTION_HOURS", "24"))
+LOANS_ARCHIVE_DAYS = float(os.environ.get("LIBRARY_LOANS_ARCHIVE_DAYS", "365"))
+ARCHIVE_DIR = os.environ.get("LIBRARY_ARCHIVE_DIR")
+RECOMMEND_INTERVAL = float(os.environ.get("LIBRARY_RECOMMEND_INTERVAL", "900"))
+STATS_RECOMPUTE_INTERVAL = float(os.environ.get("LIBRARY_STATS_RECOMPUTE_INTERVAL", "3600"))
+
+logger = logging.getLogger("library.scheduler")
+
+
+def sweep_overdue(conn, now=None, batch_size=SWEEP_BATCH):
+    """Flag lent copies past their due date and queue a notification for
+    each borrower. Returns the number of copies flagged."""
+    # due_date is written with datetime.isoformat(), so string order is
+    # time order
+    cutoff = (now or datetime.now()).isoformat()
+    flagged = 0
+    while True:
+        with write_transaction(conn):
+            rows = conn.execute(
+                """
+                UPDATE book_copies SET overdue = 1
+                WHERE copy_id IN (
+                    SELECT copy_id FROM book_copies
+                    WHERE is_available = 0 AND overdue = 0 AND due_date < ?
+                    ORDER BY due_date LIMIT ?
+                )
+                RETURNING copy_id, book_id, borrowed_by, due_date
+                """,
+                (cutoff, batch_size),
+            ).fetchall()
+            conn.executemany(
+                """INSERT INTO notifications (user_id, kind, copy_id, payload)
+                   VALUES (?, 'overdue', ?, ?)""",
+                [
+                    (
+                        row["borrowed_by"],
+                        row["copy_id"],
+                        json.dumps({"book_id": row["book_id"], "due_date": row["due_date"]}),
+                    )
+                    for row in rows
+                    if row["borrowed_by"] is not None
+                ],
+            )
+        flagged += len(rows)
+        if len(rows) < batch_size:
+            return flagged
+
+
+def expire_requests(conn, now=None, ttl_days=REQUEST_TTL_DAYS, batch_size=SWEEP_BATCH):
+    """Drop the waiting requests on copies more than `ttl_days` overdue,
+    and notify their users. Returns the number removed."""
+    # Same format as due_date, see sweep_overdue
+    cutoff = ((now or datetime.now()) - timedelta(days=ttl_days)).isoformat()
+    expired = 0
+    while True:
+        with write_transaction(conn):
+            # Overdue copies along idx_book_copies_due, then their queues
+            rows = conn.execute(
+                """
+                DELETE FROM book_requests
+                WHERE request_id IN (
+                    SELECT br.request_id FROM book_copies bc
+                    JOIN book_requests br ON br.copy_id = bc.copy_id AND br.status = 'waiting'
+                    WHERE bc.is_available = 0 AND bc.overdue = 1 AND bc.due_date < ?
+                    LIMIT ?
+                )
+                RETURNING request_id, copy_id, user_id, requested_date
+                """,
+                (cutoff, batch_size),
+            ).fetchall()
+            conn.executemany(
+                """INSERT INTO notifications (user_id, kind, copy_id, payload)
+                   VALUES (?, 'request_expired', ?, ?)""",
+                [
+                    (
+                        row["user_id"],
+                        row["copy_id"],
+                        json.dumps(
+                            {
+                                "request_id": row["request_id"],
+                                "requested_date": row["requested_date"],
+                            }
+                        ),
+                    )
+                    for row in rows
+                ],
+            )
+        expired += len(rows)
+        if len(rows) < batch_size:
+            return expired
+
+
+def prune_changes(conn, now=None, retention_hours=CHANGES_RETENTION_HOURS, batch_size=SWEEP_BATCH):
+    """Delete changes feed rows older than `retention_hours`. Returns the
+    number of rows removed."""
+    cutoff = ((now or datetime.utcnow()) - timedelta(hours=retention_hours)).strftime(
+        "%Y-%m-%d %H:%M:%S"
+    )
+    pruned = 0
+    while True:
+        with write_transaction(conn):
+            # Oldest first along the primary key, stopping at the cutoff
+            removed = conn.execute(
+                """
+                DELETE FROM changes
+                WHERE seq IN (
+                    SELECT seq FROM changes WHERE created_at < ? ORDER BY seq LIMIT ?
+                )
+                """,
+                (cutoff, batch_size),
+            ).rowcount
+        pruned += removed
+        if removed < batch_size:
+            return pruned
+
+
+def archive_path(conn, year, directory=None):
+    """The archive file for loans that started in `year`"""
+    if directory is None:
+        main = conn.execute("PRAGMA database_list").fetchone()["file"]
+        directory = ARCHIVE_DIR or os.path.dirname(main) or "."
+    return os.path.join(directory, f"loans-{year}.db")
+
+
+def archive_loans(conn, now=None, days=LOANS_ARCHIVE_DAYS, directory=None, batch_size=SWEEP_BATCH):
+    """Move loans returned more than `days` ago from the loans table to the
+    archive file of the year they started in. Loans the recommendation job
+    hasn't folded in yet stay until it has. Returns the number moved."""
+    # returned_date is written in the isoformat() layout, local time
+    cutoff = ((now or datetime.now()) - timedelta(days=days)).isoformat()
+    folded = recommend.get_state(conn, "last_loan_id", 0)
+    columns = LOAN_COLUMNS.split(", ")
+    placeholders = ", ".join("?" * len(columns))
+    attached = []
+    moved = 0
+    try:
+        while True:
+            rows = conn.execute(
+                f"""SELECT {LOAN_COLUMNS} FROM loans
+                    WHERE returned_date < ? AND loan_id <= ?
+                    ORDER BY returned_date LIMIT ?""",
+                (cutoff, folded, batch_size),
+            ).fetchall()
+            if not rows:
+                return moved
+
+            by_year = {}
+            for row in rows:
+                year = row["borrowed_date"][:4]
+                by_year.setdefault(year if year.isdigit() else "0000", []).append(tuple(row))
+            for year in by_year:
+                if f"archive_{year}" not in attached:
+                    # ATTACH can't run inside a transaction
+                    conn.execute(
+                        f"ATTACH DATABASE ? AS archive_{year}",
+                        (archive_path(conn, year, directory),),
+                    )
+                    attached.append(f"archive_{year}")
+                    conn.execute(LOANS_SCHEMA.format(schema=f"archive_{year}."))
+
+            # Copy, then delete, in two transactions: with WAL a commit is
+            # not atomic across files, and a copy repeated after a crash is
+            # ignored, where a lost one would be gone
+            with write_transaction(conn):
+                for year, group in by_year.items():
+                    conn.executemany(
+                        f"INSERT OR IGNORE INTO archive_{year}.loans ({LOAN_COLUMNS}) VALUES ({placeholders})",
+                        group,
+                    )
+            with write_transaction(conn):
+                conn.executemany(
+                    "DELETE FROM loans WHERE loan_id = ?", [(row["loan_id"],) for row in rows]
+                )
+            moved += len(rows)
+            if len(rows) < batch_size:
+                return moved
+    finally:
+        for name in attached:
+            conn.execute(f"DETACH DATABASE {name}")
+
+
+class Scheduler:
+    """Runs the sweeps on a daemon thread until stop() is called"""
+
+    def __init__(self, interval=SWEEP_INTERVAL, path=None):
+        self.interval = interval
+        self.path = path
+        self._stop = threading.Event()
+        self._thread = None
+        self._last_recount = time.monotonic()
+        self._last_recommend = None
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(
+            target=self.run, name="library-scheduler", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self, timeout=10):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def run(self):
+        conn = connect(self.path)
+        try:
+            while not self._stop.is_set():
+                try:
+                    self.sweep(conn)
+                except Exception:
+                    logger.exception("sweep failed")
+                self._stop.wait(self.interval)
+        finally:
+            conn.close()
+
+    def sweep(self, conn):
+        start = time.perf_counter()
+        overdue = sweep_overdue(conn)
+        expired = expire_requests(conn)
+        prune_changes(conn)
+        # Before archiving, which only moves loans that are folded in
+        recommended = 0
+        if self._last_recommend is None or time.monotonic() - self._last_recommend >= RECOMMEND_INTERVAL:
+            recommended = recommend.update_recommendations(conn)
+            self._last_recommend = time.monotonic()
+        archived = archive_loans(conn)
+        if time.monotonic() - self._last_recount >= STATS_RECOMPUTE_INTERVAL:
+            with write_transaction(conn):
+                rebuild_library_stats(conn.cursor())
+            self._last_recount = time.monotonic()
+        if overdue or expired or archived or recommended:
+            logger.info(
+                "sweep: %d copies overdue, %d requests expired, %d loans archived, "
+                "%d loans folded into recommendations in %.2fs",
+                overdue,
+                expired,
+                archived,
+                recommended,
+                time.perf_counter() - start,
+            )
+        return {"overdue": overdue, "expired": expired, "archived": archived}
+
+
+sweeper = Scheduler()
+
+
+def init_app(app):
+    """Start the sweeps alongside the app unless LIBRARY_SCHEDULER=0. Call
+    it from the process that serves requests, not at import time."""
+    if ENABLED:
+        sweeper.start()
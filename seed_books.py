@@ -1,10 +1,42 @@
-import sqlite3
-from datetime import datetime
+"""Synthetic library generator.
+
+    python seed_books.py
+    python seed_books.py --fresh --db big.db --users 1000000 --books 2000000 \\
+        --loans 1500000 --requests 3000000 --seed 7
+
+With no options it writes the sample library to data.db: 3 users and 20
+books. Every size is a flag, and the same --seed always produces the same
+library. Book popularity follows a Zipf distribution (--zipf), and loans
+and waitlist entries are drawn from it. The result is a handful of titles
+that are always out with long queues, while most of the catalog sits on
+the shelf. --history adds returned loans from the past year straight to
+the loans table, as input for the recommendation job (recommend.py).
+
+Lookup ids are resolved once up front, and rows go in with executemany
+in batches of --batch. --fresh recreates the file and loads it with the
+journal and fsync off, with triggers and secondary indexes dropped. At
+the end it builds the indexes, books_fts and book_summary in one pass
+and restores the triggers. Without --fresh, rows are added to an existing
+database in a single transaction and the triggers stay in place.
+"""
+
+import argparse
+import itertools
+import os
 import random
+import time
+from collections import Counter
+from contextlib import contextmanager, nullcontext
+from datetime import datetime, timedelta
 
-# Connect to database
-conn = sqlite3.connect("data.db")
-cur = conn.cursor()
+from database import (
+    connect,
+    init_db,
+    rebuild_book_summary,
+    rebuild_library_stats,
+    rebuild_open_loans,
+    rebuild_search_index,
+)
 
 # Sample data
 themes = [
@@ -26,6 +58,7 @@ publishers = [
     "Oxford Press",
     "Cambridge Press",
 ]
+branches = ["Main branch", "North branch", "East branch"]
 locations = [
     "Aisle A",
     "Aisle B",
@@ -125,8 +158,6 @@ book_images = [
     "https://covers.openlibrary.org/b/id/8421474-M.jpg",  # Les Misérables
 ]
 
-# Insert Users
-print("📝 Inserting users...")
 users_data = [
     {
         "fname": "Admin",
@@ -169,133 +200,485 @@ users_data = [
     },
 ]
 
-for user in users_data:
-    try:
-        cur.execute(
-            """INSERT INTO users (fname, lname, age, state, username, email, password, address, phone, role, is_subscribed)
-               VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
-            (
-                user["fname"],
-                user["lname"],
-                user["age"],
-                user["state"],
-                user["username"],
-                user["email"],
-                user["password"],
-                user["address"],
-                user["phone"],
-                user["role"],
-                user["is_subscribed"],
-            ),
+# Pragmas for loading a fresh file: if the load fails the file is garbage
+# anyway, so skip the journal and fsyncs
+BULK_PRAGMAS = (
+    "PRAGMA foreign_keys = OFF",
+    "PRAGMA journal_mode = OFF",
+    "PRAGMA synchronous = OFF",
+    "PRAGMA locking_mode = EXCLUSIVE",
+    "PRAGMA cache_size = -262144",
+    "PRAGMA temp_store = MEMORY",
+)
+BATCH_SIZE = 10000
+# Reading-taste bands for the past loans (see history_rows)
+TASTES = 16
+
+
+def zipf_cum_weights(n, exponent):
+    """Cumulative weights for ranks 1..n under a Zipf distribution"""
+    return list(itertools.accumulate(1.0 / rank**exponent for rank in range(1, n + 1)))
+
+
+def batched(rows, size):
+    iterator = iter(rows)
+    while True:
+        batch = list(itertools.islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+
+def draw_loans(rng, by_rank, cum_weights, copy_counts, count):
+    """Spread `count` loans over books by popularity and return
+    {book_id: copies lent}. A draw that lands on a fully lent title moves
+    down to the next title that still has a copy on the shelf."""
+    n = len(by_rank)
+    # next_free[r] leads to the first rank >= r with a copy left (n = none)
+    next_free = list(range(n + 1))
+
+    def find(rank):
+        root = rank
+        while next_free[root] != root:
+            root = next_free[root]
+        while next_free[rank] != root:
+            next_free[rank], rank = root, next_free[rank]
+        return root
+
+    loans = Counter()
+    count = min(count, sum(copy_counts.values()))
+    for rank in rng.choices(range(n), cum_weights=cum_weights, k=count) if n else []:
+        rank = find(rank)
+        if rank == n:
+            rank = find(0)
+        book_id = by_rank[rank]
+        loans[book_id] += 1
+        if loans[book_id] == copy_counts[book_id]:
+            next_free[rank] = rank + 1
+    return loans
+
+
+def ensure_lookups(cur, table, column, names):
+    """Insert any missing names and return {name: id} for the whole table"""
+    cur.executemany(
+        f"INSERT OR IGNORE INTO {table} ({column}) VALUES (?)",
+        ((name,) for name in names),
+    )
+    return dict(cur.execute(f"SELECT {column}, id FROM {table}"))
+
+
+def ensure_shelves(cur):
+    """Create the sample branches with every shelf in each and return
+    [(shelf name, location id), ...]"""
+    cur.executemany(
+        "INSERT OR IGNORE INTO locations (name) VALUES (?)", ((name,) for name in branches)
+    )
+    cur.executemany(
+        """INSERT OR IGNORE INTO locations (name, parent_id)
+           SELECT ?, id FROM locations WHERE parent_id IS NULL AND name = ?""",
+        ((shelf, branch) for branch in branches for shelf in locations),
+    )
+    return [
+        tuple(row)
+        for row in cur.execute(
+            """SELECT l.name, l.id FROM locations l
+               JOIN locations b ON b.id = l.parent_id
+               WHERE b.name IN ({})
+               ORDER BY l.id""".format(",".join("?" * len(branches))),
+            branches,
         )
-        print(f"✓ Inserted user: {user['email']} ({user['role']})")
-    except Exception as e:
-        print(f"Error inserting user {user['email']}: {e}")
-        conn.rollback()
+    ]
 
-# Generate 20 unique books with 3 copies each
-print("\n📚 Inserting books...")
-for i in range(20):
-    try:
-        # Generate book data
-        title = book_titles[i]
-        catalog_code = f"BOOK{str(i+1).zfill(5)}"
-        theme = random.choice(themes)
-        publisher = random.choice(publishers)
-        poster = book_images[i]  # One-to-one mapping with working images
-
-        # Get or create theme
-        cur.execute("SELECT id FROM themes WHERE name = ?", (theme,))
-        theme_result = cur.fetchone()
-        if theme_result:
-            theme_id = theme_result[0]
-        else:
-            cur.execute("INSERT INTO themes (name) VALUES (?)", (theme,))
-            theme_id = cur.lastrowid
-
-        # Get or create publisher
-        cur.execute("SELECT id FROM publishers WHERE name = ?", (publisher,))
-        pub_result = cur.fetchone()
-        if pub_result:
-            publisher_id = pub_result[0]
-        else:
-            cur.execute("INSERT INTO publishers (name) VALUES (?)", (publisher,))
-            publisher_id = cur.lastrowid
-
-        # Insert book
-        cur.execute(
-            """INSERT INTO books (catalog_code, title, theme_id, publisher_id, poster)
-               VALUES (?, ?, ?, ?, ?)""",
-            (catalog_code, title, theme_id, publisher_id, poster),
+
+def next_id(cur, table, column):
+    return cur.execute(f"SELECT COALESCE(MAX({column}), 0) + 1 FROM {table}").fetchone()[0]
+
+
+@contextmanager
+def deferred_schema(conn):
+    """Drop triggers and non-unique indexes for a bulk load, then rebuild the
+    indexes and trigger-maintained tables and put the triggers back"""
+    # Unique indexes are constraints the load relies on, so they stay
+    saved = conn.execute(
+        """SELECT type, name, sql FROM sqlite_master
+           WHERE type IN ('index', 'trigger') AND sql IS NOT NULL
+           AND sql NOT LIKE 'CREATE UNIQUE%'"""
+    ).fetchall()
+    for kind, name, _ in saved:
+        conn.execute(f"DROP {kind.upper()} IF EXISTS {name}")
+
+    yield
+
+    cur = conn.cursor()
+    for kind, _, sql in saved:
+        if kind == "index":
+            cur.execute(sql)
+    rebuild_search_index(cur)
+    rebuild_book_summary(cur)
+    rebuild_library_stats(cur)
+    rebuild_open_loans(cur)
+    for kind, _, sql in saved:
+        if kind == "trigger":
+            cur.execute(sql)
+
+
+def user_rows(rng, start, count):
+    for user_id in range(start, start + count):
+        yield (
+            user_id,
+            f"Reader{user_id}",
+            "Synthetic",
+            rng.randint(8, 80),
+            rng.choice(("kid", "student", "pro")),
+            f"reader{user_id}",
+            f"reader{user_id}@example.com",
+            f"reader{user_id}",
+            f"{user_id} Synthetic St, City, State",
+            f"555-{user_id:07d}",
+            "user",
+            int(rng.random() < 0.3),
         )
-        book_id = cur.lastrowid
-
-        # Add random authors (1-3 per book)
-        num_authors = random.randint(1, 3)
-        selected_authors = random.sample(authors, num_authors)
-        for author_name in selected_authors:
-            cur.execute("SELECT id FROM authors WHERE name = ?", (author_name,))
-            auth_result = cur.fetchone()
-            if auth_result:
-                author_id = auth_result[0]
-            else:
-                cur.execute("INSERT INTO authors (name) VALUES (?)", (author_name,))
-                author_id = cur.lastrowid
-
-            cur.execute(
-                """INSERT INTO book_authors (book_id, author_id) VALUES (?, ?)""",
-                (book_id, author_id),
-            )
 
-        # Add random keywords (2-4 per book)
-        num_keywords = random.randint(2, 4)
-        selected_keywords = random.sample(keywords_list, num_keywords)
-        for keyword in selected_keywords:
-            cur.execute("SELECT id FROM keyword WHERE word = ?", (keyword,))
-            kw_result = cur.fetchone()
-            if kw_result:
-                keyword_id = kw_result[0]
-            else:
-                cur.execute("INSERT INTO keyword (word) VALUES (?)", (keyword,))
-                keyword_id = cur.lastrowid
-
-            cur.execute(
-                """INSERT INTO book_keywords (book_id, keyword_id) VALUES (?, ?)""",
-                (book_id, keyword_id),
-            )
 
-        # Insert 3 copies for each book
-        for copy_num in range(3):
-            copy_location = random.choice(locations)
-            copy_publisher = random.choice(publishers)
-
-            # Get or create copy's publisher
-            cur.execute("SELECT id FROM publishers WHERE name = ?", (copy_publisher,))
-            copy_pub_result = cur.fetchone()
-            if copy_pub_result:
-                copy_publisher_id = copy_pub_result[0]
-            else:
-                cur.execute(
-                    "INSERT INTO publishers (name) VALUES (?)", (copy_publisher,)
-                )
-                copy_publisher_id = cur.lastrowid
+def insert_users(cur, rng, count, batch_size, log):
+    """Insert the sample users (if missing) plus `count` synthetic readers
+    and return every user id"""
+    cur.executemany(
+        """INSERT OR IGNORE INTO users (fname, lname, age, state, username, email, password, address, phone, role, is_subscribed)
+           VALUES (:fname, :lname, :age, :state, :username, :email, :password, :address, :phone, :role, :is_subscribed)""",
+        users_data,
+    )
+    start = next_id(cur, "users", "user_id")
+    for batch in batched(user_rows(rng, start, count), batch_size):
+        cur.executemany(
+            """INSERT INTO users (user_id, fname, lname, age, state, username, email, password, address, phone, role, is_subscribed)
+               VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+            batch,
+        )
+        log(f"users: {batch[-1][0] - start + 1}/{count}")
+    return [row[0] for row in cur.execute("SELECT user_id FROM users")]
+
+
+def insert_books(cur, rng, options, user_ids, log):
+    """Insert books with their authors, keywords and copies.
+
+    Copies are lent out as they are written: each book gets the number of
+    loans its popularity drew, capped at its copy count. Returns
+    {book_id: [(copy_id, borrower), ...]} for the lent copies.
+    """
+    count = options["books"]
+    theme_ids = list(ensure_lookups(cur, "themes", "name", themes).values())
+    publisher_ids = list(
+        ensure_lookups(
+            cur,
+            "publishers",
+            "name",
+            publishers + [f"Publisher {i}" for i in range(count // 1000)],
+        ).values()
+    )
+    author_ids = list(
+        ensure_lookups(
+            cur,
+            "authors",
+            "name",
+            authors + [f"Author {i}" for i in range(count // 10)],
+        ).values()
+    )
+    keyword_ids = list(
+        ensure_lookups(
+            cur,
+            "keyword",
+            "word",
+            keywords_list + [f"topic{i}" for i in range(options["keywords"])],
+        ).values()
+    )
+
+    shelves = ensure_shelves(cur)
+
+    first_book = next_id(cur, "books", "id")
+    first_copy = next_id(cur, "book_copies", "copy_id")
+    book_ids = list(range(first_book, first_book + count))
 
-            cur.execute(
-                """INSERT INTO book_copies (book_id, location, publisher_id, is_available, state)
-                   VALUES (?, ?, ?, 1, 100)""",
-                (book_id, copy_location, copy_publisher_id),
+    # Popularity rank is a random permutation of the new books
+    by_rank = book_ids[:]
+    rng.shuffle(by_rank)
+    cum_weights = zipf_cum_weights(count, options["zipf"]) if count else []
+    copy_counts = {book_id: options["copies"] for book_id in book_ids}
+    loans = draw_loans(rng, by_rank, cum_weights, copy_counts, options["loans"])
+
+    now = datetime.now()
+    lent = {}
+    copy_id = first_copy
+
+    for batch in batched(book_ids, options["batch_size"]):
+        books, book_authors, book_keywords, copies = [], [], [], []
+        for book_id in batch:
+            i = book_id - first_book
+            title = book_titles[i % len(book_titles)]
+            if i >= len(book_titles):
+                title = f"{title} (Vol. {i // len(book_titles) + 1})"
+            books.append(
+                (
+                    book_id,
+                    f"BOOK{book_id:05d}",
+                    title,
+                    rng.choice(theme_ids),
+                    rng.choice(publisher_ids),
+                    book_images[i % len(book_images)],
+                )
+            )
+            book_authors.extend(
+                (book_id, author_id)
+                for author_id in rng.sample(author_ids, rng.randint(1, 3))
+            )
+            book_keywords.extend(
+                (book_id, keyword_id)
+                for keyword_id in rng.sample(keyword_ids, rng.randint(2, 4))
             )
 
-        print(f"✓ Inserted '{title}' with 3 copies...")
+            n_copies = copy_counts[book_id]
+            n_lent = loans[book_id]
+            for n in range(n_copies):
+                if n < n_lent:
+                    borrower = rng.choice(user_ids)
+                    borrowed = now - timedelta(days=rng.randint(0, 30), minutes=rng.randint(0, 1439))
+                    copies.append(
+                        (
+                            copy_id, book_id, *rng.choice(shelves), rng.choice(publisher_ids),
+                            0, borrower, borrowed.isoformat(),
+                            (borrowed + timedelta(days=15)).isoformat(),
+                            rng.randint(20, 100),
+                        )
+                    )
+                    lent.setdefault(book_id, []).append((copy_id, borrower))
+                else:
+                    copies.append(
+                        (
+                            copy_id, book_id, *rng.choice(shelves), rng.choice(publisher_ids),
+                            1, None, None, None, rng.randint(20, 100),
+                        )
+                    )
+                copy_id += 1
+
+        cur.executemany(
+            """INSERT INTO books (id, catalog_code, title, theme_id, publisher_id, poster)
+               VALUES (?, ?, ?, ?, ?, ?)""",
+            books,
+        )
+        cur.executemany(
+            "INSERT INTO book_authors (book_id, author_id) VALUES (?, ?)", book_authors
+        )
+        cur.executemany(
+            "INSERT INTO book_keywords (book_id, keyword_id) VALUES (?, ?)", book_keywords
+        )
+        cur.executemany(
+            """INSERT INTO book_copies (copy_id, book_id, location, location_id, publisher_id,
+                                        is_available, borrowed_by, borrowed_date, due_date, state)
+               VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+            copies,
+        )
+        log(f"books: {batch[-1] - first_book + 1}/{count} ({copy_id - first_copy} copies)")
+
+    return lent, by_rank, cum_weights
+
+
+def request_rows(rng, count, lent, by_rank, cum_weights, user_ids):
+    """Waitlist entries on lent copies, concentrated on popular titles.
+    Positions increase per copy in draw order."""
+    if not lent:
+        return
+    # Same format and clock (UTC) as the CURRENT_TIMESTAMP default
+    now = datetime.utcnow()
+    positions = Counter()
+    made = 0
+    # Popular titles always have lent copies; draws that land on a title
+    # with none are skipped, so bound the attempts
+    for book_id in rng.choices(by_rank, cum_weights=cum_weights, k=count * 3):
+        if made == count:
+            return
+        held = lent.get(book_id)
+        if not held:
+            continue
+        copy_id, holder = rng.choice(held)
+        user_id = rng.choice(user_ids)
+        if user_id == holder:
+            continue
+        positions[copy_id] += 1
+        made += 1
+        requested = now - timedelta(days=14) + timedelta(seconds=positions[copy_id] * 60)
+        yield (copy_id, user_id, requested.strftime("%Y-%m-%d %H:%M:%S"), positions[copy_id])
+
 
-    except Exception as e:
-        print(f"Error inserting book {i + 1}: {e}")
+def insert_requests(cur, rng, options, lent, by_rank, cum_weights, user_ids, log):
+    # Duplicate (copy, user) draws are dropped by the unique constraint;
+    # the gaps they leave in positions are harmless since ranks are computed
+    for batch in batched(
+        request_rows(rng, options["requests"], lent, by_rank, cum_weights, user_ids),
+        options["batch_size"],
+    ):
+        cur.executemany(
+            """INSERT OR IGNORE INTO book_requests (copy_id, user_id, requested_date, position, status)
+               VALUES (?, ?, ?, ?, 'waiting')""",
+            batch,
+        )
+        log(f"requests: +{len(batch)}")
+
+
+def history_rows(rng, count, by_rank, cum_weights, user_ids, first_copies):
+    """Returned loans from the past year. Half the draws follow global
+    popularity, the other half are shifted to one of TASTES bands of the
+    catalog picked by the reader, so readers of a band borrow its books
+    together."""
+    now = datetime.now()
+    n = len(by_rank)
+    for rank in rng.choices(range(n), cum_weights=cum_weights, k=count) if n else []:
+        user_id = rng.choice(user_ids)
+        if rng.random() < 0.5:
+            rank = (rank + (user_id % TASTES) * n // TASTES) % n
+        book_id = by_rank[rank]
+        borrowed = now - timedelta(days=rng.uniform(20, 365))
+        due = borrowed + timedelta(days=15)
+        returned = borrowed + timedelta(days=rng.randint(1, 20))
+        yield (
+            first_copies[book_id], book_id, user_id, borrowed.isoformat(), due.isoformat(),
+            returned.isoformat(), int(returned > due),
+        )
+
+
+def insert_history(cur, rng, options, by_rank, cum_weights, user_ids, log):
+    if not options["history"]:
+        return
+    first_copies = dict(cur.execute("SELECT book_id, MIN(copy_id) FROM book_copies GROUP BY book_id"))
+    by_rank = [book_id for book_id in by_rank if book_id in first_copies]
+    rows = history_rows(
+        rng, options["history"], by_rank, cum_weights[: len(by_rank)], user_ids, first_copies
+    )
+    for batch in batched(rows, options["batch_size"]):
+        cur.executemany(
+            """INSERT INTO loans (copy_id, book_id, user_id, borrowed_date, due_date,
+                                  returned_date, overdue)
+               VALUES (?, ?, ?, ?, ?, ?, ?)""",
+            batch,
+        )
+        log(f"past loans: +{len(batch)}")
+
+
+def seed_library(
+    conn,
+    users=0,
+    books=20,
+    copies=3,
+    loans=0,
+    requests=0,
+    history=0,
+    keywords=0,
+    zipf=1.1,
+    seed=None,
+    batch_size=BATCH_SIZE,
+    bulk=False,
+    log=None,
+):
+    """Populate an initialized database in one transaction and return row
+    counts. `bulk` defers triggers and indexes (see deferred_schema) and is
+    meant for fresh files."""
+    rng = random.Random(seed)
+    log = log or (lambda message: None)
+    options = {
+        "books": books,
+        "copies": copies,
+        "loans": loans,
+        "requests": requests,
+        "history": history,
+        "keywords": keywords,
+        "zipf": zipf,
+        "batch_size": batch_size,
+    }
+
+    conn.execute("BEGIN")
+    try:
+        with deferred_schema(conn) if bulk else nullcontext():
+            cur = conn.cursor()
+            user_ids = insert_users(cur, rng, users, batch_size, log)
+            lent, by_rank, cum_weights = insert_books(cur, rng, options, user_ids, log)
+            insert_requests(cur, rng, options, lent, by_rank, cum_weights, user_ids, log)
+            insert_history(cur, rng, options, by_rank, cum_weights, user_ids, log)
+            if bulk:
+                log("building indexes, search index and summaries")
+        conn.commit()
+    except Exception:
         conn.rollback()
+        raise
+
+    return {
+        table: conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+        for table in ("users", "books", "book_copies", "book_requests", "loans")
+    }
+
+
+def open_fresh(path):
+    """Delete `path` and create an empty, migrated database tuned for loading"""
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+    init_db(path)
+    conn = connect(path)
+    for pragma in BULK_PRAGMAS:
+        conn.execute(pragma)
+    return conn
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate a synthetic library")
+    parser.add_argument("--db", default="data.db")
+    parser.add_argument("--fresh", action="store_true", help="recreate the file and bulk-load it")
+    parser.add_argument("--users", type=int, default=0, help="synthetic users on top of the 3 samples")
+    parser.add_argument("--books", type=int, default=20)
+    parser.add_argument("--copies", type=int, default=3, help="copies per book")
+    parser.add_argument("--loans", type=int, default=0, help="loans to draw by popularity")
+    parser.add_argument("--requests", type=int, default=0, help="waitlist entries")
+    parser.add_argument("--history", type=int, default=0, help="returned loans from the past year")
+    parser.add_argument("--keywords", type=int, default=0, help="synthetic keywords")
+    parser.add_argument("--zipf", type=float, default=1.1, help="popularity skew exponent")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--batch", type=int, default=BATCH_SIZE)
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    if args.fresh:
+        conn = open_fresh(args.db)
+    else:
+        init_db(args.db)
+        conn = connect(args.db)
+
+    counts = seed_library(
+        conn,
+        users=args.users,
+        books=args.books,
+        copies=args.copies,
+        loans=args.loans,
+        requests=args.requests,
+        history=args.history,
+        keywords=args.keywords,
+        zipf=args.zipf,
+        seed=args.seed,
+        batch_size=args.batch,
+        bulk=args.fresh,
+        log=print,
+    )
+
+    if args.fresh:
+        conn.execute("PRAGMA locking_mode = NORMAL")
+        conn.execute("ANALYZE")
+        conn.execute("PRAGMA journal_mode = WAL")
+    conn.close()
+
+    elapsed = time.perf_counter() - start
+    print(f"\n✅ {counts} in {elapsed:.1f}s")
+    print("\n👤 Sample users:")
+    print("   Admin: a / a")
+    print("   User 1: b / b (subscribed)")
+    print("   User 2: c / c (subscribed)")
+
 
-conn.commit()
-print("\n✅ Successfully inserted 3 users and 20 books with 3 copies each!")
-print("\n👤 Users created:")
-print("   Admin: a / a")
-print("   User 1: b / b (subscribed)")
-print("   User 2: c / c (subscribed)")
-conn.close()
+if __name__ == "__main__":
+    main()
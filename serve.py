@@ -0,0 +1,245 @@
+"""Production serving mode: the Flask app under an ASGI server.
+
+    python serve.py --port 5000 --threads 32 --readers 16 --writers 1
+
+The routes in backend.py run unchanged. Each request is handed to a
+bounded thread pool, so blocking sqlite calls never stall the event loop
+and at most --threads requests touch the database at once. GET/HEAD
+requests take connections from a pool of --readers connections. Anything
+that can write uses a dedicated pool of --writers connections (default
+1), which serializes writes in-process instead of contending for SQLite's
+lock. With --workers > 1, every process gets its own executor and pools.
+On SIGTERM/SIGINT uvicorn stops accepting connections and drains
+in-flight requests. The lifespan shutdown then joins the executor and
+closes the pools.
+
+GET /api/changes/stream is answered on the event loop itself (see
+changes.serve_asgi), so open change streams don't hold executor threads.
+On shutdown they are cut after the graceful timeout, and browsers
+reconnect and resume elsewhere.
+
+Requires uvicorn (pip install uvicorn).
+
+Throughput measured with loadgen.py: 32 connections, 10 s, the seeded
+20-book library, and a random mix of GET /api/books?limit=20,
+/api/books/search?q=the, /api/books/1/copies and /api/users/1/borrowed.
+The host was a single-core sandbox shared with the load generator:
+
+    server                                  req/s   p50 ms   p95 ms   p99 ms
+    python backend.py (dev server, debug)     507      62       77       86
+    python serve.py (1 worker, 32 threads)    484      64       81      100
+    python serve.py --workers 2               394      79      121      138
+
+On one core both servers are bound by Python CPU time, so this mode only
+matches the dev server. What it adds is bounded concurrency, no debugger
+or reloader, readers that never wait behind the write path for a
+connection, and graceful shutdown. --workers only helps on multi-core
+hosts, and should be sized to the core count.
+
+Re-run with:  python loadgen.py --url http://127.0.0.1:5000 --duration 10 --token <token>
+(/api/users/1/borrowed now needs user 1's or an admin's session token)
+"""
+
+import argparse
+import asyncio
+import io
+import logging
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+SERVE_THREADS = int(os.environ.get("LIBRARY_SERVE_THREADS", "32"))
+
+
+class WSGIBridge:
+    """ASGI application that runs a WSGI app on a bounded thread pool.
+
+    Each request runs start to finish on one executor thread, including
+    iterating a streamed body, so Flask's context locals stay valid. Body
+    chunks are handed back to the event loop as they are produced.
+    """
+
+    def __init__(self, wsgi_app, threads=SERVE_THREADS):
+        self.wsgi_app = wsgi_app
+        self.threads = threads
+        self.executor = None
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            await self.lifespan(receive, send)
+        elif scope["type"] == "http":
+            await self.handle(scope, receive, send)
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                self.start()
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                await asyncio.get_running_loop().run_in_executor(None, self.stop)
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    def start(self):
+        import scheduler
+
+        scheduler.init_app(self.wsgi_app)
+        if self.executor is None:
+            self.executor = ThreadPoolExecutor(
+                max_workers=self.threads, thread_name_prefix="library-db"
+            )
+
+    def stop(self):
+        from changes import hub
+        from database import close_pools
+        from scheduler import sweeper
+
+        sweeper.stop()
+        hub.stop()
+        if self.executor is not None:
+            self.executor.shutdown(wait=True)
+            self.executor = None
+        close_pools()
+
+    async def handle(self, scope, receive, send):
+        from changes import STREAM_PATH, serve_asgi
+
+        if scope["path"] == STREAM_PATH and scope["method"] == "GET":
+            # Long-lived; served on the event loop, not an executor thread
+            await serve_asgi(scope, receive, send)
+            return
+
+        body = []
+        more_body = True
+        while more_body:
+            message = await receive()
+            body.append(message.get("body", b""))
+            more_body = message.get("more_body", False)
+
+        self.start()
+        loop = asyncio.get_running_loop()
+        environ = build_environ(scope, b"".join(body))
+
+        def send_sync(message):
+            asyncio.run_coroutine_threadsafe(send(message), loop).result()
+
+        await loop.run_in_executor(
+            self.executor, self.run_request, environ, send_sync
+        )
+
+    def run_request(self, environ, send_sync):
+        state = {}
+
+        def start_response(status, headers, exc_info=None):
+            state["status"] = int(status.split(" ", 1)[0])
+            state["headers"] = [
+                (name.lower().encode("latin-1"), value.encode("latin-1"))
+                for name, value in headers
+            ]
+            return lambda data: None
+
+        def send_start():
+            if not state.get("started"):
+                state["started"] = True
+                send_sync(
+                    {
+                        "type": "http.response.start",
+                        "status": state["status"],
+                        "headers": state["headers"],
+                    }
+                )
+
+        result = self.wsgi_app(environ, start_response)
+        try:
+            for chunk in result:
+                send_start()
+                if chunk:
+                    send_sync(
+                        {"type": "http.response.body", "body": chunk, "more_body": True}
+                    )
+            send_start()
+            send_sync({"type": "http.response.body", "body": b""})
+        finally:
+            if hasattr(result, "close"):
+                result.close()
+
+
+def build_environ(scope, body):
+    """Translate an ASGI HTTP scope into a WSGI environ"""
+    server = scope.get("server") or ("localhost", 80)
+    client = scope.get("client") or ("", 0)
+    environ = {
+        "REQUEST_METHOD": scope["method"],
+        "SCRIPT_NAME": scope.get("root_path", "").encode("utf-8").decode("latin-1"),
+        "PATH_INFO": scope["path"].encode("utf-8").decode("latin-1"),
+        "QUERY_STRING": scope["query_string"].decode("latin-1"),
+        "SERVER_NAME": server[0],
+        "SERVER_PORT": str(server[1]),
+        "SERVER_PROTOCOL": f"HTTP/{scope['http_version']}",
+        "REMOTE_ADDR": client[0],
+        "REMOTE_PORT": str(client[1]),
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": scope.get("scheme", "http"),
+        "wsgi.input": io.BytesIO(body),
+        "wsgi.errors": sys.stderr,
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": True,
+        "wsgi.run_once": False,
+    }
+
+    for raw_name, raw_value in scope["headers"]:
+        name = raw_name.decode("latin-1").upper().replace("-", "_")
+        value = raw_value.decode("latin-1")
+        if name == "CONTENT_TYPE":
+            environ["CONTENT_TYPE"] = value
+        elif name == "CONTENT_LENGTH":
+            environ["CONTENT_LENGTH"] = value
+        else:
+            key = f"HTTP_{name}"
+            environ[key] = f"{environ[key]},{value}" if key in environ else value
+
+    return environ
+
+
+def create_app():
+    """uvicorn factory; pool sizes come from LIBRARY_DB_* in the environment"""
+    from backend import app
+
+    logging.getLogger().setLevel(logging.INFO)
+    return WSGIBridge(app, SERVE_THREADS)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve the library API over ASGI")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=5000)
+    parser.add_argument("--workers", type=int, default=1, help="server processes")
+    parser.add_argument("--threads", type=int, default=SERVE_THREADS, help="request threads per process")
+    parser.add_argument("--readers", type=int, default=16, help="reader connections per process")
+    parser.add_argument("--writers", type=int, default=1, help="writer connections per process")
+    parser.add_argument("--db", help="database file (defaults to LIBRARY_DB_PATH)")
+    args = parser.parse_args()
+
+    import uvicorn
+
+    # Read by database.py and create_app() in every worker process
+    os.environ["LIBRARY_SERVE_THREADS"] = str(args.threads)
+    os.environ["LIBRARY_DB_POOL_SIZE"] = str(args.readers)
+    os.environ["LIBRARY_DB_WRITERS"] = str(args.writers)
+    if args.db:
+        os.environ["LIBRARY_DB_PATH"] = args.db
+
+    uvicorn.run(
+        "serve:create_app",
+        factory=True,
+        host=args.host,
+        port=args.port,
+        workers=args.workers,
+        lifespan="on",
+        timeout_graceful_shutdown=30,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+"""Streaming JSON responses for list endpoints.
+
+Rows are pulled from the cursor in batches and written out as they are
+encoded, so memory stays flat and the first bytes leave before the query
+has finished. Clients that send Accept: application/x-ndjson get one
+object per line instead of a JSON array. orjson is used when installed.
+"""
+
+import json
+
+from flask import Response, request, stream_with_context
+
+try:
+    import orjson
+except ImportError:  # optional faster encoder
+    orjson = None
+
+NDJSON = "application/x-ndjson"
+FETCH_BATCH = 500
+
+
+def dumps(obj):
+    """Encode one object to JSON bytes"""
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj, separators=(",", ":")).encode()
+
+
+def wants_ndjson():
+    return request.accept_mimetypes.best_match(["application/json", NDJSON]) == NDJSON
+
+
+def stream_rows(cursor, transform=None, batch_size=FETCH_BATCH):
+    """Stream an executed cursor as a JSON array, or NDJSON on request.
+
+    `transform` receives each batch as a list of dicts and returns the
+    objects to emit, e.g. to fill in lookup names.
+    """
+    ndjson = wants_ndjson()
+
+    def generate():
+        first = True
+        if not ndjson:
+            yield b"["
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            items = [dict(row) for row in rows]
+            if transform:
+                items = transform(items)
+            if ndjson:
+                yield b"".join(dumps(item) + b"\n" for item in items)
+            else:
+                chunk = b",".join(dumps(item) for item in items)
+                yield chunk if first else b"," + chunk
+                first = False
+        if not ndjson:
+            yield b"]"
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype=NDJSON if ndjson else "application/json",
+    )
@@ -0,0 +1,103 @@
+"""Borrow/return throughput under concurrent load.
+
+Runs against a throwaway database, never data.db:
+
+    python stress_borrow.py --threads 16 --ops 200
+
+Each thread borrows and returns its own copy in a loop. The race check
+(one winner per copy) lives in tests/test_concurrency.py.
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+
+import database
+from benchmark import session_headers
+
+
+def seed(path, users, copies):
+    conn = database.connect(path)
+    conn.executemany(
+        """INSERT INTO users (fname, lname, age, state, username, email, password, address, phone)
+           VALUES ('Stress', 'User', 30, 'pro', ?, ?, 'x', 'n/a', 'n/a')""",
+        [(f"stress{i}", f"stress{i}@example.com") for i in range(users)],
+    )
+    conn.execute("INSERT INTO publishers (name) VALUES ('Stress Press')")
+    conn.execute(
+        """INSERT INTO books (catalog_code, title, publisher_id, poster)
+           VALUES ('STRESS', 'Stress Test', 1, '')"""
+    )
+    conn.executemany(
+        "INSERT INTO book_copies (book_id, location, publisher_id) VALUES (1, 'Stress', 1)",
+        [()] * copies,
+    )
+    conn.commit()
+    conn.close()
+
+
+def measure_throughput(app, threads, ops_per_thread):
+    """Each thread borrows and returns its own copy in a loop"""
+    errors = []
+
+    def worker(user_id):
+        client = app.test_client()
+        headers = session_headers(user_id)
+        conn = database.connect()
+        copy_id = user_id + 1
+        for _ in range(ops_per_thread):
+            res = client.post(
+                f"/api/books/copies/{copy_id}/borrow", json={"user_id": user_id},
+                headers=headers,
+            )
+            if res.status_code != 200:
+                errors.append(res.status_code)
+            res = client.post(
+                f"/api/books/copies/{copy_id}/return", headers=headers
+            )
+            if res.status_code != 200:
+                errors.append(res.status_code)
+            # Keep the copy from being retired by state decay
+            conn.execute("UPDATE book_copies SET state = 100 WHERE copy_id = ?", (copy_id,))
+            conn.commit()
+        conn.close()
+
+    start = time.perf_counter()
+    run_threads(worker, threads)
+    elapsed = time.perf_counter() - start
+    return threads * ops_per_thread / elapsed, errors
+
+
+def run_threads(target, count):
+    workers = [threading.Thread(target=target, args=(i + 1,)) for i in range(count)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--threads", type=int, default=16)
+    parser.add_argument("--ops", type=int, default=100, help="borrow/return pairs per thread")
+    args = parser.parse_args()
+
+    path = os.path.join(tempfile.mkdtemp(prefix="library-stress-"), "stress.db")
+    database.configure_db(path, pool_size=args.threads)
+    database.init_db(path)
+    seed(path, users=args.threads, copies=args.threads + 1)
+
+    from backend import app
+
+    rate, errors = measure_throughput(app, args.threads, args.ops)
+    print(f"throughput: {rate:.0f} borrow+return pairs/s, errors={len(errors)}")
+
+    if errors:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
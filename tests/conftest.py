@@ -0,0 +1,132 @@
+"""Shared fixtures. The whole session runs against one throwaway database,
+set up before backend is imported (importing it migrates the database)."""
+
+import itertools
+import os
+import sys
+import tempfile
+
+import pytest
+from flask.testing import FlaskClient
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+os.environ["LIBRARY_DB_PATH"] = os.path.join(tempfile.mkdtemp(prefix="library-tests-"), "test.db")
+os.environ.setdefault("LIBRARY_PASSWORD_COST", "10")
+os.environ.setdefault("LIBRARY_LOGIN_IP_BURST", "1000")
+
+import database  # noqa: E402
+
+_ids = itertools.count(1)
+
+
+class BufferedClient(FlaskClient):
+    """Reads and closes every response, streamed ones included. An open
+    stream would keep its app context (and g) alive into the next request."""
+
+    def open(self, *args, **kwargs):
+        kwargs.setdefault("buffered", True)
+        return super().open(*args, **kwargs)
+
+
+@pytest.fixture(scope="session")
+def app():
+    import backend
+
+    backend.app.config["TESTING"] = True
+    backend.app.test_client_class = BufferedClient
+    return backend.app
+
+
+@pytest.fixture(scope="session")
+def client(app):
+    return app.test_client()
+
+
+@pytest.fixture
+def make_user(client):
+    def make_user():
+        n = next(_ids)
+        response = client.post(
+            "/api/users",
+            json={
+                "fname": "Test",
+                "lname": f"User {n}",
+                "age": 30,
+                "state": "student",
+                "username": f"user{n}",
+                "email": f"user{n}@example.com",
+                "password": "secret",
+                "address": "1 Main St",
+                "phone": "555-0100",
+                "role": "user",
+            },
+        )
+        assert response.status_code == 201, response.get_json()
+        return login(client, f"user{n}@example.com")
+
+    return make_user
+
+
+def login(client, email):
+    """The user's profile, plus the headers that authenticate as them"""
+    response = client.post("/api/login", json={"email": email, "password": "secret"}).get_json()
+    return dict(response["user"], headers={"Authorization": f"Bearer {response['token']}"})
+
+
+@pytest.fixture(scope="session")
+def admin(client):
+    response = client.post(
+        "/api/users",
+        json={
+            "fname": "Test",
+            "lname": "Admin",
+            "age": 40,
+            "state": "pro",
+            "username": "admin",
+            "email": "admin@example.com",
+            "password": "secret",
+            "address": "1 Main St",
+            "phone": "555-0100",
+            "role": "user",
+        },
+    )
+    assert response.status_code == 201, response.get_json()
+    # Promoted in the database: only an admin can make an admin
+    conn = database.connect()
+    conn.execute("UPDATE users SET role = 'admin' WHERE email = 'admin@example.com'")
+    conn.commit()
+    conn.close()
+    return login(client, "admin@example.com")
+
+
+@pytest.fixture
+def make_book(client, admin):
+    def make_book(copies=1):
+        n = next(_ids)
+        response = client.post(
+            "/api/books",
+            headers=admin["headers"],
+            json={
+                "title": f"Test Book {n}",
+                "catCode": f"TEST-{n}",
+                "theme": "Testing",
+                "authors": ["A. Author"],
+                "publisher": "Test Press",
+                "poster": "poster.png",
+                "location": "Shelf A",
+            },
+        )
+        assert response.status_code == 201, response.get_json()
+        book_id = response.get_json()["book_id"]
+        for _ in range(copies - 1):
+            client.post(
+                f"/api/books/{book_id}/copies",
+                headers=admin["headers"],
+                json={"location": "Shelf A", "publisher": "Test Press"},
+            )
+        copies = client.get(f"/api/books/{book_id}/copies").get_json()
+        return book_id, [copy["copy_id"] for copy in copies]
+
+    return make_book
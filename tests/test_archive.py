@@ -0,0 +1,41 @@
+"""Archiving old loans waits for the recommendation job"""
+
+import database
+import recommend
+import scheduler
+
+
+def test_unfolded_loans_are_not_archived(client, admin, make_book, make_user, tmp_path):
+    _, (copy_id,) = make_book()
+    reader = make_user()
+    client.post(
+        f"/api/books/copies/{copy_id}/borrow",
+        headers=reader["headers"],
+        json={"user_id": reader["user_id"]},
+    )
+    client.post(f"/api/books/copies/{copy_id}/return", headers=reader["headers"])
+
+    conn = database.connect()
+    try:
+        conn.execute(
+            """UPDATE loans SET borrowed_date = '2001-03-01T10:00:00',
+               returned_date = '2001-03-10T10:00:00' WHERE copy_id = ?""",
+            (copy_id,),
+        )
+        conn.commit()
+        # Rewind the job to before this loan, as after a failed run
+        loan_id = conn.execute("SELECT loan_id FROM loans WHERE copy_id = ?", (copy_id,)).fetchone()[0]
+        conn.execute(
+            "INSERT OR REPLACE INTO recommend_state (name, value) VALUES ('last_loan_id', ?)",
+            (loan_id - 1,),
+        )
+        conn.commit()
+
+        assert scheduler.archive_loans(conn, directory=str(tmp_path)) == 0
+
+        recommend.update_recommendations(conn)
+        assert scheduler.archive_loans(conn, directory=str(tmp_path)) == 1
+        assert (tmp_path / "loans-2001.db").exists()
+        assert conn.execute("SELECT 1 FROM loans WHERE loan_id = ?", (loan_id,)).fetchone() is None
+    finally:
+        conn.close()
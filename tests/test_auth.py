@@ -0,0 +1,94 @@
+"""Who may call the user, loan and admin endpoints"""
+
+
+def test_token_required(client, make_user):
+    user = make_user()
+    assert client.get(f"/api/users/{user['user_id']}/borrowed").status_code == 401
+    response = client.get(
+        f"/api/users/{user['user_id']}/borrowed", headers={"Authorization": "Bearer forged"}
+    )
+    assert response.status_code == 401
+
+
+def test_users_see_only_their_own_data(client, admin, make_user):
+    user, other = make_user(), make_user()
+    own = client.get(f"/api/users/{user['user_id']}/requests", headers=user["headers"])
+    assert own.status_code == 200
+    theirs = client.get(f"/api/users/{other['user_id']}/requests", headers=user["headers"])
+    assert theirs.status_code == 403
+    as_admin = client.get(f"/api/users/{other['user_id']}/requests", headers=admin["headers"])
+    assert as_admin.status_code == 200
+
+
+def test_admin_endpoints(client, admin, make_user):
+    user = make_user()
+    assert client.get("/api/users", headers=user["headers"]).status_code == 403
+    assert client.get("/api/users", headers=admin["headers"]).status_code == 200
+    response = client.put(
+        f"/api/users/{user['user_id']}", headers=user["headers"], json={"role": "admin"}
+    )
+    assert response.status_code == 403
+
+
+def test_borrow_and_return_for_others(client, admin, make_book, make_user):
+    _, (copy_id,) = make_book()
+    user, other = make_user(), make_user()
+    response = client.post(
+        f"/api/books/copies/{copy_id}/borrow",
+        headers=user["headers"],
+        json={"user_id": other["user_id"]},
+    )
+    assert response.status_code == 403
+
+    response = client.post(
+        f"/api/books/copies/{copy_id}/borrow",
+        headers=admin["headers"],
+        json={"user_id": other["user_id"]},
+    )
+    assert response.status_code == 200
+    response = client.post(f"/api/books/copies/{copy_id}/return", headers=user["headers"])
+    assert response.status_code == 403
+    response = client.post(f"/api/books/copies/{copy_id}/return", headers=other["headers"])
+    assert response.status_code == 200
+
+
+def test_signup_cannot_create_admins(client):
+    response = client.post(
+        "/api/users",
+        json={
+            "fname": "Eve",
+            "lname": "Admin",
+            "age": 30,
+            "state": "pro",
+            "username": "eve",
+            "email": "eve@example.com",
+            "password": "secret",
+            "address": "n/a",
+            "phone": "n/a",
+            "role": "admin",
+        },
+    )
+    assert response.status_code == 403
+
+
+def test_login_does_not_reveal_accounts(client, make_user, monkeypatch):
+    import auth
+
+    user = make_user()
+    checked = []
+    check = auth.check_password_hash
+
+    def counted(stored, password):
+        checked.append(stored)
+        return check(stored, password)
+
+    monkeypatch.setattr(auth, "check_password_hash", counted)
+    wrong = client.post("/api/login", json={"email": user["email"], "password": "nope"})
+    unknown = client.post("/api/login", json={"email": "nobody@example.com", "password": "nope"})
+
+    assert wrong.get_json() == unknown.get_json() == {
+        "success": False,
+        "msg": "Invalid email or password",
+    }
+    # The unknown email ran the KDF too
+    assert len(checked) == 2
@@ -0,0 +1,54 @@
+"""Batch borrow and return at the circulation desk"""
+
+
+def post_batch(client, admin, action, body):
+    response = client.post(f"/api/books/copies/{action}:batch", headers=admin["headers"], json=body)
+    assert response.status_code == 200, response.get_json()
+    return response.get_json()
+
+
+def test_batch_borrow_and_return(client, admin, make_book, make_user):
+    book_id, (first, second, third) = make_book(copies=3)
+    reader, waiting = make_user(), make_user()
+
+    lent = post_batch(
+        client,
+        admin,
+        "borrow",
+        {"user_id": reader["user_id"], "copy_ids": [first, second, first, 10**9]},
+    )
+    assert (lent["borrowed"], lent["failed"]) == (2, 1)
+    assert [result["status"] for result in lent["results"]] == [200, 200, 404]
+
+    again = post_batch(client, admin, "borrow", {"user_id": reader["user_id"], "copy_ids": [first]})
+    assert again["results"][0]["status"] == 409
+
+    response = client.post(
+        f"/api/books/copies/{second}/request",
+        headers=waiting["headers"],
+        json={"user_id": waiting["user_id"]},
+    )
+    assert response.status_code == 201
+
+    returned = post_batch(client, admin, "return", {"copy_ids": [first, second, third]})
+    assert (returned["returned"], returned["auto_borrowed"], returned["failed"]) == (2, 1, 1)
+    assert [result["status"] for result in returned["results"]] == [200, 200, 409]
+
+    copies = {copy["copy_id"]: copy for copy in client.get(f"/api/books/{book_id}/copies").get_json()}
+    assert (copies[first]["is_available"], copies[first]["borrowed_by"]) == (1, None)
+    assert (copies[second]["is_available"], copies[second]["borrowed_by"]) == (0, waiting["user_id"])
+
+
+def test_batch_rejects_bad_bodies(client, admin, make_user):
+    reader = make_user()
+    for body in ({}, {"copy_ids": []}, {"copy_ids": ["1"]}, {"copy_ids": [True]}):
+        response = client.post(
+            "/api/books/copies/return:batch", headers=admin["headers"], json=body
+        )
+        assert response.status_code == 400
+    response = client.post(
+        "/api/books/copies/borrow:batch",
+        headers=reader["headers"],
+        json={"user_id": reader["user_id"], "copy_ids": [1]},
+    )
+    assert response.status_code == 403
@@ -0,0 +1,84 @@
+"""Keyset paging of the catalog listing and of search results"""
+
+import database
+
+
+def walk(client, url):
+    """Every book id over all pages of `url`, following next_cursor"""
+    ids, after = [], None
+    while True:
+        page = client.get(url + (f"&after={after}" if after else "")).get_json()
+        ids += [book["id"] for book in page["books"]]
+        after = page["next_cursor"]
+        if not after:
+            return ids
+
+
+def test_listing_pages_cover_the_catalog_once(client, make_book):
+    for _ in range(5):
+        make_book()
+    everything = client.get("/api/books?limit=200").get_json()["books"]
+    all_ids = [book["id"] for book in everything]
+
+    assert walk(client, "/api/books?limit=2") == all_ids
+    by_title = sorted(everything, key=lambda book: (book["title"], book["id"]), reverse=True)
+    assert walk(client, "/api/books?limit=3&sort=-title") == [book["id"] for book in by_title]
+
+
+def test_bare_listing_is_one_page(client, make_book):
+    make_book()
+    page = client.get("/api/books").get_json()
+    assert set(page) == {"books", "next_cursor"}
+    assert 0 < len(page["books"]) <= 50
+
+
+def test_invalid_cursor_is_rejected(client):
+    assert client.get("/api/books?after=not-a-cursor").status_code == 400
+    assert client.get("/api/books/search?q=test&after=not-a-cursor").status_code == 400
+
+
+def test_search_pages_and_fields(client, make_book):
+    book_ids = [make_book()[0] for _ in range(3)]
+    conn = database.connect()
+    conn.execute("UPDATE books SET title = 'Zyzzyva Field Guide' WHERE id = ?", (book_ids[0],))
+    conn.commit()
+    conn.close()
+
+    found = walk(client, "/api/books/search?q=test&limit=2")
+    assert len(found) == len(set(found))
+    assert set(book_ids) <= set(found)
+
+    titled = client.get("/api/books/search?q=zyzzyva&field=title").get_json()["books"]
+    assert [book["id"] for book in titled] == [book_ids[0]]
+    assert client.get("/api/books/search?q=zyzzyva&field=catalog_code").get_json()["books"] == []
+    assert client.get("/api/books/search?q=zyzzyva&field=poster").status_code == 400
+
+    themed = client.get("/api/books/search?q=zyzzyva&theme=Testing").get_json()["books"]
+    assert [book["id"] for book in themed] == [book_ids[0]]
+    assert client.get("/api/books/search?q=zyzzyva&theme=Poetry").get_json()["books"] == []
+    assert "Testing" in client.get("/api/themes").get_json()
+
+
+def test_listing_copy_counts_follow_circulation(client, admin, make_book, make_user):
+    book_id, (first, second) = make_book(copies=2)
+    reader = make_user()
+
+    def counts():
+        (book,) = [
+            book
+            for book in client.get("/api/books?limit=200&sort=-created_at").get_json()["books"]
+            if book["id"] == book_id
+        ]
+        return book["total_copies"], book["available_copies"]
+
+    assert counts() == (2, 2)
+    client.post(
+        f"/api/books/copies/{first}/borrow",
+        headers=reader["headers"],
+        json={"user_id": reader["user_id"]},
+    )
+    assert counts() == (2, 1)
+    client.delete(f"/api/books/copies/{second}", headers=admin["headers"])
+    assert counts() == (1, 0)
+    client.post(f"/api/books/copies/{first}/return", headers=reader["headers"])
+    assert counts() == (1, 1)
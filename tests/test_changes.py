@@ -0,0 +1,77 @@
+"""Who sees what on the change stream"""
+
+import json
+
+import pytest
+
+import changes
+import database
+
+
+@pytest.fixture
+def short_streams(monkeypatch):
+    monkeypatch.setattr(changes, "STREAM_TTL", 1.0)
+
+
+def latest_seq():
+    conn = database.connect()
+    try:
+        return conn.execute("SELECT COALESCE(MAX(seq), 0) FROM changes").fetchone()[0]
+    finally:
+        conn.close()
+
+
+def read_events(client, query):
+    response = client.get(f"/api/changes/stream?{query}")
+    assert response.status_code == 200, response.get_json()
+    return [
+        json.loads(line[len("data: ") :])
+        for line in response.get_data(as_text=True).splitlines()
+        if line.startswith("data: {\"")
+    ]
+
+
+def stream_token(client, user):
+    response = client.get("/api/changes/token", headers=user["headers"])
+    assert response.status_code == 200
+    return response.get_json()["token"]
+
+
+def test_public_stream_hides_the_reader(client, make_book, make_user, short_streams):
+    book_id, (copy_id,) = make_book()
+    reader = make_user()
+    since = latest_seq()
+    client.post(
+        f"/api/books/copies/{copy_id}/borrow",
+        headers=reader["headers"],
+        json={"user_id": reader["user_id"]},
+    )
+
+    (event,) = read_events(client, f"book_id={book_id}&since={since}")
+    assert event["kind"] == "copy_borrowed"
+    assert set(event) == set(changes.PUBLIC_FIELDS)
+
+
+def test_user_stream_needs_that_users_token(client, admin, make_book, make_user, short_streams):
+    _, (copy_id,) = make_book()
+    reader, other = make_user(), make_user()
+    since = latest_seq()
+    client.post(
+        f"/api/books/copies/{copy_id}/borrow",
+        headers=reader["headers"],
+        json={"user_id": reader["user_id"]},
+    )
+    query = f"user_id={reader['user_id']}&since={since}"
+
+    assert client.get(f"/api/changes/stream?{query}").status_code == 401
+    assert client.get(f"/api/changes/stream?{query}&token=forged").status_code == 401
+    denied = client.get(f"/api/changes/stream?{query}&token={stream_token(client, other)}")
+    assert denied.status_code == 403
+    # Session tokens aren't stream tokens
+    session_token = reader["headers"]["Authorization"][len("Bearer ") :]
+    assert client.get(f"/api/changes/stream?{query}&token={session_token}").status_code == 401
+
+    for viewer in (reader, admin):
+        (event,) = read_events(client, f"{query}&token={stream_token(client, viewer)}")
+        assert (event["kind"], event["user_id"]) == ("copy_borrowed", reader["user_id"])
+        assert "due_date" in event
@@ -0,0 +1,67 @@
+"""Concurrent borrows and returns of one copy: exactly one caller wins,
+every other one gets a 409. Throughput is measured by stress_borrow.py."""
+
+import threading
+
+import database
+
+THREADS = 8
+ROUNDS = 20
+
+
+def race(client_factory, threads, attempt):
+    """Run `attempt(client, index)` on `threads` threads released at the
+    same instant, returning the status codes"""
+    barrier = threading.Barrier(threads, timeout=30)
+    statuses = [None] * threads
+
+    def worker(index):
+        client = client_factory()
+        barrier.wait()
+        statuses[index] = attempt(client, index).status_code
+
+    workers = [threading.Thread(target=worker, args=(i,)) for i in range(threads)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    return statuses
+
+
+def test_one_winner_per_copy(app, admin, make_book, make_user):
+    _, (copy_id,) = make_book()
+    users = [make_user() for _ in range(THREADS)]
+    conn = database.connect()
+
+    try:
+        for _ in range(ROUNDS):
+            borrows = race(
+                app.test_client,
+                THREADS,
+                lambda client, i: client.post(
+                    f"/api/books/copies/{copy_id}/borrow",
+                    headers=users[i]["headers"],
+                    json={"user_id": users[i]["user_id"]},
+                ),
+            )
+            assert sorted(borrows) == [200] + [409] * (THREADS - 1)
+
+            returns = race(
+                app.test_client,
+                THREADS,
+                lambda client, i: client.post(
+                    f"/api/books/copies/{copy_id}/return", headers=admin["headers"]
+                ),
+            )
+            assert sorted(returns) == [200] + [409] * (THREADS - 1)
+
+            # Undo the wear of the return so the copy is never retired
+            conn.execute("UPDATE book_copies SET state = 100 WHERE copy_id = ?", (copy_id,))
+            conn.commit()
+
+        copy = conn.execute(
+            "SELECT is_available, borrowed_by FROM book_copies WHERE copy_id = ?", (copy_id,)
+        ).fetchone()
+        assert tuple(copy) == (1, None)
+    finally:
+        conn.close()
@@ -0,0 +1,78 @@
+"""ETags and cached bodies follow every table a response is built from"""
+
+import pytest
+
+import database
+
+
+@pytest.fixture
+def conn():
+    conn = database.connect()
+    yield conn
+    conn.close()
+
+
+def etag_of(client, url, headers=None):
+    response = client.get(url, headers=headers)
+    assert response.status_code == 200
+    return response.headers["ETag"]
+
+
+def revalidate(client, url, etag, headers=None):
+    return client.get(url, headers={**(headers or {}), "If-None-Match": etag})
+
+
+def test_unchanged_response_is_not_modified(client, make_book):
+    book_id, _ = make_book()
+    url = f"/api/books/{book_id}/copies"
+    assert revalidate(client, url, etag_of(client, url)).status_code == 304
+
+
+def test_user_lists_follow_the_book_title(client, make_book, make_user, conn):
+    book_id, (copy_id,) = make_book()
+    reader, waiting = make_user(), make_user()
+    client.post(
+        f"/api/books/copies/{copy_id}/borrow",
+        headers=reader["headers"],
+        json={"user_id": reader["user_id"]},
+    )
+    client.post(
+        f"/api/books/copies/{copy_id}/request",
+        headers=waiting["headers"],
+        json={"user_id": waiting["user_id"]},
+    )
+    lists = [
+        (f"/api/users/{reader['user_id']}/borrowed", reader["headers"]),
+        (f"/api/users/{reader['user_id']}/loans", reader["headers"]),
+        (f"/api/users/{waiting['user_id']}/requests", waiting["headers"]),
+    ]
+    etags = [etag_of(client, url, headers) for url, headers in lists]
+
+    conn.execute("UPDATE books SET title = 'Renamed Title' WHERE id = ?", (book_id,))
+    conn.commit()
+
+    for (url, headers), etag in zip(lists, etags):
+        response = revalidate(client, url, etag, headers)
+        assert response.status_code == 200, url
+        assert "Renamed Title" in response.get_data(as_text=True), url
+
+
+def test_copies_follow_the_publisher_name(client, make_book, conn):
+    book_id, _ = make_book()
+    url = f"/api/books/{book_id}/copies"
+    etag = etag_of(client, url)
+    publisher_id, name = conn.execute(
+        """SELECT p.id, p.name FROM book_copies bc JOIN publishers p ON p.id = bc.publisher_id
+           WHERE bc.book_id = ?""",
+        (book_id,),
+    ).fetchone()
+
+    conn.execute("UPDATE publishers SET name = 'Renamed Press' WHERE id = ?", (publisher_id,))
+    conn.commit()
+    try:
+        response = revalidate(client, url, etag)
+        assert response.status_code == 200
+        assert {copy["publisher"] for copy in response.get_json()} == {"Renamed Press"}
+    finally:
+        conn.execute("UPDATE publishers SET name = ? WHERE id = ?", (name, publisher_id))
+        conn.commit()
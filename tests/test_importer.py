@@ -0,0 +1,68 @@
+"""Bulk catalog import: bad rows are reported and skipped, the rest land
+with their copies, authors and keywords"""
+
+import io
+import json
+
+import database
+from importer import import_books, read_rows
+
+
+def book_row(code, **fields):
+    return {
+        "title": f"Imported {code}",
+        "catCode": code,
+        "theme": "Imports",
+        "publisher": "Import Press",
+        "authors": ["I. Porter"],
+        "keywords": ["imported"],
+        "poster": "poster.png",
+        "location": "Shelf I",
+        **fields,
+    }
+
+
+def test_jsonl_import_reports_bad_rows(app):
+    lines = [
+        json.dumps(book_row("IMP-1", copies=2)),
+        "{not json",
+        json.dumps(book_row("IMP-2", copies=0)),
+        json.dumps(book_row("IMP-1")),
+        json.dumps(book_row("IMP-3", title="")),
+        json.dumps(book_row("IMP-4", copies=-1)),
+        json.dumps(book_row("IMP-5")),
+    ]
+    conn = database.connect()
+    try:
+        report = import_books(conn, read_rows(io.StringIO("\n".join(lines)), "jsonl"), chunk_size=3)
+        copies = dict(
+            conn.execute(
+                """SELECT b.catalog_code, COUNT(bc.copy_id) FROM books b
+                   LEFT JOIN book_copies bc ON bc.book_id = b.id
+                   WHERE b.catalog_code LIKE 'IMP-%' GROUP BY b.id"""
+            ).fetchall()
+        )
+    finally:
+        conn.close()
+
+    assert (report["rows"], report["imported"], report["failed"]) == (7, 3, 4)
+    assert sorted(error["row"] for error in report["errors"]) == [2, 4, 5, 6]
+    assert report["errors"][0]["error"].startswith("Malformed JSON")
+    assert copies == {"IMP-1": 2, "IMP-2": 0, "IMP-5": 1}
+
+
+def test_csv_import_splits_names(client):
+    csv_text = (
+        "title,catCode,theme,publisher,authors,keywords,poster,location\n"
+        "CSV Book,IMP-CSV,Imports,Import Press,A. One; B. Two,alpha;beta,p.png,Shelf I\n"
+    )
+    conn = database.connect()
+    try:
+        report = import_books(conn, read_rows(io.StringIO(csv_text), "csv"))
+    finally:
+        conn.close()
+    assert report["imported"] == 1
+
+    (book,) = client.get("/api/books/search?q=IMP-CSV&field=catalog_code").get_json()["books"]
+    assert book["total_copies"] == 1
+    assert sorted(book["keywords"].split(",")) == ["alpha", "beta"]
@@ -0,0 +1,85 @@
+"""Copies can be filed under any branch or shelf, not just the default branch"""
+
+import json
+
+import database
+
+
+def add_location(client, admin, name, parent_id=None):
+    response = client.post(
+        "/api/locations", headers=admin["headers"], json={"name": name, "parent_id": parent_id}
+    )
+    assert response.status_code == 201, response.get_json()
+    return response.get_json()["location_id"]
+
+
+def test_copies_filed_by_location_id(client, admin, make_book):
+    branch = add_location(client, admin, "East branch")
+    shelf = add_location(client, admin, "East shelf 1", branch)
+    other_shelf = add_location(client, admin, "East shelf 2", branch)
+    book_id, _ = make_book()
+
+    response = client.post(
+        f"/api/books/{book_id}/copies",
+        headers=admin["headers"],
+        json={"location_id": shelf, "publisher": "Test Press"},
+    )
+    assert response.status_code == 201
+    copy_id = response.get_json()["copy_id"]
+
+    availability = client.get(f"/api/books/{book_id}/availability?branch_id={branch}").get_json()
+    first = availability["locations"][0]
+    assert (first["location_id"], first["branch_id"]) == (shelf, branch)
+
+    response = client.put(
+        f"/api/books/copies/{copy_id}", headers=admin["headers"], json={"location_id": other_shelf}
+    )
+    assert response.status_code == 200
+    assert response.get_json()["location_id"] == other_shelf
+    assert response.get_json()["location"] == "East shelf 2"
+
+    # Free text alone still goes under the default branch
+    response = client.put(
+        f"/api/books/copies/{copy_id}", headers=admin["headers"], json={"location": "Shelf Z"}
+    )
+    locations = {loc["id"]: loc for loc in client.get("/api/locations").get_json()}
+    moved = locations[response.get_json()["location_id"]]
+    assert moved["name"] == "Shelf Z" and moved["parent_id"] != branch
+
+
+def test_unknown_location_id(client, admin, make_book):
+    book_id, (copy_id,) = make_book()
+    response = client.post(
+        f"/api/books/{book_id}/copies",
+        headers=admin["headers"],
+        json={"location_id": 999999, "publisher": "Test Press"},
+    )
+    assert response.status_code == 404
+    response = client.put(
+        f"/api/books/copies/{copy_id}", headers=admin["headers"], json={"location_id": 999999}
+    )
+    assert response.status_code == 404
+
+
+def test_copy_added_event_has_location_id(client, admin, make_book):
+    book_id, _ = make_book()
+    for body in ({"location": "Brand new shelf"}, {"location": "Shelf A"}):
+        response = client.post(
+            f"/api/books/{book_id}/copies",
+            headers=admin["headers"],
+            json={**body, "publisher": "Test Press"},
+        )
+        copy_id = response.get_json()["copy_id"]
+
+        conn = database.connect()
+        try:
+            payload, location_id = conn.execute(
+                """SELECT c.payload, bc.location_id FROM changes c
+                   JOIN book_copies bc ON bc.copy_id = c.copy_id
+                   WHERE c.kind = 'copy_added' AND c.copy_id = ?""",
+                (copy_id,),
+            ).fetchone()
+        finally:
+            conn.close()
+        assert location_id is not None
+        assert json.loads(payload)["location_id"] == location_id
@@ -0,0 +1,110 @@
+"""The queries behind the circulation endpoints must be answered from
+indexes. Each test calls an endpoint on the freshly migrated database,
+records the statements it ran and checks them with find_full_scans."""
+
+import pytest
+
+import database
+
+CHECKED = ("SELECT", "WITH", "UPDATE", "DELETE")
+
+
+def find_full_scans(conn, query, params=()):
+    """Return the EXPLAIN QUERY PLAN steps of a query that scan a whole table
+    without an index. Scans of a subquery's own result (e.g. a window
+    function's) don't count."""
+    plan = conn.execute(f"EXPLAIN QUERY PLAN {query}", params).fetchall()
+    return [
+        row[3]
+        for row in plan
+        if row[3].startswith("SCAN")
+        and "USING" not in row[3]
+        and "CONSTANT ROW" not in row[3]
+        and not row[3].startswith("SCAN (subquery")
+    ]
+
+
+@pytest.fixture
+def statements(monkeypatch):
+    """The SQL run by the app (parameters filled in) while the test runs"""
+    seen = []
+    connect = database.connect
+
+    def traced(path=None):
+        conn = connect(path)
+        conn.set_trace_callback(seen.append)
+        return conn
+
+    monkeypatch.setattr(database, "connect", traced)
+    database.configure_db()
+    yield seen
+    monkeypatch.undo()
+    database.configure_db()
+
+
+def assert_indexed(statements):
+    queries = {sql for sql in statements if sql.lstrip().split(None, 1)[0].upper() in CHECKED}
+    assert queries
+    conn = database.connect()
+    try:
+        scans = {sql: find_full_scans(conn, sql) for sql in queries}
+    finally:
+        conn.close()
+    assert {sql: steps for sql, steps in scans.items() if steps} == {}
+
+
+@pytest.fixture
+def queued_copy(client, make_book, make_user):
+    """A lent copy with two readers waiting for it"""
+    _, (copy_id,) = make_book()
+    borrower, first, second = make_user(), make_user(), make_user()
+    client.post(
+        f"/api/books/copies/{copy_id}/borrow",
+        headers=borrower["headers"],
+        json={"user_id": borrower["user_id"]},
+    )
+    for user in (first, second):
+        response = client.post(
+            f"/api/books/copies/{copy_id}/request",
+            headers=user["headers"],
+            json={"user_id": user["user_id"]},
+        )
+        assert response.status_code == 201
+    return copy_id, borrower, first
+
+
+def test_book_copies(client, make_book, statements):
+    book_id, _ = make_book(copies=3)
+    statements.clear()
+    assert client.get(f"/api/books/{book_id}/copies").status_code == 200
+    assert_indexed(statements)
+
+
+def test_user_borrowed_books(client, queued_copy, statements):
+    _, borrower, _ = queued_copy
+    response = client.get(f"/api/users/{borrower['user_id']}/borrowed", headers=borrower["headers"])
+    assert response.status_code == 200
+    assert_indexed(statements)
+
+
+def test_user_requests(client, queued_copy, statements):
+    _, _, first = queued_copy
+    response = client.get(f"/api/users/{first['user_id']}/requests", headers=first["headers"])
+    assert response.status_code == 200
+    assert_indexed(statements)
+
+
+def test_copy_requests(client, admin, queued_copy, statements):
+    copy_id, _, _ = queued_copy
+    response = client.get(f"/api/books/copies/{copy_id}/requests", headers=admin["headers"])
+    assert response.status_code == 200
+    assert_indexed(statements)
+
+
+def test_return_hands_copy_to_queue(client, queued_copy, statements):
+    copy_id, borrower, first = queued_copy
+    response = client.post(f"/api/books/copies/{copy_id}/return", headers=borrower["headers"])
+    assert response.status_code == 200
+    borrowed = client.get(f"/api/users/{first['user_id']}/borrowed", headers=first["headers"]).get_json()
+    assert [copy["copy_id"] for copy in borrowed] == [copy_id]
+    assert_indexed(statements)
@@ -0,0 +1,95 @@
+"""Folding loans into the recommendation tables"""
+
+import threading
+from datetime import datetime, timedelta
+
+import pytest
+
+import database
+import recommend
+
+
+def add_loans(conn, book_id, copy_id, user_ids, borrowed_date):
+    conn.executemany(
+        """INSERT INTO loans (copy_id, book_id, user_id, borrowed_date, returned_date)
+           VALUES (?, ?, ?, ?, ?)""",
+        [(copy_id, book_id, user_id, borrowed_date, borrowed_date) for user_id in user_ids],
+    )
+    conn.commit()
+
+
+def test_concurrent_sweeps_fold_each_loan_once(make_book, make_user, monkeypatch):
+    book_id, (copy_id,) = make_book()
+    readers = [make_user()["user_id"] for _ in range(3)]
+    conn = database.connect()
+    try:
+        recommend.update_recommendations(conn)
+        add_loans(conn, book_id, copy_id, readers * 4, "2026-01-05T10:00:00")
+
+        # Hold each sweep right after it reads the high-water mark, so both
+        # read it before either commits a batch. A sweep that reads it
+        # under the write lock keeps the other one out; the barrier then
+        # times out and the sweeps run one after the other.
+        barrier = threading.Barrier(2, timeout=0.5)
+        get_state = recommend.get_state
+
+        def held_get_state(conn, name, default=None):
+            value = get_state(conn, name, default)
+            if name == "last_loan_id":
+                try:
+                    barrier.wait()
+                except threading.BrokenBarrierError:
+                    pass
+            return value
+
+        monkeypatch.setattr(recommend, "get_state", held_get_state)
+
+        def sweep():
+            own = database.connect()
+            recommend.update_recommendations(own, batch_size=5)
+            own.close()
+
+        workers = [threading.Thread(target=sweep) for _ in range(2)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+
+        row = conn.execute(
+            "SELECT readers, loan_score FROM book_popularity WHERE book_id = ?", (book_id,)
+        ).fetchone()
+        weight = recommend.decay_factor(
+            recommend.parse_time("2026-01-05T10:00:00"), recommend.get_epoch(conn)
+        )
+        assert row["readers"] == 3
+        assert row["loan_score"] == pytest.approx(12 * weight)
+    finally:
+        conn.close()
+
+
+def test_short_half_life_rebases_instead_of_overflowing(make_book, make_user, monkeypatch):
+    # Thousands of half-lives after EPOCH: 2 ** that overflows a float
+    monkeypatch.setattr(recommend, "HALF_LIFE_DAYS", 1.0)
+    book_id, (copy_id,) = make_book()
+    reader, other = make_user()["user_id"], make_user()["user_id"]
+    now = datetime(2026, 6, 1, 12, 0)
+    conn = database.connect()
+    try:
+        add_loans(conn, book_id, copy_id, [reader], (now - timedelta(days=1)).isoformat())
+        add_loans(conn, book_id, copy_id, [other], now.isoformat())
+
+        def score(at):
+            recommend.update_recommendations(conn, now=at)
+            stored = conn.execute(
+                "SELECT score FROM book_popularity WHERE book_id = ?", (book_id,)
+            ).fetchone()[0]
+            return recommend.current_score(stored, conn)
+
+        assert score(now) == pytest.approx(1.5)
+        assert recommend.get_epoch(conn) == now
+        assert score(now + timedelta(days=1)) == pytest.approx(0.75)
+        # Far enough on to move the epoch again
+        assert score(now + timedelta(days=300)) == pytest.approx(1.5 * 2**-300)
+        assert recommend.get_epoch(conn) == now + timedelta(days=300)
+    finally:
+        conn.close()
@@ -0,0 +1,28 @@
+"""Joining a copy's waiting queue"""
+
+
+def test_request_errors(client, admin, make_book, make_user):
+    _, (copy_id,) = make_book()
+    borrower, reader = make_user(), make_user()
+    client.post(
+        f"/api/books/copies/{copy_id}/borrow",
+        headers=borrower["headers"],
+        json={"user_id": borrower["user_id"]},
+    )
+
+    def request_copy(user_id, headers):
+        return client.post(
+            f"/api/books/copies/{copy_id}/request", headers=headers, json={"user_id": user_id}
+        )
+
+    first = request_copy(reader["user_id"], reader["headers"])
+    assert first.status_code == 201
+    assert first.get_json()["position"] == 1
+
+    again = request_copy(reader["user_id"], reader["headers"])
+    assert again.status_code == 409
+    assert again.get_json()["error"] == "You already requested this copy"
+
+    unknown = request_copy(999999, admin["headers"])
+    assert unknown.status_code == 404
+    assert unknown.get_json()["error"] == "User not found"
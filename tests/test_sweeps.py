@@ -0,0 +1,89 @@
+"""The scheduler's overdue, request expiry and changes feed sweeps"""
+
+from datetime import datetime, timedelta
+
+import pytest
+
+import database
+import scheduler
+
+
+@pytest.fixture
+def conn():
+    conn = database.connect()
+    yield conn
+    conn.close()
+
+
+def lend_with_queue(client, make_book, make_user, due_date):
+    """A copy lent until `due_date` with one reader waiting for it"""
+    _, (copy_id,) = make_book()
+    borrower, waiting = make_user(), make_user()
+    client.post(
+        f"/api/books/copies/{copy_id}/borrow",
+        headers=borrower["headers"],
+        json={"user_id": borrower["user_id"]},
+    )
+    response = client.post(
+        f"/api/books/copies/{copy_id}/request",
+        headers=waiting["headers"],
+        json={"user_id": waiting["user_id"]},
+    )
+    assert response.status_code == 201
+    conn = database.connect()
+    conn.execute(
+        "UPDATE book_copies SET due_date = ? WHERE copy_id = ?", (due_date.isoformat(), copy_id)
+    )
+    conn.commit()
+    conn.close()
+    return copy_id, borrower, waiting
+
+
+def notifications(conn, user_id):
+    return [
+        (row["kind"], row["copy_id"])
+        for row in conn.execute(
+            "SELECT kind, copy_id FROM notifications WHERE user_id = ? ORDER BY id", (user_id,)
+        )
+    ]
+
+
+def test_overdue_copies_are_flagged_once(client, make_book, make_user, conn):
+    now = datetime.now()
+    copy_id, borrower, _ = lend_with_queue(client, make_book, make_user, now - timedelta(days=1))
+
+    assert scheduler.sweep_overdue(conn, now=now) >= 1
+    assert scheduler.sweep_overdue(conn, now=now) == 0
+    overdue = conn.execute("SELECT overdue FROM book_copies WHERE copy_id = ?", (copy_id,)).fetchone()
+    assert overdue[0] == 1
+    assert notifications(conn, borrower["user_id"]) == [("overdue", copy_id)]
+
+
+def test_requests_on_long_overdue_copies_expire(client, make_book, make_user, conn):
+    now = datetime.now()
+    lost_id, _, stranded = lend_with_queue(client, make_book, make_user, now - timedelta(days=45))
+    late_id, _, queued = lend_with_queue(client, make_book, make_user, now - timedelta(days=2))
+    scheduler.sweep_overdue(conn, now=now)
+
+    assert scheduler.expire_requests(conn, now=now, ttl_days=30) == 1
+    assert scheduler.expire_requests(conn, now=now, ttl_days=30) == 0
+
+    waiting = {
+        row[0]
+        for row in conn.execute(
+            "SELECT copy_id FROM book_requests WHERE status = 'waiting' AND copy_id IN (?, ?)",
+            (lost_id, late_id),
+        )
+    }
+    assert waiting == {late_id}
+    assert notifications(conn, stranded["user_id"]) == [("request_expired", lost_id)]
+    assert notifications(conn, queued["user_id"]) == []
+
+
+def test_old_changes_are_pruned(client, make_book, conn):
+    make_book()
+    latest = conn.execute("SELECT MAX(seq) FROM changes").fetchone()[0]
+
+    assert scheduler.prune_changes(conn, now=datetime.utcnow() - timedelta(hours=48)) == 0
+    assert scheduler.prune_changes(conn, now=datetime.utcnow() + timedelta(hours=48)) >= 1
+    assert conn.execute("SELECT COUNT(*) FROM changes WHERE seq <= ?", (latest,)).fetchone()[0] == 0